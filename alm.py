@@ -1,112 +1,347 @@
-import math
+from functools import partial
 import numpy as np
 import pandas as pd
 import streamlit as st
 import altair as alt
+import shortrate
+import surplus
+import utils
 
 
-def cir(years: float, a: float, b: float, sigma: float, init: float, scenarios: int = 1, steps_per_year: int = 12) -> tuple[pd.DataFrame, pd.DataFrame]:
-    """Cox-Ingersoll-Ross model for interest rate simulation
+percentiles = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+
+models = {
+    'CIR': shortrate.CIR,
+    'Vasicek': shortrate.Vasicek,
+    'Hull-White': shortrate.HullWhite,
+    'Black-Karasinski': shortrate.BlackKarasinski,
+    'G2++': shortrate.G2,
+}
+
+fitted = ['Hull-White', 'G2++']
+
+candidates = [1, 2, 3, 5, 7, 10, 15, 20, 30, 40]
+
+
+def build(model: str, params: tuple, curve: tuple = None) -> shortrate.Model:
+    """Model from its name, its parameters and, for the fitted models, the curve"""
+    if model in fitted:
+        params = params + (shortrate.Curve(*curve),)
+    return models[model](*params)
+
+
+@st.cache_data(ttl=3600)
+def get_curve(region: str) -> tuple[tuple, tuple]:
+    """Latest tenors and continuously compounded zero rates of a region"""
+    yc = utils.get_region_yield_curve(region)
+    latest = yc[yc['Date'] == yc['Date'].max()].sort_values('Maturity')
+    return tuple(latest['Maturity'].astype(float)), tuple(np.log1p(latest['Bond Yield'].div(100)))
+
+
+@st.cache_data(show_spinner='Calibrating...')
+def calibrate(model: str, tenors: tuple, rates: tuple) -> tuple:
+    """Constant parameters (a, b, sigma, init) of CIR or Vasicek fitted to a curve"""
+    fit = shortrate.calibrate(models[model], shortrate.Curve(tenors, rates),
+                              x0=[0.5, rates[-1], 0.01, rates[0]],
+                              bounds=([1e-3, -0.05, 0., -0.05], [10., 0.2, 0.5, 0.2]) if model == 'Vasicek'
+                              else ([1e-3, 0., 0., 0.], [10., 0.2, 0.5, 0.2]))
+    return fit.a, fit.b, fit.sigma, fit.init
+
+
+@st.cache_data(max_entries=16, show_spinner='Simulating scenarios...')
+def simulate(model: str, params: tuple, years: float, scenarios: int = 1, steps_per_year: int = 12, seed: int = None, curve: tuple = None, dtype=np.float64) -> tuple[pd.DataFrame, pd.DataFrame, float]:
+    """Interest rate simulation with a short-rate model
+
+    The scenarios are summarized while they are simulated, so the memory does
+    not grow with their number.
 
     Parameters
     ----------
+    model : str
+        Name of the model in `models`
+    params : tuple
+        Parameters of the model, without the curve
     years : float
         Number of years
-    a : float
-        Speed of mean reversion
-    b : float
-        Long-term average rate
-    sigma : float
-        Annualized volatility
-    init : float
-        Initial rate
     scenarios : int, optional
         Number of simulations, by default 1
     steps_per_year : int, optional
         Steps per year, by default 12
+    seed : int, optional
+        Seed of the random number generator, by default None
+    curve : tuple, optional
+        Tenors and zero rates of the initial curve, for the fitted models
+    dtype : optional
+        Precision of the paths, by default np.float64
 
     Returns
     -------
-    tuple[pd.DataFrame, pd.DataFrame]
-        Rates, and zero-coupon bond prices
+    tuple[pd.DataFrame, pd.DataFrame, float]
+        Percentiles, mean and a few sample paths of the rates, and of the
+        zero-coupon bond prices, by time, and the share clipped as in
+        `fan_frames`
     """
+    instance = build(model, params, curve)
+    fan = shortrate.simulate(instance, years, scenarios=scenarios, steps_per_year=steps_per_year,
+                             seed=seed, dtype=dtype, workers=None if scenarios >= 100_000 else 1,
+                             summary=fan_summary(instance, years))
+    return fan_frames(fan, steps_per_year)
 
-    init = np.log1p(init)
-    dt = 1/steps_per_year
-    n = int(years * steps_per_year) + 1
 
-    shock = np.random.normal(0, scale=np.sqrt(dt), size=(n, scenarios))
-    rates = np.empty_like(shock)
-    rates[0] = init
+def fan_summary(instance: shortrate.Model, years: float) -> partial:
+    """Factory of the fan of the rates, whose sketch covers the likely range of the model"""
+    return partial(shortrate.Fan, rates=tuple(np.expm1(instance.interval(years))))
 
-    h = math.sqrt(a**2 + 2*sigma**2)
-    prices = np.empty_like(shock)
 
-    def price(ttm, r):
-        _A = ((2*h*math.exp((h+a)*ttm/2)) /
-              (2*h+(h+a)*(math.exp(h*ttm)-1)))**(2*a*b/sigma**2)
-        _B = (2*(math.exp(h*ttm)-1))/(2*h + (h+a)*(math.exp(h*ttm)-1))
-        _P = _A*np.exp(-_B*r)
-        return _P
+def fan_frames(fan: shortrate.Fan, steps_per_year: int) -> tuple[pd.DataFrame, pd.DataFrame, float]:
+    """Percentiles, mean and sample paths of the rates, and of the bond prices, by time
+
+    Also returns the largest share of the rates or bond prices of a step
+    outside the range of their sketch.
+    """
+    frames = []
+    for quantile, mean, sample in zip(fan.quantile(percentiles), fan.mean(), (fan.sample_rates, fan.sample_prices)):
+        frames.append(pd.concat([
+            pd.DataFrame(quantile.T, columns=[f'P{p * 100:.0f}' for p in percentiles]),
+            pd.DataFrame({'Mean': mean}),
+            pd.DataFrame(sample).add_prefix('Path ')], axis=1
+        ).set_axis(np.arange(len(mean)) / steps_per_year))
+    return *frames, float(max(share.max() for share in fan.clipped()))
 
-    prices[0] = price(years, init)
 
-    for step in range(1, n):
-        r_t = rates[step-1]
-        d_r_t = a*(b-r_t)*dt + sigma*np.sqrt(r_t)*shock[step]
-        rates[step] = abs(r_t + d_r_t)
-        prices[step] = price(years-step*dt, rates[step])
+@st.cache_data(max_entries=16, show_spinner='Simulating surplus...')
+def funding(model: str, params: tuple, years: float, scenarios: int, steps_per_year: int, seed: int, curve: tuple, liabilities: tuple, cash: float, equity: float, faces: tuple, premium: float, vol: float) -> tuple[pd.DataFrame, ...]:
+    """Funding ratio of the liabilities over the same scenarios as `simulate`
 
-    rates = pd.DataFrame(data=np.expm1(rates), index=np.arange(n) * dt)
-    prices = pd.DataFrame(data=prices, index=np.arange(n) * dt)
-    return rates, prices
+    The rates and bond prices of `simulate` are summarized in the same pass,
+    so the scenarios are only simulated once.
+
+    Parameters
+    ----------
+    model, params, years, scenarios, steps_per_year, seed, curve
+        As in `simulate`
+    liabilities : tuple
+        Payment times and amounts of the liabilities
+    cash : float
+        Initial cash
+    equity : float
+        Initial equity
+    faces : tuple
+        Face amounts of the zero-coupon bonds maturing at `candidates`
+    premium : float
+        Equity risk premium
+    vol : float
+        Equity volatility
+
+    Returns
+    -------
+    tuple[pd.DataFrame, ...]
+        Rates, bond prices and share clipped as in `simulate`, percentiles,
+        mean and sample paths of the funding ratio, probability of shortfall
+        by time, and distribution and median of the surplus at the horizon
+    """
+    maturities, flows = surplus.align(*liabilities, steps_per_year)
+    bonds, paid = surplus.align(candidates, faces, steps_per_year)
+    instance = build(model, params, curve)
+    summary = partial(surplus.Surplus, maturities, flows, cash=cash, equity=equity,
+                      bonds=bonds, faces=paid, premium=premium, vol=vol, fan=fan_summary(instance, years))
+    result = shortrate.simulate(instance, years, scenarios=scenarios, steps_per_year=steps_per_year,
+                                seed=seed, workers=None if scenarios >= 100_000 else 1, summary=summary)
+
+    time = np.arange(len(result.mean())) / steps_per_year
+    fan = pd.concat([
+        pd.DataFrame(result.quantile(percentiles).T, columns=[f'P{p * 100:.0f}' for p in percentiles]),
+        pd.DataFrame({'Mean': result.mean()}),
+        pd.DataFrame(result.sample_funding).add_prefix('Path ')], axis=1).set_axis(time)
+    shortfall, underfunded = result.probability()
+    probability = pd.DataFrame({'At the time': shortfall, 'At any time until': underfunded}, index=time)
+    edges, frequency = result.distribution()
+    distribution = pd.DataFrame({'From': edges[:-1], 'To': edges[1:], 'Frequency': frequency})
+    return *fan_frames(result.fan, steps_per_year), fan, probability, distribution, float(np.median(result.terminal()))
+
+
+def fan_chart(df: pd.DataFrame, title: str, format: str = '') -> alt.LayerChart:
+    """Percentile bands, median, mean and sample paths"""
+    data = df.reset_index(names='Time')
+    x = alt.X('Time', axis=alt.Axis(tickMinStep=1, title='Time'))
+    base = alt.Chart(data).encode(x=x)
+    paths = alt.Chart(data.melt(id_vars='Time', value_vars=[c for c in df.columns if c.startswith('Path')],
+                                var_name='c', value_name='y')).mark_line(opacity=0.4, strokeWidth=1).encode(
+        x=x,
+        y='y',
+        color=alt.Color('c', legend=None)
+    )
+    return (base.mark_area(opacity=0.2).encode(y=alt.Y('P5', axis=alt.Axis(title=title, format=format)), y2='P95')
+            + base.mark_area(opacity=0.3).encode(y='P25', y2='P75')
+            + paths
+            + base.mark_line().encode(y='P50')
+            + base.mark_line(strokeDash=[4, 4]).encode(y='Mean'))
 
 
 with st.sidebar:
 
-    st.markdown("**CIR Model Parameters**")
-    scenarios = st.slider('Scenarios', min_value=1,
-                          max_value=1000, value=100)
+    model = st.selectbox('Model', models.keys())
+    st.markdown(f"**{model} Model Parameters**")
+    # The funding ratio is simulated for the one-factor models, and too slow beyond 100,000 scenarios
+    scenarios = st.select_slider('Scenarios', options=[100, 1_000, 10_000, 100_000] + ([1_000_000] if model == 'G2++' else []),
+                                 value=1_000, format_func='{:,}'.format,
+                                 help='Runs of 100,000 scenarios over long horizons take several seconds')
     years = st.slider('Years', min_value=0.25,
-                      max_value=30., step=0.25, value=5.)
+                      max_value=40., step=0.25, value=5.)
     steps_per_year = st.slider('Steps per year', min_value=1,
                                max_value=12, value=4)
-    a = st.slider('Speed of mean reversion', min_value=0.,
-                  max_value=10., value=0.5)
-    b = st.slider('Long-term average rate', min_value=0.,
-                  max_value=0.1, value=0.05, step=0.001, format='percent')
-    sigma = st.slider('Volatility', min_value=0.,
-                      max_value=0.1, value=0.01, step=0.001, format='percent')
-    r0 = st.slider('Initial rate', min_value=0.,
-                   max_value=0.1, value=0.02, step=0.001, format='percent')
+
+    curve = None
+    if model in fitted:
+        region = st.segmented_control('Current curve', ['Canada', 'US'], default='Canada')
+        curve = get_curve(region or 'Canada')
+        a = st.slider('Speed of mean reversion', min_value=0.01,
+                      max_value=2., value=0.1)
+        sigma = st.slider('Volatility', min_value=0.,
+                          max_value=0.05, value=0.01, step=0.001, format='percent')
+        params = (a, sigma)
+        if model == 'G2++':
+            b = st.slider('Speed of mean reversion (2nd factor)', min_value=0.01,
+                          max_value=2., value=0.5)
+            eta = st.slider('Volatility (2nd factor)', min_value=0.,
+                            max_value=0.05, value=0.008, step=0.001, format='percent')
+            rho = st.slider('Correlation', min_value=-1.,
+                            max_value=1., value=-0.5, step=0.05)
+            params = (a, sigma, b, eta, rho)
+    else:
+        if model != 'Black-Karasinski' and st.toggle('Calibrate to current curve'):
+            region = st.segmented_control('Current curve', ['Canada', 'US'], default='Canada')
+            a, b, sigma, r0 = calibrate(model, *get_curve(region or 'Canada'))
+            st.caption(f'Fitted a = {a:.3f}, b = {b:.2%}, sigma = {sigma:.2%}, r0 = {r0:.2%}')
+        else:
+            a = st.slider('Speed of mean reversion', min_value=0.,
+                          max_value=10., value=0.5)
+            b = st.slider('Long-term average rate', min_value=0.,
+                          max_value=0.1, value=0.05, step=0.001, format='percent')
+            if model == 'Black-Karasinski':
+                sigma = st.slider('Volatility of log-rate', min_value=0.,
+                                  max_value=1., value=0.2, step=0.01, format='percent')
+            else:
+                sigma = st.slider('Volatility', min_value=0.,
+                                  max_value=0.1, value=0.01, step=0.001, format='percent')
+            r0 = st.slider('Initial rate', min_value=0.,
+                           max_value=0.1, value=0.02, step=0.001, format='percent')
+        params = (a, b, sigma, r0)
+    seed = st.number_input('Seed', min_value=0, value=0, step=1)
 
     st.markdown("---")
 
-    # asset = st.slider('Cash in hand', min_value=0,
-    #                   max_value=10000000, step=250000, value=750000, format="dollar")
-    # liability = st.slider('Liability', min_value=0,
-    #                       max_value=10000000, step=250000, value=1000000, format="dollar")
+    st.markdown("**Assets and Liabilities**")
+    asset = st.slider('Total assets', min_value=0,
+                      max_value=50_000_000, step=250_000, value=7_500_000, format="dollar",
+                      help='Invested in equity, cash and bonds')
+    liability = st.slider('Liability', min_value=50_000,
+                          max_value=5_000_000, step=50_000, value=500_000, format="dollar",
+                          help='Annual payment')
+    start, end = st.slider('Payment years', min_value=0., max_value=40., step=0.25, value=(1., 20.))
+    frequency = st.segmented_control('Payment frequency', ['Monthly', 'Quarterly', 'Annually'], default='Annually')
+    growth = st.slider('Growth of payments', min_value=0., max_value=0.1,
+                       value=0.02, step=0.005, format='percent')
+    schedule = st.file_uploader('Liability schedule', type='csv',
+                                help='Columns Time (years) and Cash Flow, replacing the payments above')
+
+    equity_weight = st.slider('Equity', min_value=0., max_value=0.9,
+                              value=0.3, step=0.05, format='percent')
+    cash_weight = st.slider('Cash', min_value=0., max_value=1. - equity_weight,
+                            value=min(0.1, 1. - equity_weight), step=0.05, format='percent')
+    strategy = st.segmented_control('Bonds', ['Duration', 'Duration & Convexity', 'Single'],
+                                    default='Duration & Convexity',
+                                    help='Match the liabilities, or hold a single zero-coupon bond')
+    if strategy == 'Single':
+        single = st.select_slider('Bond maturity', options=candidates, value=10)
+    with st.expander('Equity'):
+        premium = st.slider('Risk premium', min_value=0., max_value=0.1,
+                            value=0.04, step=0.005, format='percent')
+        vol = st.slider('Volatility', min_value=0., max_value=0.5,
+                        value=0.15, step=0.01, format='percent', key='equity_vol')
 
 
 st.title('Asset Liability Management')
 
-rates, prices = cir(years=years, a=a, b=b, sigma=sigma, init=r0,
-                    scenarios=scenarios, steps_per_year=steps_per_year)
+if model != 'G2++':
+    if schedule is not None:
+        table = pd.read_csv(schedule)
+        liabilities = (tuple(table['Time'].astype(float)), tuple(table['Cash Flow'].astype(float)))
+    else:
+        per_year = {'Monthly': 12, 'Quarterly': 4, 'Annually': 1}[frequency or 'Annually']
+        times = np.arange(start, end + 1e-9, 1 / per_year)
+        liabilities = (tuple(times), tuple(liability / per_year * (1 + growth) ** (times - times[0])))
 
-st.header('Cox-Ingersoll-Ross Model')
+    instance = build(model, params, curve)
+    times, flows = np.array(liabilities)
+    value = (flows * instance.discount(times)).sum()
+    bond_prices = instance.discount(np.array(candidates, dtype=float))
+    budget = asset * (1 - equity_weight - cash_weight)
+    if strategy == 'Single':
+        faces = np.where(np.array(candidates) == single, budget / bond_prices, 0.)
+    else:
+        faces = surplus.hedge(times, flows, instance.discount, budget, candidates,
+                              convexity=strategy == 'Duration & Convexity')
 
-rates_chart = alt.Chart(rates.reset_index().melt(id_vars='index', var_name='c', value_name='y')).mark_line().encode(
-    x=alt.X('index', axis=alt.Axis(tickMinStep=1, title='Time')),
-    y=alt.Y('y', axis=alt.Axis(title='Rates', format='%')),
-    color=alt.Color('c', legend=None)
-)
+    rates, prices, clipped, fan, probability, distribution, median = funding(
+        model, params, years, scenarios, steps_per_year, seed, curve, liabilities,
+        asset * cash_weight, asset * equity_weight, tuple(faces), premium, vol)
+else:
+    # The funding ratio is simulated with the one-factor models only
+    rates, prices, clipped = simulate(model, params, years=years, scenarios=scenarios,
+                                      steps_per_year=steps_per_year, seed=seed, curve=curve)
 
-prices_chart = alt.Chart(prices.reset_index().melt(id_vars='index', var_name='c', value_name='y')).mark_line().encode(
-    x=alt.X('index', axis=alt.Axis(tickMinStep=1, title='Time')),
-    y=alt.Y('y', axis=alt.Axis(title='Bond Prices')),
-    color=alt.Color('c', legend=None)
-)
+st.header(f'{model} Model')
+
+rates_chart = fan_chart(rates, 'Rates', format='%')
+prices_chart = fan_chart(prices, 'Bond Prices')
 
 st.altair_chart(rates_chart | prices_chart)
+st.caption(f'Bands show the 5th-95th and 25th-75th percentiles of {scenarios:,} scenarios, '
+           'with the median, the mean (dashed) and a few sample paths.')
+if clipped > 0:
+    st.caption(f'Up to {clipped:.2%} of the scenarios of a step fall outside the range of the percentile sketches, '
+               'so the percentiles in those tails are approximate.')
+
+st.header('Funding Ratio')
+
+if model != 'G2++':
+    weights = flows * instance.discount(times) / value
+    bond_weights = faces * bond_prices / max((faces * bond_prices).sum(), 1e-12)
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric('Value of Liabilities', f'${value:,.0f}')
+    col2.metric('Funding Ratio', f'{asset / value:.1%}')
+    col3.metric('Probability of Shortfall', f'{probability["At the time"].iloc[-1]:.1%}',
+                help=f'At the horizon of {years:g} years')
+    col4.metric('Median Terminal Surplus', f'${median:,.0f}',
+                help=f'Assets less liabilities at the horizon of {years:g} years')
+
+    st.altair_chart(fan_chart(fan, 'Funding Ratio', format='%'))
+    st.caption('Funding ratios are capped at 300%, and end once every liability has been paid.')
+
+    bars = alt.Chart(distribution).mark_bar().encode(
+        x=alt.X('From', bin='binned', title='Terminal Surplus', axis=alt.Axis(format='$~s')),
+        x2='To',
+        y=alt.Y('Frequency', axis=alt.Axis(format='%'))
+    )
+    lines = alt.Chart(probability.reset_index(names='Time').melt(id_vars='Time', var_name='Shortfall', value_name='Probability')).mark_line().encode(
+        x=alt.X('Time', axis=alt.Axis(tickMinStep=1)),
+        y=alt.Y('Probability', axis=alt.Axis(format='%')),
+        color=alt.Color('Shortfall', legend=alt.Legend(orient='bottom'))
+    )
+    st.altair_chart(bars | lines)
+
+    st.subheader('Bond Portfolio')
+    st.dataframe(pd.DataFrame({
+        'Face': faces,
+        'Value': faces * bond_prices,
+    }, index=pd.Index(candidates, name='Maturity'))[faces > 0].style.format('${:,.0f}'))
+    st.dataframe(pd.DataFrame({
+        'Liabilities': [(weights * times).sum(), (weights * times ** 2).sum()],
+        'Bonds': [(bond_weights * candidates).sum(), (bond_weights * np.square(candidates)).sum()],
+    }, index=['Duration', 'Convexity']).style.format('{:.2f}'))
+else:
+    st.info('The funding ratio is simulated with the one-factor models only.')
 
 st.markdown(open('data/signature.md').read())
@@ -0,0 +1,115 @@
+"""Speedups of the kernels against their NumPy fallbacks
+
+Run with `python benchmark.py`. Every timing first checks that both give the
+same result on its inputs. The parity on edge cases, such as empty
+strategies and scalar inputs, is tested in `tests/test_kernels.py`.
+"""
+import sys
+import timeit
+import numpy as np
+import pandas as pd
+import toolkit as ftk
+import kernels
+import pricing
+import surplus
+
+
+def timed(func, repeat: int) -> tuple[object, float]:
+    result = func()
+    return result, min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def agree(func, rtol: float = 1e-9, atol: float = 1e-9):
+    """Check that `func` gives the same result without and with the kernels"""
+    kernels.ENABLED = False
+    expected = np.asarray(func())
+    kernels.ENABLED = True
+    actual = np.asarray(func())
+    assert actual.shape == expected.shape, f'shape {actual.shape} != {expected.shape}'
+    np.testing.assert_allclose(actual, expected, rtol=rtol, atol=atol, equal_nan=True)
+
+
+def compare(func, repeat: int = 5, rtol: float = 1e-9, atol: float = 1e-9) -> tuple[float, float]:
+    """Best timings of `func` without and with the kernels, after checking that they agree"""
+    agree(func, rtol=rtol, atol=atol)
+    kernels.ENABLED = False
+    _, fallback = timed(func, repeat)
+    kernels.ENABLED = True
+    _, jitted = timed(func, repeat)
+    return fallback, jitted
+
+
+def surplus_step(scenarios: int = 100_000, years: int = 40, steps_per_year: int = 12):
+    """Cash account and funding ratios of the surplus simulation, monthly over 40 years"""
+    rng = np.random.default_rng(0)
+    steps = years * steps_per_year + 1
+    rates = rng.normal(0.03, 0.01, (steps, scenarios))
+    inflow = np.full(steps, -1000 / steps_per_year)
+    other = rng.lognormal(8, 0.5, (steps, scenarios))
+    liabilities = np.linspace(1, 0, steps)[:, None] * rng.lognormal(9.5, 0.1, scenarios)
+
+    def run():
+        summary = surplus.Surplus([], [], cash=5000., equity=0.).fund(
+            rates, 1 / steps_per_year, inflow, other, liabilities)
+        return np.concatenate([summary.funding.counts.ravel(), summary.funding_sum, summary.live, summary.shortfall,
+                               summary.underfunded, summary.sample_funding.ravel(), summary.terminal()])
+    return run
+
+
+def option_greeks(legs: int = 8, spots: int = 2000, vols: int = 50):
+    """Greeks of a strategy of calls, puts, stocks and debts on a spot-volatility grid"""
+    instrument = np.resize(pricing.INSTRUMENTS, legs)
+    strike = np.linspace(80, 120, legs)
+    qty = np.where(np.arange(legs) % 2, -1., 1.)
+    spot = np.linspace(1, 200, spots)[:, None]
+    vol = np.linspace(0.05, 1, vols)
+
+    def run():
+        return pricing.greeks(instrument, strike, qty, spot, 0.03, 0.5, vol, 0.01)
+    return run
+
+
+def linking(periods: int = 120, segments: int = 10):
+    """Frongello linking of monthly attribution over ten years, as called by the linking page
+
+    The fallback is `ftk.frongello`, which re-sums the history at every
+    period, so its timing includes a different algorithm and its pandas
+    overhead rather than the same loop.
+    """
+    rng = np.random.default_rng(0)
+    p = pd.DataFrame(rng.normal(0.001, 0.01, (periods, segments)))
+    b = pd.DataFrame(rng.normal(0.001, 0.01, (periods, segments)))
+
+    def run():
+        if kernels.ENABLED:
+            return pd.DataFrame(kernels.frongello(*kernels.contiguous(p.to_numpy(), b.to_numpy()), 0.5),
+                                index=p.index, columns=p.columns).to_numpy()
+        return ftk.frongello(p, b, sel=0.5).to_numpy()
+    return run
+
+
+def linking_loop(periods: int = 120, segments: int = 10):
+    """The same Frongello loop on the same arrays, interpreted then compiled"""
+    rng = np.random.default_rng(0)
+    p = rng.normal(0.001, 0.01, (periods, segments))
+    b = rng.normal(0.001, 0.01, (periods, segments))
+
+    def run():
+        kernel = kernels.frongello if kernels.ENABLED else kernels.frongello.py_func
+        return kernel(p, b, 0.5)
+    return run
+
+
+if __name__ == '__main__':
+    if kernels.numba is None:
+        sys.exit('Numba is not installed, so only the NumPy fallbacks are available.')
+
+    kernels.warmup()
+    rows = {}
+    for name, func in [('Surplus step loop', surplus_step()),
+                       ('Option Greeks', option_greeks()),
+                       ('Frongello loop, interpreted', linking_loop()),
+                       ('Frongello page, vs ftk.frongello (different algorithm)', linking())]:
+        fallback, jitted = compare(func)
+        rows[name] = {'Fallback (ms)': fallback * 1e3, 'Numba (ms)': jitted * 1e3, 'Speedup': fallback / jitted}
+    print(pd.DataFrame(rows).T.round(2).to_string())
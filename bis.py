@@ -0,0 +1,85 @@
+"""Local copy of the central bank policy rates of the BIS bulk file
+
+The rates are kept as a Parquet file under `.cache`, next to the ETag and
+Last-Modified headers they were downloaded with, so the file is only
+downloaded again when it changed upstream.
+"""
+import json
+import os
+import tempfile
+from zipfile import ZipFile
+import pandas as pd
+import requests
+from famafrench import write, write_json
+
+URL = 'https://data.bis.org/static/bulk/WS_CBPOL_csv_flat.zip'
+PATH = os.path.join('.cache', 'policy.parquet')
+
+fields = {
+    'FREQ:Frequency': 'freq',
+    'REF_AREA:Reference area': 'country',
+    'TIME_PERIOD:Time period or range': 'date',
+    'OBS_VALUE:Observation Value': 'rate'
+}
+
+countries = ['CA', 'CH', 'CN', 'DE', 'FR', 'GB', 'HK',
+             'IN', 'IT', 'JP', 'KR', 'MX', 'AU', 'US', 'XM']
+
+
+def parse(f, chunksize: int = 100_000) -> pd.DataFrame:
+    """Daily policy rates of `countries` since 2020, filtered while the CSV is read"""
+    chunks = []
+    for chunk in pd.read_csv(f, usecols=fields.keys(), chunksize=chunksize):
+        chunk = chunk.rename(columns=fields)
+        keep = (chunk['freq'] == 'D: Daily') & chunk['country'].str[:2].isin(countries) \
+            & (chunk['date'] >= '2020')
+        chunks.append(chunk.loc[keep, ['country', 'date', 'rate']])
+
+    df = pd.concat(chunks, ignore_index=True)
+    df[['iso', 'country']] = df['country'].str.split(':', n=1, expand=True).astype('category')
+    df['date'] = pd.to_datetime(df['date'])
+    df['rate'] = df['rate'].div(100)
+    return df
+
+
+def load(url: str = URL, path: str = PATH, timeout: float = 60) -> pd.DataFrame:
+    """Policy rates, downloaded again only if the file changed upstream
+
+    The download is streamed to a temporary file and the CSV inside is
+    filtered chunk by chunk, so the full table is never in memory. The local
+    copy is written through temporary files, so that readers never see it
+    half written, and served as it is when the source cannot be reached.
+    """
+    meta_path = path + '.json'
+    headers = {}
+    if os.path.exists(path) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    try:
+        response = requests.get(url, headers=headers, stream=True, timeout=timeout)
+        if response.status_code == 304:
+            return pd.read_parquet(path)
+        response.raise_for_status()
+    except requests.RequestException:
+        if headers:
+            return pd.read_parquet(path)
+        raise
+
+    with tempfile.TemporaryFile() as tmp:
+        for block in response.iter_content(chunk_size=1 << 20):
+            tmp.write(block)
+        tmp.seek(0)
+        with ZipFile(tmp) as z:
+            with z.open(z.namelist()[0]) as f:
+                df = parse(f)
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    write(path, df.to_parquet)
+    write_json(meta_path, {'etag': response.headers.get('ETag'),
+                           'last_modified': response.headers.get('Last-Modified')})
+    return df
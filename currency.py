@@ -1,7 +1,10 @@
 import pandas as pd
 import streamlit as st
 import altair as alt
+import numpy as np
 import toolkit as ftk
+import feed
+from fx import CrossRates
 
 
 @st.cache_data(ttl=3600)
@@ -17,128 +20,155 @@ def get_flag(code):
     return f'https://flagpedia.net/data/{"org" if code == "EU" else "flags"}/w320/{code.lower()}.png'
 
 
-fx, data = get_data()
-fx = fx.drop(columns=['USD=X']).dropna()
-fx.index = fx.index.date
+@st.cache_data(ttl=3600)
+def get_rates() -> tuple[CrossRates, pd.DataFrame]:
+    fx, data = get_data()
+    fx = fx.drop(columns=['USD=X']).dropna()
+    fx.index = fx.index.date
+    return CrossRates(fx.rename(columns=lambda ticker: ticker[:-2])), data
+
+
+@st.cache_data(ttl=3600)
+def get_risk(from_date, to_date) -> tuple[np.ndarray, np.ndarray]:
+    """Volatility of every cross rate and correlation of the currencies over the period"""
+    rates, _ = get_rates()
+    return rates.volatility(from_date, to_date), rates.correlation(from_date, to_date)
+
+
+rates, data = get_rates()
+dates = rates.dates
 
 with st.sidebar:
 
+    live = st.toggle('Live', help='Poll the latest rates and update the last day in place')
+    interval = st.select_slider('Refresh every (seconds)', options=[5, 15, 30, 60, 300], value=30,
+                                disabled=not live)
+
     from_date, to_date = st.select_slider(
-        'Period', options=fx.index, value=(fx.index[-252], fx.index[-1]))
-    show = st.segmented_control('Show', ['Quote', 'Change'], default='Quote')
-
-filtered = fx.T[[from_date, to_date]]
-merged = filtered.join(data)
-merged = pd.concat([merged, pd.DataFrame({
-    from_date: 1.,
-    to_date: 1.,
-    'Name': 'US Dollar',
-    'Country': 'US'
-}, index=['USD=X'])]).reset_index()
-merged['index'] = merged['index'].str[:-2]
-
-matrix = pd.merge(merged, merged.add_prefix('FC'), how='cross')
-matrix = matrix.rename(columns={
-    'index': 'DC_ISO',
-    from_date: 'DC_0',
-    to_date: 'DC_1',
-    'Name': 'DC_Name',
-    'Country': 'DC_Country',
-    'FCindex': 'FC_ISO',
-    'FC'+str(from_date): 'FC_0',
-    'FC'+str(to_date): 'FC_1',
-    'FCName': 'FC_Name',
-    'FCCountry': 'FC_Country'
-})
-
-matrix['Quote'] = matrix['DC_ISO'] + '/' + matrix['FC_ISO']
-matrix['FX_1'] = matrix['FC_1'] / matrix['DC_1']
-matrix['FX_0'] = matrix['FC_0'] / matrix['DC_0']
-matrix['FX_C'] = matrix['FX_1'] / matrix['FX_0'] - 1
-matrix['DC_Country'] = matrix['DC_Country'].apply(get_flag)
-matrix['FC_Country'] = matrix['FC_Country'].apply(get_flag)
-
-tooltip = [
-    alt.Tooltip('Quote:N', title='Quote'),
-    alt.Tooltip('FX_C:Q', title='Change', format='.2%'),
-    alt.Tooltip('FX_1:Q', title=str(to_date), format='.5g'),
-    alt.Tooltip('FX_0:Q', title=str(from_date), format='.5g'),
-]
-
-# Heatmap
-rng = max(abs(matrix['FX_C'].max()), abs(matrix['FX_C'].min()))
-
-hover = alt.selection_point(
-    fields=['FC_ISO', 'DC_ISO'],
-    on='mouseover',
-    empty='none'
-)
-brush = alt.selection_interval(encodings=["x"])
-
-base = alt.Chart(matrix)
-heatmap = base.mark_rect().encode(
-    x=alt.X('FC_ISO:N', axis=None),
-    y=alt.Y('DC_ISO:N', axis=None),
-    color=alt.Color('FX_C:Q', scale=alt.Scale(
-        domain=[-rng, 0, rng],
-        range=['red', '#fefefe', 'green']
-    ),
-        legend=alt.Legend(format='.0%'),
-        title='Change'
-    ),
-    tooltip=tooltip
-).add_params(hover).properties(
-    height=600,
-    width=1200
-)
-
-# X-axis / Foreign Currency
-x_images = base.mark_image(height=40).encode(
-    x=alt.X('FC_ISO:N'),
-    y=alt.value(-22),
-    url='FC_Country'
-)
-
-# Y-axis / Domestic Currency
-y_images = base.mark_image(width=60).encode(
-    x=alt.value(-32),
-    y=alt.Y('DC_ISO:N'),
-    url='DC_Country'
-)
-
-text = base.mark_text().encode(
-    x=alt.X('FC_ISO:N'),
-    y=alt.Y('DC_ISO:N'),
-    text=alt.Text('FX_1:Q', format='.5g') if show == 'Quote' else alt.Text(
-        'FX_C:Q', format='.2%'),
-    tooltip=tooltip
-)
-
-chart = heatmap + x_images + y_images + text
-
-# Filtered time series
-ts = fx
-ts.index.name = 'Date'
-ts = ts.reset_index().melt(id_vars='Date', var_name='DC_ISO', value_name='Rate')
-ts['DC_ISO'] = ts['DC_ISO'].str[:-2]
-ts = pd.merge(ts, ts.add_prefix('FC'), left_on='Date', right_on='FCDate')
-ts['Rate'] = ts['FCRate'] / ts['Rate']
-ts = ts.rename(columns={'FCDC_ISO': 'FC_ISO'}).drop(
-    columns=['FCDate', 'FCRate'])
-x = ts.merge(matrix, left_on=['DC_ISO', 'FC_ISO'],
-             right_on=['DC_ISO', 'FC_ISO'], how='inner')
-
-line = alt.Chart(x).mark_line().encode(
-    x='Date:T',
-    y='Rate:Q'
-).transform_filter(hover)
+        'Period', options=dates, value=(dates[-252], dates[-1]))
+    measure = st.segmented_control('Heatmap', ['Change', 'Volatility', 'Correlation'], default='Change') or 'Change'
+    show = st.segmented_control('Show', ['Quote', 'Value'], default='Quote')
+
+# Live mode patches its own copy of the rates, kept for the session
+if live and 'currency' not in st.session_state:
+    st.session_state['currency'] = get_rates()[0], feed.connect(data.index.drop('USD=X'))
+elif not live:
+    st.session_state.pop('currency', None)
 
 # Page
 col1, col2 = st.columns(2)
 col1.title('Foreign Exchange')
 
-st.altair_chart(chart, width='content')  # chart & line, too slow
 
-with st.expander('Data', expanded=False):
-    st.dataframe(matrix.drop(
-        columns=['DC_Name', 'DC_Country', 'FC_Name', 'FC_Country']))
+@st.fragment(run_every=interval if live else None)
+def dashboard(rates, to_date):
+    if live:
+        rates, source = st.session_state['currency']
+        try:
+            date, quotes = source.latest()
+            rates.patch(date.date(), quotes.rename(lambda ticker: ticker[:-2]))
+        except Exception:
+            st.toast('Unable to fetch the latest rates')
+        to_date = rates.dates[-1]
+        vol, corr = rates.volatility(from_date, to_date), rates.correlation(from_date, to_date)
+    else:
+        vol, corr = get_risk(from_date, to_date)
+
+    codes = rates.codes.to_numpy()
+    n = len(codes)
+
+    # One row per pair, domestic currency by row and foreign currency by column
+    countries = data['Country'].rename(index=lambda ticker: ticker[:-2]).reindex(codes).fillna('US')
+    flags = countries.map(get_flag).to_numpy()
+    matrix = pd.DataFrame({
+        'DC_ISO': np.repeat(codes, n),
+        'FC_ISO': np.tile(codes, n),
+        'DC_Country': np.repeat(flags, n),
+        'FC_Country': np.tile(flags, n),
+        'FX_1': rates.cross(to_date).ravel(),
+        'FX_0': rates.cross(from_date).ravel(),
+        'FX_C': rates.change(from_date, to_date).ravel(),
+        'Vol': vol.ravel(),
+        'Corr': corr.ravel()
+    })
+    matrix.insert(0, 'Quote', matrix['DC_ISO'] + '/' + matrix['FC_ISO'])
+
+    tooltip = [
+        alt.Tooltip('Quote:N', title='Quote'),
+        alt.Tooltip('FX_C:Q', title='Change', format='.2%'),
+        alt.Tooltip('FX_1:Q', title=str(to_date), format='.5g'),
+        alt.Tooltip('FX_0:Q', title=str(from_date), format='.5g'),
+        alt.Tooltip('Vol:Q', title='Volatility', format='.2%'),
+        alt.Tooltip('Corr:Q', title='Correlation', format='.2f'),
+    ]
+
+    # Heatmap
+    rng = max(abs(matrix['FX_C'].max()), abs(matrix['FX_C'].min()))
+    field, fmt, scale = {
+        'Change': ('FX_C', '.2%', alt.Scale(domain=[-rng, 0, rng], range=['red', '#fefefe', 'green'])),
+        'Volatility': ('Vol', '.2%', alt.Scale(domain=[0, matrix['Vol'].max()], range=['#fefefe', 'orange'])),
+        'Correlation': ('Corr', '.2f', alt.Scale(domain=[-1, 0, 1], range=['blue', '#fefefe', 'red']))
+    }[measure]
+
+    pair = alt.selection_point(
+        name='pair',
+        fields=['FC_ISO', 'DC_ISO'],
+        on='click',
+        empty='none'
+    )
+
+    base = alt.Chart(matrix)
+    heatmap = base.mark_rect().encode(
+        x=alt.X('FC_ISO:N', axis=None),
+        y=alt.Y('DC_ISO:N', axis=None),
+        color=alt.Color(f'{field}:Q', scale=scale,
+                        legend=alt.Legend(format='.0%' if fmt.endswith('%') else '.1f'),
+                        title=measure),
+        tooltip=tooltip
+    ).add_params(pair).properties(
+        height=600,
+        width=1200
+    )
+
+    # X-axis / Foreign Currency
+    x_images = base.mark_image(height=40).encode(
+        x=alt.X('FC_ISO:N'),
+        y=alt.value(-22),
+        url='FC_Country'
+    )
+
+    # Y-axis / Domestic Currency
+    y_images = base.mark_image(width=60).encode(
+        x=alt.value(-32),
+        y=alt.Y('DC_ISO:N'),
+        url='DC_Country'
+    )
+
+    text = base.mark_text().encode(
+        x=alt.X('FC_ISO:N'),
+        y=alt.Y('DC_ISO:N'),
+        text=alt.Text('FX_1:Q', format='.5g') if show == 'Quote' else alt.Text(
+            f'{field}:Q', format=fmt),
+        tooltip=tooltip
+    )
+
+    chart = heatmap + x_images + y_images + text
+
+    event = st.altair_chart(chart, width='content', on_select='rerun', key='cross')
+
+    # Time series of the clicked pair only
+    selected = event.selection.get('pair') or [{'DC_ISO': 'USD', 'FC_ISO': codes[1]}]
+    domestic, foreign = selected[0]['DC_ISO'], selected[0]['FC_ISO']
+    ts = rates.series(domestic, foreign).loc[from_date:to_date]
+    ts.index.name = 'Date'
+    st.altair_chart(alt.Chart(ts.reset_index(name='Rate')).mark_line().encode(
+        x='Date:T',
+        y=alt.Y('Rate:Q', title=f'{domestic}/{foreign}', scale=alt.Scale(zero=False))
+    ), width='stretch')
+
+    with st.expander('Data', expanded=False):
+        st.dataframe(matrix.drop(
+            columns=['DC_Country', 'FC_Country']))
+
+
+dashboard(rates, to_date)
@@ -0,0 +1,245 @@
+import numpy as np
+import pandas as pd
+from scipy.interpolate import CubicSpline
+
+PARAMS = ['Beta 0', 'Beta 1', 'Beta 2', 'Beta 3', 'Tau 1', 'Tau 2']
+
+
+def loadings(maturity, tau: np.ndarray) -> np.ndarray:
+    """Nelson-Siegel-Svensson factor loadings
+
+    Parameters
+    ----------
+    maturity : array-like of float
+        Maturities in years
+    tau : np.ndarray
+        Decay times, shape (..., 2)
+
+    Returns
+    -------
+    np.ndarray
+        Loadings, shape (..., len(maturity), 4)
+    """
+    t = np.asarray(maturity, dtype=float)
+    x = t[:, None] / tau[..., None, :]
+    decay = np.exp(-x)
+    slope = -np.expm1(-x) / x
+    return np.concatenate([
+        np.ones(x.shape[:-1] + (1,)),
+        slope[..., :1],
+        slope - decay], axis=-1)
+
+
+def nss(params: np.ndarray, maturity) -> np.ndarray:
+    """Yields of Nelson-Siegel-Svensson curves
+
+    Parameters
+    ----------
+    params : np.ndarray
+        Parameters in the order of `PARAMS`, shape (..., 6)
+    maturity : array-like of float
+        Maturities in years
+
+    Returns
+    -------
+    np.ndarray
+        Yields, shape (..., len(maturity))
+    """
+    params = np.asarray(params, dtype=float)
+    return (loadings(maturity, params[..., 4:]) @ params[..., :4, None])[..., 0]
+
+
+def _profile(maturity, yields: np.ndarray, weight: np.ndarray, tau: np.ndarray, ridge: float = 1e-8) -> tuple[np.ndarray, np.ndarray]:
+    """Betas solved by weighted least squares given the decay times, and the residuals"""
+    X = loadings(maturity, tau)
+    Xw = X * weight[..., None]
+    gram = np.swapaxes(Xw, -1, -2) @ X + ridge * np.eye(4)
+    beta = np.linalg.solve(gram, (np.swapaxes(Xw, -1, -2) @ yields[..., None]))[..., 0]
+    residual = (yields - (X @ beta[..., None])[..., 0]) * np.sqrt(weight)
+    return beta, residual
+
+
+def fit(maturity, yields, grid=None, iterations: int = 20, init: np.ndarray = None) -> np.ndarray:
+    """Nelson-Siegel-Svensson curves fitted to every date at once
+
+    The betas are linear given the decay times, so they are profiled out and
+    only the two decay times are searched: first on a coarse grid shared by
+    all dates, then by batched Levenberg-Marquardt steps on their logarithm.
+    Every date then starts again from the fit of the previous date when it
+    is better, which keeps the parameter history smooth.
+
+    Parameters
+    ----------
+    maturity : array-like of float
+        Maturities in years
+    yields : array-like of float
+        Yields by date and maturity, NaN where missing
+    grid : array-like of float, optional
+        Candidate decay times of the coarse search
+    iterations : int, optional
+        Number of Levenberg-Marquardt steps, by default 20
+    init : np.ndarray, optional
+        Decay times to start from, shape (dates, 2), e.g. a previous fit.
+        Rows with NaN fall back to the coarse search.
+
+    Returns
+    -------
+    np.ndarray
+        Parameters in the order of `PARAMS`, shape (dates, 6)
+    """
+    maturity = np.asarray(maturity, dtype=float)
+    yields = np.asarray(yields, dtype=float)
+    weight = (~np.isnan(yields)).astype(float)
+    yields = np.nan_to_num(yields)
+
+    # Coarse search over pairs of decay times
+    grid = np.geomspace(0.25, 30, 12) if grid is None else np.asarray(grid, dtype=float)
+    pairs = np.array([(a, b) for a in grid for b in grid if b > 1.5 * a])
+    _, residual = _profile(maturity, yields[None], weight[None], pairs[:, None, :])
+    tau = pairs[np.argmin((residual ** 2).sum(axis=-1), axis=0)]
+    if init is not None:
+        tau = np.where(np.isnan(init), tau, init)
+
+    def sse(log_tau):
+        return (_profile(maturity, yields, weight, np.exp(log_tau))[1] ** 2).sum(axis=-1)
+
+    def refine(log_tau):
+        damping = np.full(len(log_tau), 1e-2)
+        h = 1e-5
+        for _ in range(iterations):
+            _, r = _profile(maturity, yields, weight, np.exp(log_tau))
+            J = np.stack([(_profile(maturity, yields, weight, np.exp(log_tau + h * e))[1] - r) / h
+                          for e in np.eye(2)], axis=-1)
+            JtJ = np.swapaxes(J, -1, -2) @ J
+            step = -np.linalg.solve(JtJ + damping[:, None, None] * (np.eye(2) + JtJ * np.eye(2)),
+                                    (np.swapaxes(J, -1, -2) @ r[..., None]))[..., 0]
+            trial = np.clip(log_tau + step, np.log(0.05), np.log(50))
+            better = sse(trial) < (r ** 2).sum(axis=-1)
+            log_tau = np.where(better[:, None], trial, log_tau)
+            damping = np.where(better, damping / 3, damping * 4)
+        return log_tau
+
+    log_tau = refine(np.log(tau))
+
+    # Warm start from the previous date where it fits better
+    previous = np.vstack([log_tau[:1], log_tau[:-1]])
+    log_tau = refine(np.where((sse(previous) < sse(log_tau))[:, None], previous, log_tau))
+
+    beta, _ = _profile(maturity, yields, weight, np.exp(log_tau))
+    return np.hstack([beta, np.exp(log_tau)])
+
+
+def spline(maturity, yields, at) -> np.ndarray:
+    """Yields interpolated by natural cubic splines through the available maturities of every date
+
+    Parameters
+    ----------
+    maturity : array-like of float
+        Maturities in years
+    yields : array-like of float
+        Yields by date and maturity, NaN where missing
+    at : array-like of float
+        Maturities to interpolate
+
+    Returns
+    -------
+    np.ndarray
+        Yields, shape (dates, len(at))
+    """
+    maturity = np.asarray(maturity, dtype=float)
+    yields = np.asarray(yields, dtype=float)
+    result = np.full((len(yields), len(np.atleast_1d(at))), np.nan)
+
+    # Dates sharing the same available maturities are interpolated together
+    masks, groups = np.unique(~np.isnan(yields), axis=0, return_inverse=True)
+    for i, mask in enumerate(masks):
+        if mask.sum() < 2:
+            continue
+        rows = groups.ravel() == i
+        result[rows] = CubicSpline(maturity[mask], yields[rows][:, mask], axis=1, bc_type='natural')(at)
+    return result
+
+
+def factors(params: pd.DataFrame) -> pd.DataFrame:
+    """Level, slope (long minus short rate) and curvature of fitted curves"""
+    return pd.DataFrame({
+        'Level': params['Beta 0'],
+        'Slope': -params['Beta 1'],
+        'Curvature': params['Beta 2'],
+    }, index=params.index)
+
+
+def moments(changes) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Running sums of yield changes over pairs of maturities, for covariances of any window
+
+    Missing changes are skipped pair by pair, so a maturity that is only
+    quoted on some dates still contributes where it is. The covariance of
+    rows `start` to `end` is then a difference of two running sums instead of
+    a pass over the window.
+
+    Parameters
+    ----------
+    changes : array-like of float
+        Changes by date and maturity, NaN where missing
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray, np.ndarray]
+        Running number of pairs observed, sum of the first of the pair and
+        sum of the products, each of shape (dates + 1, maturities, maturities)
+    """
+    changes = np.asarray(changes, dtype=float)
+    mask = ~np.isnan(changes)
+    x = np.nan_to_num(changes)
+    zero = np.zeros((1, changes.shape[1], changes.shape[1]))
+    return tuple(np.concatenate([zero, np.cumsum(m, axis=0)]) for m in [
+        mask[:, :, None] & mask[:, None, :],
+        x[:, :, None] * mask[:, None, :],
+        x[:, :, None] * x[:, None, :]])
+
+
+def covariance(moments: tuple, start, end) -> np.ndarray:
+    """Pairwise covariances of the changes in rows `start` to `end` (excluded), zero where undefined"""
+    count, total, product = (m[end] - m[start] for m in moments)
+    n = np.maximum(count, 2)
+    cov = (product - total * np.swapaxes(total, -1, -2) / n) / (n - 1)
+    return np.where(count > 1, cov, 0.)
+
+
+def pca(cov: np.ndarray, reference: np.ndarray = None) -> tuple[np.ndarray, np.ndarray]:
+    """Principal components of covariance matrices
+
+    Parameters
+    ----------
+    cov : np.ndarray
+        Covariance matrices, shape (..., maturities, maturities)
+    reference : np.ndarray, optional
+        Loadings the signs are aligned to, otherwise the largest loading of
+        every component is positive
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        Share of variance explained by every component, shape (..., maturities),
+        and loadings, shape (..., maturities, components), largest component first
+    """
+    values, vectors = np.linalg.eigh(cov)
+    values, vectors = np.maximum(values[..., ::-1], 0), vectors[..., ::-1]
+    if reference is None:
+        reference = np.eye(cov.shape[-1])[np.abs(vectors).argmax(axis=-2)].swapaxes(-1, -2)
+    sign = np.where((vectors * reference).sum(axis=-2) < 0, -1., 1.)
+    total = values.sum(axis=-1, keepdims=True)
+    return np.divide(values, total, out=np.zeros_like(values), where=total > 0), vectors * sign[..., None, :]
+
+
+def rolling_pca(moments: tuple, window: int, reference: np.ndarray = None) -> tuple[np.ndarray, np.ndarray]:
+    """Principal components of every window of `window` consecutive changes
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        Explained shares and loadings as `pca`, one row per window, the first
+        ending at row `window - 1`
+    """
+    end = np.arange(window, len(moments[0]))
+    return pca(covariance(moments, end - window, end), reference)
@@ -2,16 +2,20 @@ import pandas as pd
 import streamlit as st
 import altair as alt
 import toolkit as ftk
+import utils
 
 
 @st.cache_data(ttl=3600)
 def get_data():
 
-    ca = ftk.get_statcan_bulk(n=120)
-    us = pd.DataFrame(columns=['CUUR0000SA0', 'LNS14000000'])
-    try:
-        us = ftk.get_bls_bulk()
-    except Exception as e:
+    # Retried once only, as the BLS API has a daily limit
+    loaded, failed = utils.fetch({'Canada': lambda: ftk.get_statcan_bulk(n=120),
+                                  'US': ftk.get_bls_bulk}, timeout=60, retries=1)
+    if 'Canada' in failed:
+        raise failed['Canada']
+    ca = loaded['Canada']
+    us = loaded.get('US', pd.DataFrame(columns=['CUUR0000SA0', 'LNS14000000']))
+    if 'US' in failed:
         st.warning('Unable to fetch US data')  # API daily limit
 
     df = pd.concat({
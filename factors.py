@@ -1,17 +1,40 @@
+from functools import partial
 import numpy as np
 import pandas as pd
 import streamlit as st
 import toolkit as ftk
+import famafrench
+import utils
+
+
+@st.cache_resource(ttl=3600, show_spinner=False)
+def get_mirror():
+    """Local mirror of the factor library, refreshed at most once a day
+
+    Only the datasets changed upstream are downloaded, and the mirror is
+    served as it is when the library cannot be reached.
+    """
+    mirror = famafrench.Mirror()
+    if mirror.stale():
+        try:
+            names = mirror.list()
+        except Exception:
+            return mirror
+        bar = st.progress(0., text='Refreshing the factor library')
+        _, errors = utils.fetch({name: partial(mirror.update, name) for name in names}, timeout=300, workers=8,
+                                progress=lambda done: bar.progress(done / len(names), f'Checked {done} of {len(names)} datasets'))
+        bar.empty()
+        if not errors:
+            mirror.checked()
+    return mirror
 
 
-@st.cache_data
 def get_datasets():
-    return ftk.get_famafrench_datasets()
+    return get_mirror().datasets()
 
 
-@st.cache_data(ttl=3600)
 def get_factors(dataset, mom):
-    return ftk.get_famafrench_factors(dataset, mom)
+    return get_mirror().factors(dataset, mom)
 
 
 @st.cache_data(ttl=60)
@@ -20,24 +43,151 @@ def get_price(ticker):
 
 
 # Return (portfolio, factors, rfr)
-def resample(portfolio, factors):
+def resample(portfolio, factors, memo: dict = None):
     if ftk.periodicity(portfolio) > ftk.periodicity(factors):
-        portfolio = portfolio.resample(
-            factors.index.freqstr).aggregate(ftk.compound_return)
+        # Reuse the resampled portfolio for factors of the same frequency
+        memo = {} if memo is None else memo
+        freq = factors.index.freqstr
+        if freq not in memo:
+            memo[freq] = portfolio.resample(freq).aggregate(ftk.compound_return)
+        portfolio = memo[freq]
 
     merged = pd.merge(portfolio, factors, left_index=True, right_index=True)
     return merged.iloc[:, 0], merged.iloc[:, 1:-1], merged.iloc[:, -1]
 
 
-@st.cache_data(ttl=60)
-def get_bestfit(portfolio):
-
-    def analyse(portfolio, model):
-        portfolio, factors, rfr = resample(portfolio, get_factors(model, mom))
-        return ftk.rsquared(portfolio - rfr, factors, adjusted=True)
-
+def adjusted_rsquared(y: np.ndarray, X: np.ndarray) -> np.ndarray:
+    """Adjusted R-squared of regressions with an intercept, solved together
+
+    The regressions are solved by pseudo-inverse and the degrees of freedom
+    taken from the rank, as in statsmodels, so a model with collinear or
+    empty factors does not fail the others.
+
+    Parameters
+    ----------
+    y : np.ndarray
+        Dependent variables, shape (models, observations)
+    X : np.ndarray
+        Regressors without the constant, shape (models, observations, factors)
+
+    Returns
+    -------
+    np.ndarray
+        Adjusted R-squared of every model, as in `ftk.rsquared(..., adjusted=True)`
+    """
+    n = X.shape[-2]
+    X = np.concatenate([np.ones(X.shape[:-1] + (1,)), X], axis=-1)
+    coef = np.linalg.pinv(X) @ y[..., None]
+    k = np.linalg.matrix_rank(X) - 1
+    ssr = ((y - (X @ coef)[..., 0]) ** 2).sum(axis=-1)
+    sst = ((y - y.mean(axis=-1, keepdims=True)) ** 2).sum(axis=-1)
+    return 1 - ssr / sst * (n - 1) / (n - k - 1)
+
+
+def rolling_regression(y: pd.Series, X: pd.DataFrame, window: int = None) -> pd.DataFrame:
+    """Alpha, betas and R-squared of the regressions over every rolling or expanding window
+
+    Running sums of the cross-products X'X and X'y, with a constant, give
+    the normal equations of any window from two rows, so every window is
+    solved from one pass over the data instead of one regression each.
+    Periods with a missing return are skipped.
+
+    Parameters
+    ----------
+    y : pd.Series
+        Excess returns of the portfolio
+    X : pd.DataFrame
+        Factor returns, on the same dates as `y`
+    window : int, optional
+        Number of periods of every window, expanding from the first period if None
+
+    Returns
+    -------
+    pd.DataFrame
+        'Alpha', the beta of every factor and 'R-Squared' by the last date of
+        the window, NaN until the window is full and where the factors of
+        the window are collinear
+    """
+    Z = np.column_stack([np.ones(len(X)), X.to_numpy(dtype=float)])
+    v = y.to_numpy(dtype=float)
+    valid = np.isfinite(v) & np.isfinite(Z).all(axis=1)
+    Z, v = np.where(valid[:, None], Z, 0.), np.where(valid, v, 0.)
+
+    def running(m):
+        return np.concatenate([np.zeros((1,) + m.shape[1:]), np.cumsum(m, axis=0)])
+
+    count, XtX, Xty, yty = map(running, [valid, Z[:, :, None] * Z[:, None, :], Z * v[:, None], v ** 2])
+    end = np.arange(1, len(v) + 1)
+    start = np.zeros_like(end) if window is None else np.maximum(end - window, 0)
+    n, A, b, c = (m[end] - m[start] for m in (count, XtX, Xty, yty))
+
+    # Enough observations for a residual degree of freedom, and a full window
+    ok = (n > Z.shape[1]) & (True if window is None else end >= window)
+
+    # Windows where a factor is constant or collinear have no betas. X'X is
+    # scaled to unit diagonal first, so the test does not depend on the size
+    # of the returns.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = np.sqrt(np.einsum('nii->ni', A[ok]))
+        scaled = np.nan_to_num(A[ok] / scale[:, :, None] / scale[:, None, :])
+        ok[ok] = np.linalg.cond(scaled) < 1e10
+    coef = np.full(Z.shape, np.nan)
+    coef[ok] = np.linalg.solve(A[ok], b[ok, :, None])[..., 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rsquared = 1 - (c - (coef * b).sum(axis=1)) / (c - b[:, 0] ** 2 / n)
+
+    result = pd.DataFrame(coef, index=X.index, columns=['Alpha', *X.columns])
+    result['R-Squared'] = rsquared
+    return result
+
+
+def cumulative_contribution(attribution: pd.DataFrame) -> pd.DataFrame:
+    """Contribution of every component to the compound return up to each date
+
+    The periods are linked by `ftk.carino` over the whole history, then
+    rescaled by the Carino coefficient of the return to each date, so every
+    row equals the linked contributions of the history up to that date.
+    """
+    linked = ftk.carino(attribution, pd.DataFrame(np.zeros_like(attribution), index=attribution.index,
+                                                  columns=attribution.columns))
+    growth = (1 + attribution.sum(axis=1)).cumprod().to_numpy() - 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        k = np.where(growth == 0, 1., np.log1p(growth) / growth)
+    return linked.cumsum().mul(k[-1] / k, axis=0)
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def get_bestfit(ticker, mom):
+    """Adjusted R-squared of the portfolio on every factor dataset, best first
+
+    The datasets are read from the local mirror concurrently, so that any
+    missing from it are downloaded in parallel. Datasets with the same
+    number of observations and factors are regressed together. Raises if any
+    dataset cannot be read, so that an incomplete ranking is not cached.
+    """
+    portfolio = get_price(ticker)
     models = get_datasets()
-    return pd.Series([analyse(portfolio, model) for model in models], index=models).sort_values(ascending=False)
+    bar = st.progress(0., text='Reading the factor library')
+    library, errors = utils.fetch({model: partial(get_factors, model, mom) for model in models}, timeout=300, workers=8,
+                             progress=lambda done: bar.progress(done / len(models), f'Read {done} of {len(models)} datasets'))
+    bar.empty()
+    if errors:
+        missing = ', '.join(errors)
+        raise RuntimeError(f'Datasets {missing} could not be read') from next(iter(errors.values()))
+
+    memo, groups = {}, {}
+    for model, factors in library.items():
+        y, X, rfr = resample(portfolio, factors, memo)
+        y, X = (y - rfr).to_numpy(), X.to_numpy()
+        valid = np.isfinite(y) & np.isfinite(X).all(axis=1)
+        if valid.sum() > X.shape[1] + 1:
+            groups.setdefault((valid.sum(), X.shape[1]), []).append((model, y[valid], X[valid]))
+
+    result = {}
+    for group in groups.values():
+        names, ys, Xs = zip(*group)
+        result.update(zip(names, adjusted_rsquared(np.stack(ys), np.stack(Xs))))
+    return pd.Series(result).sort_values(ascending=False)
 
 
 if 'price' not in st.session_state:
@@ -62,6 +212,8 @@ with st.sidebar:
 
     mom = st.toggle('Add momentum factor')
 
+    window = st.select_slider('Rolling window (periods)', options=[12, 24, 36, 60, 120, 252, 'Expanding'], value=36)
+
 portfolio = st.session_state.price
 
 st.title('Fama–French Factor Model')
@@ -70,9 +222,16 @@ if portfolio is not None:
     st.header(portfolio.name)
 
     if st.button('Check model of best fit'):
-        best = get_bestfit(portfolio)
-        st.info(
-            f'The model of best fit is {best.index[0]} with adjusted R-squared of {best.iloc[0]:.2%}')
+        try:
+            best = get_bestfit(portfolio.name, mom)
+        except RuntimeError as e:
+            st.error(e)
+        else:
+            if best.empty:
+                st.warning('No factor dataset overlaps enough with the portfolio to fit a model')
+            else:
+                st.info(
+                    f'The model of best fit is {best.index[0]} with adjusted R-squared of {best.iloc[0]:.2%}')
 
     factors = get_factors(dataset, mom)
 
@@ -132,6 +291,21 @@ if portfolio is not None:
                      ),
                  },)
     st.line_chart(ftk.return_to_price(combined))
+
+    # Exposures over time
+    st.subheader('Rolling Exposures')
+    rolling = rolling_regression(portfolio - rfr, factors, None if window == 'Expanding' else window).dropna()
+    if rolling.empty:
+        st.info('Not enough history for the selected window')
+    else:
+        attribution = pd.concat([rolling[factors.columns] * factors.loc[rolling.index], rfr.loc[rolling.index]], axis=1)
+        attribution['Residual'] = portfolio.loc[rolling.index] - attribution.sum(axis=1)
+
+        tab1, tab2, tab3 = st.tabs(['Beta', 'Contribution', 'Alpha and R-Squared'])
+        tab1.line_chart(rolling[factors.columns])
+        tab2.line_chart(cumulative_contribution(attribution) * 100)
+        tab2.caption('Cumulative contribution to the compound return since the first full window (%)')
+        tab3.line_chart(rolling[['Alpha', 'R-Squared']])
 else:
     st.write(
         'Please search a ticker on the sidebar e.g. `SPY`, `QQQ`, `ARKK`, `BRK-B`')
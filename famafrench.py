@@ -0,0 +1,166 @@
+"""Local mirror of the factor datasets of Kenneth French's data library
+
+Every dataset is kept as a Parquet file under `.cache/famafrench`, next to
+the ETag and Last-Modified headers it was downloaded with. A refresh asks the
+library for every file conditionally, so only the files changed upstream are
+downloaded again, and reads are memory-mapped from the local copies.
+"""
+import io
+import json
+import os
+import re
+import tempfile
+import time
+from zipfile import ZipFile
+import pandas as pd
+import requests
+import toolkit as ftk
+
+URL = 'https://mba.tuck.dartmouth.edu/pages/faculty/ken.french/ftp/{}_CSV.zip'
+PATH = os.path.join('.cache', 'famafrench')
+PATTERN = re.compile(r'^\w+_Factors\w*$')
+
+
+def momentum(dataset: str) -> str:
+    """Name of the momentum dataset joined to `dataset`, as in `toolkit.get_famafrench_factors`"""
+    return re.sub(r'[35]_Factors', 'Mom_Factor', dataset)
+
+
+def parse(content: bytes) -> pd.DataFrame:
+    """Largest table of a zipped CSV of the library, indexed by monthly or daily period"""
+    with ZipFile(io.BytesIO(content)) as z:
+        name = [n for n in z.namelist() if n.lower().endswith('.csv')][0]
+        text = z.read(name).decode('latin1')
+
+    # The CSV holds several tables separated by blank lines, with notes around them
+    data = None
+    for block in re.split(r'\n\s*\n', text):
+        try:
+            df = pd.read_csv(io.StringIO(block.strip()), index_col=0)
+        except Exception:
+            continue
+        if data is None or len(df) > len(data):
+            data = df
+
+    idx = data.index.astype(str).str.strip()
+    if idx.str.len()[0] == 6:
+        data.index = pd.to_datetime(idx, format='%Y%m').to_period('M')
+    elif idx.str.len()[0] == 8:
+        data.index = pd.to_datetime(idx, format='%Y%m%d').to_period('D')
+    data.columns = data.columns.str.strip()
+    return data.astype(float)
+
+
+def write(path: str, write_to):
+    """Write a file through a temporary one, so that readers never see it half written
+
+    The temporary file is unique, so that threads writing the same file at
+    once do not share it.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    os.close(fd)
+    try:
+        write_to(tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def write_json(path: str, obj):
+    def dump(tmp):
+        with open(tmp, 'w') as f:
+            json.dump(obj, f)
+    write(path, dump)
+
+
+class Mirror:
+    """Factor datasets of the library, mirrored to a local directory
+
+    Parameters
+    ----------
+    path : str, optional
+        Directory of the mirror, by default `.cache/famafrench`
+    """
+
+    def __init__(self, path: str = PATH):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def file(self, dataset: str, ext: str = 'parquet') -> str:
+        return os.path.join(self.path, f'{dataset}.{ext}')
+
+    @property
+    def catalog(self) -> dict:
+        """Factor datasets, datasets mirrored and time of the last refresh"""
+        try:
+            with open(self.file('catalog', 'json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'datasets': [], 'mirrored': [], 'checked': 0}
+
+    def stale(self, max_age: float = 86400) -> bool:
+        """Whether the last refresh is older than `max_age` seconds"""
+        return time.time() - self.catalog['checked'] > max_age
+
+    def list(self) -> list:
+        """Update the catalog from the library page, and return the datasets to mirror
+
+        These are the factor datasets and the momentum datasets they are
+        joined to.
+        """
+        full = set(ftk.get_all_famafrench_datasets())
+        datasets = sorted(x for x in full if PATTERN.match(x))
+        mirrored = sorted(set(datasets) | {momentum(x) for x in datasets} & full)
+        catalog = {**self.catalog, 'datasets': datasets, 'mirrored': mirrored}
+        write_json(self.file('catalog', 'json'), catalog)
+        return mirrored
+
+    def checked(self):
+        """Record that the mirror is up to date"""
+        catalog = {**self.catalog, 'checked': time.time()}
+        write_json(self.file('catalog', 'json'), catalog)
+
+    def update(self, dataset: str, timeout: float = 60) -> bool:
+        """Download `dataset` if it changed upstream, and return whether it did"""
+        path, meta_path = self.file(dataset), self.file(dataset, 'json')
+        headers = {}
+        if os.path.exists(path) and os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        response = requests.get(URL.format(dataset), headers=headers, timeout=timeout)
+        if response.status_code == 304:
+            return False
+        response.raise_for_status()
+
+        write(path, parse(response.content).to_parquet)
+        write_json(meta_path, {'etag': response.headers.get('ETag'),
+                               'last_modified': response.headers.get('Last-Modified')})
+        return True
+
+    def datasets(self) -> list:
+        """Factor datasets of the library, listed from it if the mirror has never been refreshed"""
+        if not self.catalog['datasets']:
+            self.list()
+        return self.catalog['datasets']
+
+    def read(self, dataset: str) -> pd.DataFrame:
+        """Table of `dataset`, memory-mapped from the mirror and downloaded first if missing"""
+        if not os.path.exists(self.file(dataset)):
+            self.update(dataset)
+        return pd.read_parquet(self.file(dataset), memory_map=True)
+
+    def factors(self, dataset: str, add_momentum: bool = False) -> pd.DataFrame:
+        """Factor returns with the risk-free rate last, as `toolkit.get_famafrench_factors`"""
+        freq = 'B' if 'aily' in dataset else 'M'
+        data = self.read(dataset).asfreq(freq) / 100
+        factors = data.iloc[:, :-1]
+        rfr = data.iloc[:, -1]
+        if add_momentum:
+            factors = factors.join(self.read(momentum(dataset)).asfreq(freq) / 100, how='inner')
+        return factors.join(rfr, how='inner')
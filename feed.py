@@ -0,0 +1,40 @@
+"""Latest quotes polled by the live mode of the dashboards
+
+Set the environment variable FTK_REPLAY to a CSV file of quotes, with dates
+in the first column and tickers as the other columns, to replay it one row
+per poll instead of calling Yahoo! Finance.
+"""
+import os
+import pandas as pd
+import toolkit as ftk
+
+
+class Yahoo:
+    """Latest prices from Yahoo! Finance"""
+
+    def __init__(self, tickers):
+        self.tickers = list(tickers)
+
+    def latest(self) -> tuple[pd.Timestamp, pd.Series]:
+        """Date of the latest quotes, and the price of every ticker quoted on that date"""
+        px = ftk.get_yahoo_bulk(self.tickers, '5d').dropna(how='all')
+        return px.index[-1], px.iloc[-1]
+
+
+class Replay:
+    """Quotes read from a file, one row per poll, the last row repeated once exhausted"""
+
+    def __init__(self, path: str, tickers):
+        self.quotes = pd.read_csv(path, index_col=0, parse_dates=True).reindex(columns=list(tickers))
+        self.position = 0
+
+    def latest(self) -> tuple[pd.Timestamp, pd.Series]:
+        row = self.quotes.iloc[min(self.position, len(self.quotes) - 1)]
+        self.position += 1
+        return row.name, row
+
+
+def connect(tickers) -> Yahoo | Replay:
+    """Feed of the tickers, replayed from FTK_REPLAY when it is set"""
+    path = os.environ.get('FTK_REPLAY')
+    return Replay(path, tickers) if path else Yahoo(tickers)
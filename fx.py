@@ -0,0 +1,137 @@
+import numpy as np
+import pandas as pd
+
+
+class CrossRates:
+    """Exchange rates of every pair of currencies, from their rates against a base currency
+
+    The rates are kept as one array of shape (dates, currencies). A cross
+    rate is the ratio of two columns, so any matrix of cross rates or of
+    their changes is an outer division computed when it is needed. Running
+    sums of the log returns and of their cross-products give the covariance
+    of any period from two rows, whatever its length.
+
+    Parameters
+    ----------
+    rates : pd.DataFrame
+        Units of every currency per unit of `base`, indexed by date with ISO
+        codes as columns
+    base : str, optional
+        ISO code of the base currency, by default 'USD'
+    """
+
+    def __init__(self, rates: pd.DataFrame, base: str = 'USD'):
+        rates = rates.drop(columns=base, errors='ignore')
+        self.dates = rates.index
+        self.codes = pd.Index([base]).append(rates.columns)
+        self.values = np.hstack([np.ones((len(rates), 1)), rates.to_numpy(dtype=float)])
+        returns = np.vstack([np.zeros((1, len(self.codes))), np.diff(np.log(self.values), axis=0)])
+        self.sums = returns.cumsum(axis=0)
+        self.products = (returns[:, :, None] * returns[:, None, :]).cumsum(axis=0)
+
+    def loc(self, date) -> int:
+        return self.dates.get_loc(date)
+
+    def cross(self, date) -> np.ndarray:
+        """Units of the foreign currency (column) per unit of the domestic currency (row)"""
+        rate = self.values[self.loc(date)]
+        return rate[None, :] / rate[:, None]
+
+    def change(self, start, end) -> np.ndarray:
+        """Change of every cross rate from `start` to `end`"""
+        growth = self.values[self.loc(end)] / self.values[self.loc(start)]
+        return growth[None, :] / growth[:, None] - 1
+
+    def series(self, domestic: str, foreign: str) -> pd.Series:
+        """Cross rate of one pair at every date"""
+        i, j = self.codes.get_loc(domestic), self.codes.get_loc(foreign)
+        return pd.Series(self.values[:, j] / self.values[:, i], index=self.dates, name=f'{domestic}/{foreign}')
+
+    def patch(self, date, rates: pd.Series):
+        """Write the rates quoted on `date` into the last row, or into a new row after it
+
+        The running sums of the returns are updated for that row alone.
+        Rates older than the last row are ignored, and currencies not quoted
+        keep their last rate.
+        """
+        if date < self.dates[-1]:
+            return self
+        if date > self.dates[-1]:
+            self.dates = self.dates.append(pd.Index([date]))
+            self.values, self.sums, self.products = (np.concatenate([a, a[-1:]])
+                                                     for a in (self.values, self.sums, self.products))
+        q = rates.reindex(self.codes[1:]).to_numpy(dtype=float)
+        self.values[-1, 1:] = np.where(np.isnan(q), self.values[-1, 1:], q)
+        if len(self.dates) == 1:
+            # The first row has no return
+            return self
+        r = np.log(self.values[-1] / self.values[-2])
+        self.sums[-1] = self.sums[-2] + r
+        self.products[-1] = self.products[-2] + np.outer(r, r)
+        return self
+
+    def covariance(self, start, end) -> np.ndarray:
+        """Covariance of the daily log returns against the base currency, from `start` to `end`"""
+        i, j = self.loc(start), self.loc(end)
+        n = max(j - i, 2)
+        total = self.sums[j] - self.sums[i]
+        return (self.products[j] - self.products[i] - np.outer(total, total) / n) / (n - 1)
+
+    def volatility(self, start, end, periods: int = 252) -> np.ndarray:
+        """Annualized volatility of every cross rate from `start` to `end`
+
+        The log return of a cross rate is the difference of the returns of its
+        two currencies, so its variance follows from their covariance.
+        """
+        cov = self.covariance(start, end)
+        var = np.diag(cov)
+        return np.sqrt(np.maximum(var[:, None] + var[None, :] - 2 * cov, 0) * periods)
+
+    def correlation(self, start, end) -> np.ndarray:
+        """Correlation of the returns of the currencies against the base currency, NaN for the base"""
+        cov = self.covariance(start, end)
+        std = np.sqrt(np.diag(cov))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.clip(cov / np.outer(std, std), -1, 1)
+
+
+def convert(prices: pd.DataFrame, currency: pd.Series, rates: pd.DataFrame, bases) -> dict[str, pd.DataFrame]:
+    """Prices converted from their own currencies to every base currency at once
+
+    Every column is divided by the rate of its currency, picked by position,
+    and multiplied by the rate of each base currency in one broadcast. Rates
+    missing on a date are filled with the last quote, as in
+    `toolkit.convert_fx`. Raises a KeyError naming any currency of an asset,
+    or base currency, without rates.
+
+    Parameters
+    ----------
+    prices : pd.DataFrame
+        Prices by date and asset, in the currency of the asset
+    currency : pd.Series
+        ISO code of the currency of every asset
+    rates : pd.DataFrame
+        Units of every currency per US dollar, with ISO codes as columns
+        including 'USD'
+    bases : list of str
+        ISO codes of the base currencies
+
+    Returns
+    -------
+    dict[str, pd.DataFrame]
+        Converted prices by base currency
+    """
+    codes = currency.reindex(prices.columns)
+    own, base = rates.columns.get_indexer(codes), rates.columns.get_indexer(bases)
+    if codes.isna().any():
+        raise KeyError(f'No currency for {", ".join(map(str, codes.index[codes.isna()]))}')
+    if (own < 0).any() or (base < 0).any():
+        missing = sorted(set(codes[own < 0]) | set(np.asarray(bases)[base < 0]))
+        raise KeyError(f'No exchange rate for {", ".join(missing)}')
+
+    rates = rates.reindex(prices.index).ffill()
+    values = rates.to_numpy(dtype=float)
+    usd = prices.to_numpy(dtype=float) / values[:, own]
+    converted = usd[None] * values[:, base].T[:, :, None]
+    return {base: pd.DataFrame(converted[i], index=prices.index, columns=prices.columns)
+            for i, base in enumerate(bases)}
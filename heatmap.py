@@ -2,8 +2,32 @@ import streamlit as st
 import altair as alt
 import numpy as np
 import pandas as pd
+from scipy.cluster.hierarchy import leaves_list, linkage
+from scipy.spatial.distance import squareform
 import toolkit as ftk
-from utils import redis_cache
+from utils import fetch, redis_cache
+
+
+def get_msci(codes) -> pd.DataFrame:
+    """MSCI indices in a single request, retried on failure"""
+    loaded, failed = fetch({'MSCI': lambda: ftk.get_msci(codes, variant='GRTR')}, timeout=60)
+    if failed:
+        raise failed['MSCI']
+    return loaded['MSCI']
+
+
+def get_withintelligence(codes) -> pd.DataFrame:
+    """WithIntelligence indices fetched concurrently, retried on failure
+
+    Raises if any index cannot be fetched, so that an incomplete table is
+    never cached.
+    """
+    loaded, failed = fetch({code: lambda code=code: ftk.get_withintelligence(code) for code in codes},
+                           timeout=60)
+    if failed:
+        missing = ', '.join(map(str, failed))
+        raise RuntimeError(f'Indices {missing} could not be fetched') from next(iter(failed.values()))
+    return pd.concat([loaded[code] for code in codes], axis=1)
 
 
 @redis_cache(ttl=15 * 24 * 60 * 60)
@@ -88,7 +112,7 @@ def get_data(dataset: str) -> pd.DataFrame:
                 971000: 'S. Africa',
                 903200: 'Argentina'
             }
-            df = ftk.get_msci(sectors.keys(), variant='GRTR').dropna()
+            df = get_msci(sectors.keys()).dropna()
             df.columns = sectors.values()
             df.columns.name = 'Category'
 
@@ -109,7 +133,7 @@ def get_data(dataset: str) -> pd.DataFrame:
                 106754: 'Util',
                 132082: 'R/E'
             }
-            df = ftk.get_msci(sectors.keys(), variant='GRTR').dropna()
+            df = get_msci(sectors.keys()).dropna()
             df.columns = sectors.values()
             df.columns.name = 'Category'
 
@@ -126,14 +150,14 @@ def get_data(dataset: str) -> pd.DataFrame:
                 129859: 'Size',
                 729745: 'Growth'
             }
-            df = ftk.get_msci(factors.keys(), variant='GRTR').dropna()
+            df = get_msci(factors.keys()).dropna()
             df.columns = factors.values()
             df.columns.name = 'Category'
 
             desc = 'Returns for the major MSCI ACWI factors.'
 
         case 'Hedge Fund - Asia':
-            df = ftk.get_withintelligence_bulk(
+            df = get_withintelligence(
                 [11425, 11449, 11431, 11451, 11454, 11453, 11450, 11430, 11443, 11452])
             df = df.rename(columns={
                 'With Intelligence Asia Equity Hedge Fund Index': 'Equity',
@@ -156,7 +180,7 @@ def get_data(dataset: str) -> pd.DataFrame:
             desc = 'Global strategy returns from the WithIntelligence Hedge Fund Index.'
 
         case 'Hedge Fund - Global':
-            df = ftk.get_withintelligence_bulk(
+            df = get_withintelligence(
                 [11469, 11475, 11470, 11471, 11420, 11473, 11474, 11454, 11486])
             df = df.rename(columns={
                 'With Intelligence Hedge Fund Index': 'HF',
@@ -183,6 +207,135 @@ def get_data(dataset: str) -> pd.DataFrame:
     return df, desc
 
 
+# Periods of the periodic table, as period frequency and label format
+freq_options = {
+    'Monthly': ('M', '%Y-%m'),
+    'Quarterly': ('Q', '%Y Q%q'),
+    'Annually': ('Y', '%Y')
+}
+
+horizons = {
+    '1 Mo': 1,
+    '3 Mo': 3,
+    '6 Mo': 6,
+    '1 Yr': 12,
+    '2 Yr': 24,
+    '3 Yr': 36,
+    '4 Yr': 48,
+    '5 Yr': 60,
+    '6 Yr': 72,
+    '7 Yr': 84,
+    '8 Yr': 96,
+    '9 Yr': 108,
+    '10 Yr': 120
+}
+
+
+def dense_rank(x: np.ndarray, mask: np.ndarray = None, descending: bool = False) -> np.ndarray:
+    """Dense ranks along the last axis among the elements in `mask`, NaN elsewhere
+
+    Every element is compared with the first occurrence of every other value,
+    which suits the few categories of a periodic table.
+    """
+    mask = ~np.isnan(x) if mask is None else mask & ~np.isnan(x)
+    first = ~np.tril(x[..., :, None] == x[..., None, :], -1).any(axis=-1)
+    other = x[..., None, :] > x[..., :, None] if descending else x[..., None, :] < x[..., :, None]
+    rank = (other & (first & mask)[..., None, :]).sum(axis=-1) + 1.
+    return np.where(mask, rank, np.nan)
+
+
+def rank(returns: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Absolute ranks, and relative ranks to zero then to every category
+
+    Relative ranks count up from the reference among the returns above it
+    and down from it among those below.
+    """
+    rel = returns[None] - np.vstack([np.zeros((1,) + returns.shape[:-1]), np.moveaxis(returns, -1, 0)])[..., None]
+    pos = rel >= 0
+    relative = np.where(pos, dense_rank(rel, pos), -dense_rank(rel, ~pos, descending=True))
+    return dense_rank(returns).astype(np.float32), relative.astype(np.float32)
+
+
+@st.cache_data(ttl=3600)
+def get_cube(dataset: str) -> dict:
+    """Returns and ranks of every period of the periodic table, by period
+
+    The returns of any period are differences of the cumulative log returns,
+    so the calendar periods and the trailing horizons come from one running
+    sum. Trailing returns are kept with and without annualization, which
+    does not change their ranks.
+    """
+    raw, _ = get_data(dataset)
+    log = np.vstack([np.zeros((1, raw.shape[1])), np.nan_to_num(np.log1p(raw.to_numpy(dtype=float))).cumsum(axis=0)])
+    cube = {}
+    for freq, (f, fmt) in freq_options.items():
+        periods = raw.index.asfreq(f)
+        end = np.flatnonzero(np.append(periods[1:] != periods[:-1], True)) + 1
+        start = np.concatenate([[0], end[:-1]])
+        returns = np.expm1(log[end] - log[start])
+        cube[freq] = (periods[end - 1].strftime(fmt), returns.astype(np.float32), *rank(returns))
+
+    months = np.array([m for m in horizons.values() if m <= len(raw)], dtype=int)
+    total = log[-1] - log[-1 - months]
+    scale = 12 / np.where(months > 12, months, 12)[:, None]
+    returns = np.stack([np.expm1(total), np.expm1(total * scale)])
+    cube['Trailing'] = (pd.Index(list(horizons)[:len(months)]), returns.astype(np.float32), *rank(returns[0]))
+    cube['Categories'] = raw.columns
+    return cube
+
+
+def get_table(dataset: str, freq: str, display: str, category: str, annualize: bool) -> pd.DataFrame:
+    """Slice of the cube in long format, with the label, category, return and rank of every cell"""
+    cube = get_cube(dataset)
+    labels, returns, absolute, relative = cube[freq]
+    columns = cube['Categories']
+    if freq == 'Trailing':
+        returns = returns[int(annualize)]
+    ranks = absolute if display == 'Absolute' else relative[0 if category == 'Zero' else columns.get_loc(category) + 1]
+    table = pd.DataFrame({
+        'Date': np.repeat(labels, len(columns)),
+        'Category': np.tile(columns, len(labels)),
+        'Return': returns.ravel(),
+        'Rank': ranks.ravel()
+    })
+    return table.dropna(subset=['Return', 'Rank'])
+
+
+@st.cache_data(ttl=3600)
+def get_correlations(dataset: str, window: int) -> tuple[pd.PeriodIndex, np.ndarray, np.ndarray]:
+    """Correlations of the categories over every window of `window` periods, and their clustered order
+
+    The covariance of every window is a difference of running sums of the
+    returns and of their cross-products, so all windows come at once. The
+    categories are ordered by average-linkage clustering of the correlations
+    over the whole history, which keeps the order fixed while scrubbing.
+
+    Returns
+    -------
+    tuple[pd.PeriodIndex, np.ndarray, np.ndarray]
+        End of every window, correlations of shape (windows, categories,
+        categories) and the order of the categories
+    """
+    raw, _ = get_data(dataset)
+    r = np.nan_to_num(raw.to_numpy(dtype=float))
+    sums = np.vstack([np.zeros((1, r.shape[1])), r.cumsum(axis=0)])
+    products = np.concatenate([np.zeros((1,) + r.shape[1:] * 2), (r[:, :, None] * r[:, None, :]).cumsum(axis=0)])
+
+    def correlation(start, end):
+        n = (end - start)[..., None, None]
+        total = sums[end] - sums[start]
+        cov = products[end] - products[start] - total[..., :, None] * total[..., None, :] / n
+        std = np.sqrt(np.diagonal(cov, axis1=-2, axis2=-1))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.clip(cov / (std[..., :, None] * std[..., None, :]), -1, 1)
+
+    end = np.arange(window, len(r) + 1)
+    full = np.nan_to_num(correlation(np.array(0), np.array(len(r))))
+    np.fill_diagonal(full, 1)
+    order = leaves_list(linkage(squareform(1 - full, checks=False), method='average'))
+    return raw.index[end - 1], correlation(end - window, end).astype(np.float32), order
+
+
 category = 'Zero'
 
 with st.sidebar:
@@ -190,13 +343,12 @@ with st.sidebar:
     dataset = st.selectbox(
         'Data', ['Asset Classes', 'MSCI Regions/Countries', 'MSCI ACWI Sectors', 'MSCI ACWI Factors', 'Hedge Fund - Asia', 'Hedge Fund - Global', 'Random'], 0)
     raw, desc = get_data(dataset)
-    data = raw.copy()
 
     freq = st.segmented_control(
-        'Period', ['Monthly', 'Quarterly', 'Annually', 'Trailing'], default=['Annually'])
+        'Period', ['Monthly', 'Quarterly', 'Annually', 'Trailing'], default=['Annually']) or 'Trailing'
 
     categories = ['Zero']
-    categories.extend(data.columns)
+    categories.extend(raw.columns)
     display = st.segmented_control(
         'Rank', ['Absolute', 'Relative'], default='Absolute')
     if display == 'Relative':
@@ -208,72 +360,8 @@ with st.sidebar:
         decimal = 0
     annualize = st.toggle('Annualize', value=True)
 
-# Aggregate
-freq_options = {
-    'Monthly': ('ME', '%Y-%m'),
-    'Quarterly': ('QE', '%Y Q%q'),
-    'Annually': ('YE', '%Y')
-}
-
-horizons = {
-    '1 Mo': 1,
-    '3 Mo': 3,
-    '6 Mo': 6,
-    '1 Yr': 12,
-    '2 Yr': 24,
-    '3 Yr': 36,
-    '4 Yr': 48,
-    '5 Yr': 60,
-    '6 Yr': 72,
-    '7 Yr': 84,
-    '8 Yr': 96,
-    '9 Yr': 108,
-    '10 Yr': 120
-}
-
-if freq in freq_options:
-    data = data.groupby(pd.Grouper(freq=freq_options[freq][0])).apply(
-        lambda r: np.expm1(np.log1p(r).sum()))
-else:
-    data = pd.DataFrame({
-        horizon: np.expm1(np.log1p(data.tail(months)).sum()
-                          * 12 / (months if annualize and months > 12 else 12))
-        for horizon, months in horizons.items() if len(data) >= months
-    }).T
-    data.index.name = 'Date'
-
-# Reshape to long format
-data = data.stack().to_frame('Return')
-data['Percent'] = data['Return'].map(f"{{:.{decimal}%}}".format)
-
-# Reference asset
-ref = data[data.index.get_level_values(1) == category][['Return']].rename(
-    columns={'Return': 'Ref'}
-).droplevel(1)
-
-if category == 'Zero':
-    data['Ref'] = 0
-else:
-    data = data.join(ref, how='left')
-data['Rel'] = data['Return'] - data['Ref']
-
-# Rank
-data['Rank'] = np.nan
-pos = data['Rel'] >= 0
-neg = data['Rel'] < 0
-if display == 'Absolute':
-    data['Rank'] = data.groupby('Date')['Return'].rank(
-        ascending=True, method='dense')
-else:
-    data.loc[pos, 'Rank'] = data[pos].groupby(
-        'Date')['Rel'].rank(ascending=True, method='dense')
-    data.loc[neg, 'Rank'] = - \
-        data[neg].groupby('Date')['Rel'].rank(ascending=False, method='dense')
-data = data.reset_index()
-if freq in freq_options:
-    data['Date'] = data['Date'].dt.strftime(freq_options[freq][1])
-else:
-    data['Months'] = data['Date'].map(horizons)
+data = get_table(dataset, freq, display, category, annualize)
+labels = get_cube(dataset)[freq][0]
 
 # Chart Formatting
 height = (data['Rank'].max() - data['Rank'].min()) * 30 + 150
@@ -288,32 +376,55 @@ st.title('Periodic Table')
 st.markdown(f'### {dataset}')
 st.markdown(desc)
 
-# Chart
-base = alt.Chart(data)
-xaxis = alt.X('Date:N', axis=alt.Axis(title=None)) if freq in freq_options else alt.X(
-    'Date', axis=alt.Axis(title=None), sort=alt.SortField('Months:O', order='ascending'))
-heatmap = base.mark_rect().encode(
-    x=xaxis,
-    y=alt.Y('Rank:O', axis=None, sort='descending'),
-    color=alt.Color('Return:Q', scale=scale, title='Return', legend=alt.Legend(
-        format='.0%')) if color == 'Return' else alt.Color('Category:N', title='Category'),
-).properties(
-    height=height,
-    width=width
-)
-text1 = base.mark_text(dy=-7, fontWeight='bold').encode(
-    x=xaxis,
-    y=alt.Y('Rank:O', sort='descending', axis=None),
-    text='Category:N'
-)
-text2 = base.mark_text(dy=7).encode(
-    x=xaxis,
-    y=alt.Y('Rank:O', sort='descending', axis=None),
-    text='Percent:N'
-)
-chart = heatmap + text1 + text2
-st.altair_chart(chart, width='content')
-st.write('Data as of:', raw.index[-1])
+tab1, tab2 = st.tabs(['Periodic Table', 'Correlation'])
+
+with tab1:
+    # Chart
+    base = alt.Chart(data)
+    xaxis = alt.X('Date:N', axis=alt.Axis(title=None), sort=list(labels))
+    heatmap = base.mark_rect().encode(
+        x=xaxis,
+        y=alt.Y('Rank:O', axis=None, sort='descending'),
+        color=alt.Color('Return:Q', scale=scale, title='Return', legend=alt.Legend(
+            format='.0%')) if color == 'Return' else alt.Color('Category:N', title='Category'),
+    ).properties(
+        height=height,
+        width=width
+    )
+    text1 = base.mark_text(dy=-7, fontWeight='bold').encode(
+        x=xaxis,
+        y=alt.Y('Rank:O', sort='descending', axis=None),
+        text='Category:N'
+    )
+    text2 = base.mark_text(dy=7).encode(
+        x=xaxis,
+        y=alt.Y('Rank:O', sort='descending', axis=None),
+        text=alt.Text('Return:Q', format=f'.{decimal}%')
+    )
+    chart = heatmap + text1 + text2
+    st.altair_chart(chart, width='content')
+    st.write('Data as of:', raw.index[-1])
+
+with tab2:
+    col1, col2 = st.columns(2)
+    window = col1.select_slider('Rolling window (months)', options=[w for w in [12, 24, 36, 60] if w < len(raw)] or [len(raw)],
+                                value=next((w for w in [36, 24, 12] if w < len(raw)), len(raw)))
+    ends, correlations, order = get_correlations(dataset, window)
+    end = col2.select_slider('Window ending', options=ends, value=ends[-1], format_func=str)
+    names = raw.columns[order]
+    matrix = pd.DataFrame(correlations[ends.get_loc(end)][np.ix_(order, order)], index=names, columns=names)
+    matrix = matrix.rename_axis('Category').reset_index().melt(id_vars='Category', var_name='Other', value_name='Correlation')
+    grid = alt.Chart(matrix).encode(
+        x=alt.X('Other:N', sort=list(names), title=None),
+        y=alt.Y('Category:N', sort=list(names), title=None))
+    st.altair_chart((grid.mark_rect().encode(
+        color=alt.Color('Correlation:Q', scale=alt.Scale(domain=[-1, 0, 1], range=['blue', '#fefefe', 'red']))
+    ) + grid.mark_text().encode(
+        text=alt.Text('Correlation:Q', format='.2f')
+    )).properties(
+        height=len(names) * 40 + 50,
+        width=len(names) * 60 + 100
+    ), width='content')
 
 with st.expander('Data', expanded=False):
     st.write(raw.style.format("{:.2%}"))
@@ -1,8 +1,11 @@
-import numpy as np
+import copy
 import pandas as pd
 import streamlit as st
 import altair as alt
 import toolkit as ftk
+import feed
+import fx
+from panel import Panel
 
 
 @st.cache_data(ttl=3600)
@@ -12,6 +15,70 @@ def get_data():
     return data, px
 
 
+def convert(px: pd.DataFrame, data: pd.DataFrame) -> dict[str, pd.DataFrame]:
+    """Prices in local currency under 'Local', and in every base currency
+
+    A currency is treated as an asset worth one unit of itself, so that
+    it is converted with the indices.
+    """
+    px = px.assign(**{'USD=X': 1.})
+    is_fx = px.columns.str.endswith('=X')
+    rates = px.loc[:, is_fx].rename(columns=lambda ticker: ticker[:-2])
+    currency = data['Currency'].where(~data.index.str.endswith('=X'), data.index.str[:-2])
+    bases = sorted(set(data['Currency'].dropna()))
+    return {'Local': px, **fx.convert(px.assign(**{ticker: 1. for ticker in px.columns[is_fx]}), currency, rates, bases)}
+
+
+@st.cache_resource(ttl=3600)
+def get_adjusted() -> dict[str, Panel]:
+    """Panels of the prices in every base currency, and in local currency under 'Local'
+
+    Shared by all sessions without copying, so they must not be modified.
+    """
+    data, px = get_data()
+    return {base: Panel(prices) for base, prices in convert(px, data).items()}
+
+
+def view(panel: Panel, group: str, date, lookback: int, custom: tuple) -> pd.DataFrame:
+    """Table of the instruments of one group as of `date`, with their sparklines"""
+    t = data[data.Group == group]
+    idx = panel.columns.get_indexer(t.index)
+    table = pd.DataFrame({
+        'MTD': panel.period_return(date - pd.offsets.MonthEnd(), date) * 100,
+        'QTD': panel.period_return(date - pd.offsets.QuarterEnd(), date) * 100,
+        'YTD': panel.period_return(date - pd.offsets.YearEnd(), date) * 100,
+        'Custom': panel.period_return(*custom) * 100,
+        'Last': panel.price(date),
+        'As of': panel.as_of(date),
+    }).reindex(t.index)
+    table['chart'] = panel.window(date, lookback)[idx].tolist()
+    table = pd.concat([t, table], axis=1)
+    table['flag'] = table['Country'].apply(lambda c: get_flag(c))
+    table['As of'] = table['As of'].apply(
+        lambda d: None if pd.isnull(d) else d.strftime('%b %d'))
+    return table
+
+
+@st.cache_data(ttl=3600)
+def get_view(base: str, group: str, date, lookback: int, custom: tuple) -> pd.DataFrame:
+    return view(get_adjusted()[base], group, date, lookback, custom)
+
+
+def refresh(panels: dict[str, Panel], source, data: pd.DataFrame):
+    """Patch the last row of every panel with the latest quotes
+
+    Instruments not quoted keep their last price, which is still used to
+    convert the ones quoted.
+    """
+    date, quotes = source.latest()
+    local = panels['Local']
+    quotes = quotes.reindex(local.columns)
+    quoted = quotes.notna()
+    row = quotes.fillna(local.price(date)).to_frame(date).T
+    for base, prices in convert(row, data).items():
+        panels[base].patch(date, prices.iloc[0].where(quoted))
+
+
 # https://flagsapi.com/{x}/flat/64.png as backup (no flag for Europe/ASEAN)
 def get_flag(code):
     if isinstance(code, str):
@@ -24,11 +91,16 @@ data, px = get_data()
 
 with st.sidebar:
 
+    live = st.toggle('Live', help='Poll the latest quotes and update the prices in place')
+    interval = st.select_slider('Refresh every (seconds)', options=[5, 15, 30, 60, 300], value=30,
+                                disabled=not live)
+
     date = st.select_slider(
         'As of',
         options=px.index,
         value=px.index[-1],
-        format_func=lambda d: d.strftime('%Y-%m-%d'))
+        format_func=lambda d: d.strftime('%Y-%m-%d'),
+        disabled=live)
 
     currencies = ['Local']
     currencies.extend(sorted(set(data.Currency.dropna())))
@@ -51,87 +123,75 @@ with st.sidebar:
 
     lookback = st.slider('Sparkline lookback (days)', 5, 252, 252)
 
+    custom = st.select_slider(
+        'Custom period',
+        options=px.index,
+        value=(px.index[-64], px.index[-1]),
+        format_func=lambda d: d.strftime('%Y-%m-%d'))
 
-# Adjust the prices
-def getFX(c):
-    return px.loc[:, f'{data.loc[c].Currency}=X']
-
-
-usd = pd.Series(np.ones(len(px)), index=px.index)
-px['USD=X'] = usd
-if base != 'Local':
-
-    foreign_fx = px.apply(lambda column: getFX(column.name))
-    domestic_fx = px.loc[:, f'{base}=X']
-
-    adj_fx = px.filter(regex='=X$', axis=1).apply(
-        lambda x: ftk.convert_fx(domestic_fx, x, usd))
-    adj_px = px.filter(regex='.*(?<!=X)$', axis=1).apply(
-        lambda x: ftk.convert_fx(x, foreign_fx[x.name], domestic_fx))
-
-    adjusted = pd.concat([adj_fx, adj_px], axis=1)
 
-else:
-    adjusted = px
+# Live mode patches its own copy of the panels, kept for the session
+if live and 'indices' not in st.session_state:
+    st.session_state['indices'] = copy.deepcopy(get_adjusted()), feed.connect(px.columns)
+elif not live:
+    st.session_state.pop('indices', None)
 
-# Prepare the table
-begin_m = date - pd.offsets.MonthEnd()
-begin_q = date - pd.offsets.QuarterEnd()
-begin_y = date - pd.offsets.YearEnd()
+st.title('Equity Dashboard')
 
-table = pd.DataFrame({
-    'MTD': ftk.compound_return(adjusted[begin_m:date].ffill()) * 100,
-    'QTD': ftk.compound_return(adjusted[begin_q:date].ffill()) * 100,
-    'YTD': ftk.compound_return(adjusted[begin_y:date].ffill()) * 100,
-    'Last': adjusted[:date].stack().groupby(level=1).last(),
-    'As of': adjusted[:date].aggregate(pd.Series.last_valid_index),
-    'chart': pd.Series(adjusted.ffill()[:date].iloc[-lookback:].T.values.tolist(), index=adjusted.columns)
-})
-table = pd.concat([data, table], axis=1)
-table['flag'] = table['Country'].apply(lambda c: get_flag(c))
-table['As of'] = table['As of'].apply(
-    lambda d: None if pd.isnull(d) else d.strftime('%b %d'))
 
-groups = ['America', 'Asia', 'EMEA', 'Currency', 'Commodity', 'Crypto']
-horizons = ['MTD', 'QTD', 'YTD']
+@st.fragment(run_every=interval if live else None)
+def dashboard(date):
+    groups = ['America', 'Asia', 'EMEA', 'Currency', 'Commodity', 'Crypto']
+    horizons = ['MTD', 'QTD', 'YTD', 'Custom']
 
-st.title('Equity Dashboard')
+    # Only the selected group is built and sent
+    group = st.segmented_control('Group', groups, default=groups[0], label_visibility='collapsed') or groups[0]
 
-tabs = st.tabs(groups)
-
-for i, group in enumerate(groups):
-    with tabs[i]:
-        t = table[table.Group == group]
-
-        col1, col2 = st.columns(2)
-
-        htabs = col2.tabs(horizons)
-        for j, horizon in enumerate(horizons):
-            with htabs[j]:
-                c = (alt.Chart(t)
-                     .mark_bar()
-                     .encode(
-                    y=alt.X('Name', sort='-x'),
-                    x=alt.Y(horizon),
-                    color=alt.Color('Country')
-                )
-                )
-                st.altair_chart(c)
-
-        col1.dataframe(t,
-                       hide_index=True,
-                       column_order=['flag', 'Name', 'MTD',
-                                     'QTD', 'YTD', 'Last', 'As of', 'chart'],
-                       column_config={
-                           'flag': st.column_config.ImageColumn(''),
-                           'MTD': st.column_config.NumberColumn(format='%.2f'),
-                           'QTD': st.column_config.NumberColumn(format='%.2f'),
-                           'YTD': st.column_config.NumberColumn(format='%.2f'),
-                           'Last': st.column_config.NumberColumn(format='%.2f'),
-                           'chart': st.column_config.LineChartColumn(f'Last {lookback} Trading Days'),
-                       })
-
-with st.expander('Data', expanded=False):
-    st.write(adjusted)
+    if live:
+        panels, source = st.session_state['indices']
+        try:
+            refresh(panels, source, data)
+        except Exception:
+            st.toast('Unable to fetch the latest quotes')
+        panel = panels[base]
+        date = panel.dates[-1]
+        t = view(panel, group, date, lookback, custom)
+    else:
+        panel = get_adjusted()[base]
+        t = get_view(base, group, date, lookback, custom)
+
+    col1, col2 = st.columns(2)
+
+    horizon = col2.segmented_control('Horizon', horizons, default=horizons[0],
+                                     label_visibility='collapsed') or horizons[0]
+    c = (alt.Chart(t)
+         .mark_bar()
+         .encode(
+        y=alt.X('Name', sort='-x'),
+        x=alt.Y(horizon),
+        color=alt.Color('Country')
+    )
+    )
+    col2.altair_chart(c)
+
+    col1.dataframe(t,
+                   hide_index=True,
+                   column_order=['flag', 'Name', 'MTD',
+                                 'QTD', 'YTD', 'Custom', 'Last', 'As of', 'chart'],
+                   column_config={
+                       'flag': st.column_config.ImageColumn(''),
+                       'MTD': st.column_config.NumberColumn(format='%.2f'),
+                       'QTD': st.column_config.NumberColumn(format='%.2f'),
+                       'YTD': st.column_config.NumberColumn(format='%.2f'),
+                       'Custom': st.column_config.NumberColumn(format='%.2f'),
+                       'Last': st.column_config.NumberColumn(format='%.2f'),
+                       'chart': st.column_config.LineChartColumn(f'Last {lookback} Trading Days'),
+                   })
+
+    with st.expander('Data', expanded=False):
+        st.write(panel.prices[t.index])
+
+
+dashboard(date)
 
 st.markdown(open('data/signature.md').read())
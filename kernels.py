@@ -0,0 +1,205 @@
+"""Loop kernels compiled with Numba when it is installed
+
+Every kernel has a vectorized NumPy counterpart at its call site, which is
+used when Numba is missing or when the environment variable FTK_JIT is set
+to 0. The machine code is cached on disk next to this module, so only the
+first run after a change pays for the compilation, and `warmup` loads it
+before the first page needs it.
+"""
+import math
+import os
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+ENABLED = numba is not None and os.environ.get('FTK_JIT', '1').lower() not in ('0', 'false', 'no')
+
+# Instrument codes of `greeks`, any other code is valued at zero
+CALL, PUT, STOCK, DEBT = 0, 1, 2, 3
+
+SQRT_2 = math.sqrt(2)
+SQRT_2PI = math.sqrt(2 * math.pi)
+
+
+def jit(func):
+    """Compile in nopython mode with NumPy semantics for division, or leave as is"""
+    if numba is None:
+        return func
+    return numba.njit(cache=True, error_model='numpy')(func)
+
+
+def contiguous(*arrays, dtype=float) -> list[np.ndarray]:
+    """Writable C-contiguous copies where needed, so that every call of a kernel shares one compiled signature"""
+    return [np.require(x, dtype=dtype, requirements=['C', 'W']) for x in arrays]
+
+
+def warmup():
+    """Compile or load every kernel from the cache, on inputs of the types of their call sites"""
+    if not ENABLED:
+        return
+    one, grid = np.ones(1), np.ones((1, 1))
+    greeks(np.zeros(1, dtype=np.int64), one, one, one, one, one, grid, one)
+    fund(one, grid, 1., one, grid, grid, 0., 1., 1, 1)
+    frongello(grid, grid, 1.)
+
+
+@jit
+def fund(start: np.ndarray, rates: np.ndarray, dt: float, inflow: np.ndarray, other: np.ndarray, liabilities: np.ndarray, lo: float, hi: float, bins: int, samples: int):
+    """Cash account and funding ratio statistics of `surplus.Surplus` in one pass
+
+    Parameters
+    ----------
+    start : np.ndarray
+        Initial cash of every scenario
+    rates : np.ndarray
+        Continuously compounded short rates, shape (steps, scenarios)
+    dt : float
+        Length of a step
+    inflow : np.ndarray
+        Cash received at every step, negative when paid
+    other : np.ndarray
+        Value of the other assets, shape (steps, scenarios)
+    liabilities : np.ndarray
+        Value of the liabilities, shape (steps, scenarios)
+    lo, hi : float
+        Range of the funding ratio histogram
+    bins : int
+        Number of bins of the histogram
+    samples : int
+        Number of sample paths kept
+
+    Returns
+    -------
+    Counts of the histogram, minimum, maximum and capped sum of the funding
+    ratio, number of scenarios with liabilities, number of shortfalls and of
+    scenarios underfunded so far at every step, the sample paths of the
+    funding ratio, NaN without liabilities, and the final cash
+    """
+    steps, scenarios = liabilities.shape
+    counts = np.zeros((steps, bins), dtype=np.int64)
+    low = np.full(steps, np.inf)
+    high = np.full(steps, -np.inf)
+    total = np.zeros(steps)
+    live = np.zeros(steps, dtype=np.int64)
+    shortfall = np.zeros(steps, dtype=np.int64)
+    underfunded = np.zeros(steps, dtype=np.int64)
+    sample = np.empty((steps, min(samples, scenarios)))
+    cash = start + inflow[0]
+    ever = np.zeros(scenarios, dtype=np.bool_)
+    scale = bins / (hi - lo)
+    for i in range(steps):
+        for j in range(scenarios):
+            if i > 0:
+                cash[j] = cash[j] * math.exp(rates[i - 1, j] * dt) + inflow[i]
+            assets = cash[j] + other[i, j]
+            liability = liabilities[i, j]
+            ratio = np.nan
+            if liability > 0:
+                ratio = assets / liability
+                idx = int((ratio - lo) * scale)
+                counts[i, min(max(idx, 0), bins - 1)] += 1
+                low[i] = min(low[i], ratio)
+                high[i] = max(high[i], ratio)
+                total[i] += min(ratio, hi)
+                live[i] += 1
+            if assets - liability < -1e-9 * abs(liability):
+                shortfall[i] += 1
+                ever[j] = True
+            if ever[j]:
+                underfunded[i] += 1
+            if j < samples:
+                sample[i, j] = ratio
+    return counts, low, high, total, live, shortfall, underfunded, sample, cash
+
+
+@jit
+def greeks(code: np.ndarray, strike: np.ndarray, qty: np.ndarray, spot: np.ndarray, rate: np.ndarray, time: np.ndarray, vol: np.ndarray, dvd: np.ndarray) -> np.ndarray:
+    """Black-Scholes value and Greeks of every leg at every point, one leg and point at a time
+
+    Parameters
+    ----------
+    code : np.ndarray
+        Instrument code of every leg
+    strike, qty : np.ndarray
+        Strike and quantity of every leg
+    spot, rate, time, dvd : np.ndarray
+        Market inputs of every point, flattened
+    vol : np.ndarray
+        Volatility, shape (legs, points)
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (5, legs, points) scaled by quantity
+    """
+    legs, points = len(code), len(spot)
+    out = np.zeros((5, legs, points))
+    for k in range(legs):
+        w = -1. if code[k] == PUT else 1.
+        for j in range(points):
+            s, r, t, q, v = spot[j], rate[j], time[j], dvd[j], vol[k, j]
+            disc_q = math.exp(-q * t)
+            strike_r = strike[k] * math.exp(-r * t)
+            if code[k] == CALL or code[k] == PUT:
+                sqrt_t = math.sqrt(t)
+                vol_t = v * sqrt_t
+                d1 = (np.log(s / strike[k]) + (r - q + v * v / 2) * t) / vol_t
+                d2 = d1 - vol_t
+                cdf1 = math.erfc(-w * d1 / SQRT_2) / 2
+                cdf2 = math.erfc(-w * d2 / SQRT_2) / 2
+                pdf1 = math.exp(-d1 * d1 / 2) / SQRT_2PI
+                spot_q = s * disc_q
+                out[0, k, j] = w * (spot_q * cdf1 - strike_r * cdf2)
+                out[1, k, j] = w * disc_q * cdf1
+                out[2, k, j] = disc_q * pdf1 / (s * vol_t)
+                out[3, k, j] = spot_q * pdf1 * sqrt_t
+                out[4, k, j] = -spot_q * pdf1 * v / (2 * sqrt_t) - w * r * strike_r * cdf2 + w * q * spot_q * cdf1
+            elif code[k] == STOCK:
+                out[0, k, j] = s * disc_q
+                out[1, k, j] = disc_q
+                out[4, k, j] = q * s * disc_q
+            elif code[k] == DEBT:
+                out[0, k, j] = strike_r
+                out[4, k, j] = r * strike_r
+            for g in range(5):
+                out[g, k, j] *= qty[k]
+    return out
+
+
+@jit
+def frongello(portfolio: np.ndarray, benchmark: np.ndarray, sel: float = 1.) -> np.ndarray:
+    """Frongello linking of the active returns, carrying the linked sums forward
+
+    Parameters
+    ----------
+    portfolio, benchmark : np.ndarray
+        Returns by period and segment
+    sel : float, optional
+        Share of the cross-product assigned to selection, by default 1
+
+    Returns
+    -------
+    np.ndarray
+        Linked attributes
+    """
+    periods, segments = portfolio.shape
+    linked = np.empty((periods, segments))
+    cumulative = np.zeros(segments)
+    growth_p = growth_b = 1.
+    for i in range(periods):
+        total_p = total_b = 0.
+        for j in range(segments):
+            total_p += portfolio[i, j]
+            total_b += benchmark[i, j]
+        scale = sel * growth_p + (1 - sel) * growth_b
+        carry = sel * total_b + (1 - sel) * total_p
+        for j in range(segments):
+            linked[i, j] = (portfolio[i, j] - benchmark[i, j]) * scale + carry * cumulative[j]
+        for j in range(segments):
+            cumulative[j] += linked[i, j]
+        growth_p *= 1 + total_p
+        growth_b *= 1 + total_b
+    return linked
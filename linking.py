@@ -2,6 +2,7 @@ import numpy as np
 import pandas as pd
 import streamlit as st
 import toolkit as ftk
+import kernels
 
 
 def total(source: pd.DataFrame, sum: bool = False, value: float = None) -> pd.DataFrame:
@@ -16,6 +17,13 @@ def total(source: pd.DataFrame, sum: bool = False, value: float = None) -> pd.Da
     return df.style.format('{:.2%}')
 
 
+def frongello(p: pd.DataFrame, b: pd.DataFrame, sel: float = 1) -> pd.DataFrame:
+    if kernels.ENABLED:
+        return pd.DataFrame(kernels.frongello(*kernels.contiguous(p.to_numpy(), b.to_numpy()), float(sel)),
+                            index=p.index, columns=p.columns)
+    return ftk.frongello(p, b, sel=sel)
+
+
 st.title('Multi-Period Linking')
 edit = st.toggle('Edit', value=False)
 
@@ -75,6 +83,6 @@ tabs = st.tabs(['Unadjusted', 'Carino Smoothing', 'Frongello',
 tabs[0].dataframe(total(active, value=np.expm1(np.log1p(p.sum(axis=1)).sum()
                                                ) - np.expm1(np.log1p(b.sum(axis=1)).sum())))
 tabs[1].dataframe(total(ftk.carino(p, b), sum=True))
-tabs[2].dataframe(total(ftk.frongello(p, b), sum=True))
-tabs[3].dataframe(total(ftk.frongello(p, b, sel=0), sum=True))
-tabs[4].dataframe(total(ftk.frongello(p, b, sel=0.5), sum=True))
+tabs[2].dataframe(total(frongello(p, b), sum=True))
+tabs[3].dataframe(total(frongello(p, b, sel=0), sum=True))
+tabs[4].dataframe(total(frongello(p, b, sel=0.5), sum=True))
@@ -2,7 +2,8 @@ import streamlit as st
 import numpy as np
 import pandas as pd
 import json
-import toolkit as ftk
+import altair as alt
+import pricing
 
 
 def bound(num):
@@ -12,11 +13,76 @@ def bound(num):
         return f'{num:.2f}'
 
 
+# Grid of the surface mode
+surface_spot = np.linspace(0, 100, 201)[1:]
+surface_time = np.linspace(0.01, 1, 100)
+surface_vol = np.linspace(0.01, 1, 50)
+
+
+@st.cache_data(max_entries=16)
+def get_surface(legs, rate, dvd):
+    return pricing.surface(legs['instrument'], legs['strike'], legs['qty'],
+                           surface_spot, surface_time, surface_vol, rate, dvd)
+
+
+@st.cache_data(max_entries=16, show_spinner='Pricing American and path-dependent legs...')
+def get_exotic(legs, spot, rate, time, vol, dvd, paths, seed):
+    return pricing.exotic(legs['instrument'], legs['strike'], legs['barrier'], legs['qty'],
+                          spot, rate, time, vol, dvd, paths=paths, seed=seed)
+
+
+@st.cache_data(max_entries=16)
+def get_smile(chain, spot, rate, dvd, today):
+    chain = chain.copy()
+    if not pd.api.types.is_numeric_dtype(chain['expiry']):
+        chain['expiry'] = (pd.to_datetime(chain['expiry']) - today).dt.days / 365
+    chain['type'] = chain['type'].str.strip().str.capitalize().replace(
+        {'C': 'Call', 'P': 'Put'})
+    chain['mid'] = (chain['bid'] + chain['ask']) / 2
+    chain['iv'], status = pricing.implied_vol(chain['mid'], chain['type'], chain['strike'],
+                                              spot, rate, chain['expiry'], dvd, full_output=True)
+    chain['status'] = np.array(pricing.IV_STATUS)[status]
+
+    # Smile of each expiration as a quadratic in log-moneyness, from the solved quotes
+    solved = chain[status == 0]
+    coefs = {expiry: pricing.fit_smile(g['strike'], g['iv'], spot * np.exp((rate - dvd) * expiry))
+             for expiry, g in solved.groupby('expiry')}
+    return chain, coefs
+
+
+# Shocks of the scenario mode
+spot_shocks = [-0.3, -0.2, -0.1, -0.05, 0., 0.05, 0.1, 0.2, 0.3]
+vol_shocks = [-0.1, -0.05, 0., 0.05, 0.1]
+rate_shocks = [-0.01, 0., 0.01]
+horizons = {'Now': 0, '1 Week': 1 / 52, '1 Month': 1 / 12, '3 Months': 1 / 4}
+
+
+@st.cache_data(max_entries=16)
+def get_scenarios(spot, rate, time, vol, dvd):
+    legs = pd.DataFrame([dict(leg, group=i) for i, s in enumerate(strategies)
+                         for leg in s['instruments']]).reindex(columns=columns + ['group'])
+    args = legs['instrument'], legs['strike'], legs['qty'], legs['group']
+
+    # Shape (greek, strategy, spot, vol, rate, horizon), value replaced by P&L
+    base = pricing.portfolios(*args, spot, rate, time, vol, dvd)
+    cube = pricing.portfolios(
+        *args,
+        spot * (1 + np.array(spot_shocks))[:, None, None, None],
+        np.maximum(rate + np.array(rate_shocks), 0)[None, None, :, None],
+        np.maximum(time - np.array(list(horizons.values())), 1e-6)[None, None, None, :],
+        np.maximum(vol + np.array(vol_shocks), 0.01)[None, :, None, None],
+        dvd)
+    cube[0] -= base[0][:, None, None, None, None]
+    return cube
+
+
 strategy = 'Custom Option Strategy'
 strategies = json.load(open('data/option_strategy.json'))
+columns = ['name', 'instrument', 'strike', 'barrier', 'qty']
 
 if 'data' not in st.session_state:
-    st.session_state.data = pd.DataFrame(strategies[0])
+    st.session_state.data = pd.DataFrame(
+        strategies[0]['instruments']).reindex(columns=columns)
 
 with st.sidebar:
 
@@ -27,7 +93,8 @@ with st.sidebar:
     for s in strategies:
         if option == s['name']:
             strategy = s['name']
-            st.session_state.data = pd.DataFrame(s['instruments'])
+            st.session_state.data = pd.DataFrame(
+                s['instruments']).reindex(columns=columns)
 
     vol = st.slider('Volatility', min_value=0.01,
                     max_value=1., value=0.2, format='percent')
@@ -41,97 +108,190 @@ with st.sidebar:
     entry = st.slider('Entry Point', min_value=0,
                       max_value=100, value=50, format='%f')
 
+    mode = st.segmented_control(
+        'Mode', ['Spot', 'Surface', 'Scenarios'], default='Spot')
+
+    with st.expander('Monte Carlo'):
+        paths = st.select_slider('Paths', options=[10_000, 100_000, 1_000_000],
+                                 value=100_000, format_func='{:,}'.format)
+        seed = st.number_input('Seed', min_value=0, value=0, step=1)
+
+    with st.expander('Option Chain'):
+        uploaded_file = st.file_uploader('Data File', type=['csv'],
+                                         help='Columns: strike, expiry (years or date), type, bid, ask')
+        underlying = st.number_input('Underlying price', min_value=0.01,
+                                     value=float(entry))
+        use_smile = st.toggle('Price with smile', value=False,
+                              disabled=uploaded_file is None)
+
 st.title(strategy)
 edited_df = st.data_editor(st.session_state.data,
                            num_rows='dynamic',
                            column_config={
                                'name': st.column_config.TextColumn('Name'),
-                               'instrument': st.column_config.SelectboxColumn('Type', options=['Call', 'Put', 'Stock', 'Debt']),
+                               'instrument': st.column_config.SelectboxColumn('Type', options=pricing.INSTRUMENTS + pricing.EXOTICS),
                                'strike': st.column_config.NumberColumn('Strike/Face', min_value=0.1),
+                               'barrier': st.column_config.NumberColumn('Barrier', min_value=0.1),
                                'qty': st.column_config.NumberColumn('Quantity'),
                            },
-                           column_order=[
-                               'name', 'instrument', 'strike', 'qty'],
+                           column_order=columns,
                            use_container_width=True,
                            hide_index=True,)
 
-strikes = pd.concat([edited_df['strike'], pd.Series([1e-10, 1e10])])
+legs = edited_df[edited_df['instrument'].isin(
+    pricing.INSTRUMENTS + pricing.EXOTICS)]
+instrument, strike, qty = legs['instrument'], legs['strike'], legs['qty']
+is_option = (~instrument.isin(['Stock', 'Debt'])).to_numpy()
+is_exotic = instrument.isin(pricing.EXOTICS).to_numpy()
 
 spot = np.linspace(0, 100, 100)
-value = []
-delta = []
-gamma = []
-vega = []
-theta = []
-
-payoffs = np.zeros_like(strikes)
-premium = 0
-
-for _, row in edited_df.iterrows():
-    if row.instrument:
-        qty = row.qty
-
-        # Use nested if-else as Streamlit use Python 3.9 while match/case was introduced in Python 3.10
-        if row.instrument == 'Call':
-            c = ftk.EuropeanCall(None, row.strike)
-            value.append(pd.Series(qty * c.price(spot, rate,
-                         time, vol, dvd), name=row['name']))
-            delta.append(pd.Series(qty * c.delta(spot, rate,
-                         time, vol, dvd), name=row['name']))
-            gamma.append(pd.Series(qty * c.gamma(spot, rate,
-                         time, vol, dvd), name=row['name']))
-            vega .append(
-                pd.Series(qty * c.vega(spot, rate, time, vol, dvd), name=row['name']))
-            theta.append(pd.Series(qty * c.theta(spot, rate,
-                         time, vol, dvd), name=row['name']))
-            premium += qty * c.price(entry, rate, time, vol, dvd)
-            payoffs += qty * c.moneyness(strikes)
-        elif row.instrument == 'Put':
-            p = ftk.EuropeanPut(None, row.strike)
-            value.append(pd.Series(qty * p.price(spot, rate,
-                         time, vol, dvd), name=row['name']))
-            delta.append(pd.Series(qty * p.delta(spot, rate,
-                         time, vol, dvd), name=row['name']))
-            gamma.append(pd.Series(qty * p.gamma(spot, rate,
-                         time, vol, dvd), name=row['name']))
-            vega .append(
-                pd.Series(qty * p.vega(spot, rate, time, vol, dvd), name=row['name']))
-            theta.append(pd.Series(qty * p.theta(spot, rate,
-                         time, vol, dvd), name=row['name']))
-            premium += qty * p.price(entry, rate, time, vol, dvd)
-            payoffs += qty * p.moneyness(strikes)
-        elif row.instrument == 'Stock':
-            value.append(
-                pd.Series(qty * spot * np.exp(-dvd * time), name=row['name']))
-            delta.append(pd.Series(qty * np.ones_like(spot) *
-                         np.exp(-dvd * time), name=row['name']))
-            theta.append(pd.Series(qty * dvd * spot *
-                         np.exp(-dvd * time), name=row['name']))
-            payoffs += qty * (strikes - entry) + entry * \
-                (1 - np.exp(-dvd * time))
-        elif row.instrument == 'Debt':
-            value.append(pd.Series(qty * np.ones_like(spot) *
-                         row.strike * np.exp(-rate * time), name=row['name']))
-            theta.append(pd.Series(qty * np.ones_like(spot) * rate *
-                         row.strike * np.exp(-rate * time), name=row['name']))
-            payoffs += qty * row.strike * (1 - np.exp(-rate * time))
-
-value_df = pd.DataFrame(value).T
-value_df[strategy] = value_df.sum(axis=1)
-delta_df = pd.DataFrame(delta).T
-delta_df[strategy] = delta_df.sum(axis=1)
-gamma_df = pd.DataFrame(gamma).T
-gamma_df[strategy] = gamma_df.sum(axis=1)
-vega_df = pd.DataFrame(vega).T
-vega_df[strategy] = vega_df.sum(axis=1)
-theta_df = pd.DataFrame(theta).T
-theta_df[strategy] = theta_df.sum(axis=1)
-
-payoffs -= premium
+strikes = np.concatenate([strike.dropna(), [1e-10, 1e10]])
+
+# Value and Greeks of all legs, shape (greek, leg, spot)
+# Strike-dependent volatility from the smile of the nearest expiration
+leg_vol = np.full(len(legs), vol)
+if uploaded_file is not None:
+    chain, coefs = get_smile(pd.read_csv(uploaded_file), underlying, rate, dvd,
+                             pd.Timestamp.today().normalize())
+    if use_smile and coefs:
+        expiry = min(coefs, key=lambda t: abs(t - time))
+        leg_vol = pricing.smile(coefs[expiry], strike,
+                                underlying * np.exp((rate - dvd) * expiry))
+        leg_vol = np.where(np.isnan(leg_vol), vol, leg_vol)
+
+greeks = pricing.greeks(instrument, strike, qty, spot,
+                        rate, time, leg_vol[:, None], dvd)
+
+premium = pricing.greeks(instrument, strike, qty, entry,
+                         rate, time, leg_vol, dvd)[0][is_option].sum()
+
+if is_exotic.any():
+    exotic, stderr = get_exotic(legs[is_exotic], spot, rate, time, leg_vol[is_exotic], dvd, paths, seed)
+    greeks[:, is_exotic] = exotic
+    premium += sum(np.interp(entry, spot, price) for price in exotic[0])
+
+# Payoff of the exotic legs if held to expiration without knocking out
+vanilla = instrument.where(~is_exotic, np.where(
+    instrument.str.endswith('Call'), 'Call', 'Put'))
+payoffs = pricing.payoff(vanilla, strike, qty, strikes,
+                         entry, rate, time, dvd).sum(axis=0) - premium
+
+
+def to_frame(greek, mask):
+    df = pd.DataFrame(greek[mask].T, columns=legs['name'][mask])
+    df[strategy] = df.sum(axis=1)
+    return df
+
+
+value_df, delta_df, gamma_df, vega_df, theta_df = [
+    to_frame(greeks[i], mask) for i, mask in enumerate([
+        np.ones_like(is_option),
+        (instrument != 'Debt').to_numpy(),
+        is_option,
+        is_option,
+        np.ones_like(is_option)])]
+
 col1, col2, col3 = st.columns(3)
 col1.metric("Premium Paid", f'{premium:.2f}')
 col2.metric("Maximum Gain", bound(payoffs.max()))
 col3.metric("Maximum Loss", bound(payoffs.min()))
+if is_exotic.any() and stderr.any():
+    st.caption(
+        f'Monte Carlo standard error of the legs up to {stderr.max():.4f}')
+
+if mode == 'Surface':
+    # The cube is cached per strategy, the sliders below only slice it
+    cube = get_surface(legs[['instrument', 'strike', 'qty']], rate, dvd)
+
+    col1, col2 = st.columns(2)
+    greek = col1.segmented_control('Greek', pricing.GREEKS, default='Price')
+    t = col2.select_slider('Time to expiration', options=range(len(surface_time)),
+                           value=int(np.abs(surface_time - time).argmin()),
+                           format_func=lambda i: f'{surface_time[i]:.2f}')
+    sheet = cube[pricing.GREEKS.index(greek or 'Price'), t]
+    if is_exotic.any():
+        st.caption('American and path-dependent legs are not included in the surface.')
+
+    heatmap = pd.DataFrame(sheet, index=pd.Index(surface_spot, name='Spot'),
+                           columns=pd.Index(surface_vol, name='Volatility'))
+    heatmap = heatmap.stack().rename('Value').reset_index()
+    st.header(greek or 'Price')
+    st.altair_chart(alt.Chart(heatmap).mark_rect().encode(
+        x=alt.X('Spot:O', axis=alt.Axis(format='.0f', labelOverlap=True)),
+        y=alt.Y('Volatility:O', sort='descending',
+                axis=alt.Axis(format='.0%', labelOverlap=True)),
+        color=alt.Color('Value:Q', scale=alt.Scale(scheme='redyellowgreen')),
+        tooltip=['Spot', alt.Tooltip('Volatility', format='.0%'), 'Value']
+    ), use_container_width=True)
+
+    v = int(np.abs(surface_vol - vol).argmin())
+    st.line_chart(pd.DataFrame(sheet[:, v], index=surface_spot,
+                               columns=[f'Volatility {surface_vol[v]:.0%}']))
+
+    st.markdown(open('data/signature.md').read())
+    st.stop()
+
+if mode == 'Scenarios':
+    # All strategies under all shocks in one evaluation, cached per base inputs
+    cube = get_scenarios(float(entry), rate, time, vol, dvd)
+    names = [s['name'] for s in strategies]
+
+    col1, col2, col3 = st.columns(3)
+    measure = col1.segmented_control(
+        'Measure', ['P&L'] + pricing.GREEKS[1:], default='P&L') or 'P&L'
+    horizon = col2.segmented_control(
+        'Horizon', list(horizons), default='Now') or 'Now'
+    shock = col3.segmented_control('Rate shock', rate_shocks, default=0.,
+                                   format_func='{:+.0%}'.format) or 0.
+    sheet = cube[(['P&L'] + pricing.GREEKS[1:]).index(measure), :, :, :,
+                 rate_shocks.index(shock), list(horizons).index(horizon)]
+
+    matrix = pd.DataFrame(sheet.reshape(len(names), -1), index=pd.Index(names, name='Strategy'),
+                          columns=pd.MultiIndex.from_product([spot_shocks, vol_shocks], names=['Spot', 'Volatility']))
+    matrix = matrix.stack(['Spot', 'Volatility']).rename(
+        'Value').reset_index()
+    rng = matrix['Value'].abs().max()
+
+    st.header(f'{measure} by Scenario')
+    base = alt.Chart(matrix).encode(
+        x=alt.X('Spot:O', title='Spot Shock', axis=alt.Axis(format='+.0%')),
+        y=alt.Y('Strategy:N', title=None, sort=names))
+    st.altair_chart((base.mark_rect().encode(
+        color=alt.Color('Value:Q', title=measure, scale=alt.Scale(
+            domain=[-rng, 0, rng], range=['red', '#fefefe', 'green'])),
+        tooltip=['Strategy', alt.Tooltip('Spot', format='+.0%'),
+                 alt.Tooltip('Volatility', format='+.0%'), alt.Tooltip('Value', format='.2f')]
+    ) + base.mark_text(fontSize=9).encode(text=alt.Text('Value:Q', format='.1f'))
+    ).facet(column=alt.Column('Volatility:O', title='Volatility Shock',
+                              header=alt.Header(format='+.0%'))))
+
+    st.header('Ranking')
+    col1, col2 = st.columns(2)
+    pnl = cube[0, :, :, :, rate_shocks.index(shock), list(horizons).index(horizon)]
+    best = pd.DataFrame(np.array(names)[pnl.argmax(axis=0)],
+                        index=pd.Index(spot_shocks, name='Spot'),
+                        columns=pd.Index(vol_shocks, name='Volatility'))
+    best.index = best.index.map('{:+.0%}'.format)
+    best.columns = best.columns.map('{:+.0%}'.format)
+    col1.markdown('Best strategy by spot (rows) and volatility (columns) shock')
+    col1.dataframe(best)
+
+    everything = cube[0].reshape(len(names), -1)
+    ranking = pd.DataFrame({
+        'Mean P&L': everything.mean(axis=1),
+        'Worst P&L': everything.min(axis=1),
+        'Best P&L': everything.max(axis=1),
+        'Best Regimes': np.bincount(everything.argmax(axis=0), minlength=len(names)),
+    }, index=pd.Index(names, name='Strategy')).sort_values('Mean P&L', ascending=False)
+    col2.markdown('All scenarios, including rate shocks and horizons')
+    col2.dataframe(ranking, column_config={
+        'Mean P&L': st.column_config.NumberColumn(format='%.2f'),
+        'Worst P&L': st.column_config.NumberColumn(format='%.2f'),
+        'Best P&L': st.column_config.NumberColumn(format='%.2f'),
+    })
+
+    st.markdown(open('data/signature.md').read())
+    st.stop()
 
 st.header('Price')
 st.line_chart(value_df)
@@ -190,4 +350,31 @@ $\mathcal{V} = S e^{-q \\tau} \\varphi(d_1) \sqrt{\\tau} = K e^{-r \\tau} \\varp
 For an option with vega of 15, its value will increase by \$0.15 when the volatility of the underlying asset increase by 0.01 (e.g. from 20% to 21%).
                     ''')
 
+if uploaded_file is not None and coefs:
+    st.header('Volatility Smile')
+    chain['Expiry'] = chain['expiry'].map('{:.2f}'.format)
+    grid = np.linspace(chain['strike'].min(), chain['strike'].max(), 100)
+    fitted = pd.concat([pd.DataFrame({
+        'strike': grid,
+        'iv': pricing.smile(coef, grid, underlying * np.exp((rate - dvd) * expiry)),
+        'Expiry': f'{expiry:.2f}'}) for expiry, coef in coefs.items()])
+
+    points = alt.Chart(chain[chain['status'] == pricing.IV_STATUS[0]]).mark_circle().encode(
+        x=alt.X('strike:Q', title='Strike'),
+        y=alt.Y('iv:Q', title='Implied Volatility', axis=alt.Axis(format='%')),
+        color='Expiry:N',
+        tooltip=['type', 'strike', 'Expiry', 'bid', 'ask',
+                 alt.Tooltip('iv', format='.2%')]
+    )
+    lines = alt.Chart(fitted).mark_line().encode(
+        x='strike:Q', y='iv:Q', color='Expiry:N')
+    st.altair_chart(points + lines, use_container_width=True)
+    flagged = chain['status'].value_counts().drop(pricing.IV_STATUS[0], errors='ignore')
+    if not flagged.empty:
+        st.caption('Quotes left out of the smile: ' +
+                   ', '.join(f'{n} {status.lower()}' for status, n in flagged.items()))
+
+    with st.expander('Data', expanded=False):
+        st.dataframe(chain.drop(columns='Expiry'), hide_index=True)
+
 st.markdown(open('data/signature.md').read())
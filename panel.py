@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+
+
+class Panel:
+    """Prices by date and instrument, prepared for the return of any period in constant time
+
+    The prices are filled forward and kept as logarithms, i.e. cumulative log
+    returns, so the return of every instrument over a period is the
+    difference of two rows. The position of the last valid price on or
+    before every date is kept alongside.
+
+    Parameters
+    ----------
+    prices : pd.DataFrame
+        Prices indexed by date, NaN where not quoted
+    """
+
+    def __init__(self, prices: pd.DataFrame):
+        self.prices = prices
+        self.dates = prices.index
+        self.columns = prices.columns
+        values = prices.to_numpy(dtype=float)
+        valid = ~np.isnan(values)
+        rows = np.arange(len(values))[:, None]
+        self.last = np.maximum.accumulate(np.where(valid, rows, -1), axis=0)
+        self.first = np.where(valid.any(axis=0), valid.argmax(axis=0), np.iinfo(np.int64).max)
+        self.filled = np.take_along_axis(values, np.maximum(self.last, 0), axis=0)
+        self.filled[self.last < 0] = np.nan
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.log = np.log(self.filled)
+
+    def loc(self, date) -> int:
+        """Position of the last row on or before `date`, -1 if none"""
+        return self.dates.searchsorted(date, side='right') - 1
+
+    def period_return(self, start, end) -> pd.Series:
+        """Return of every instrument from the first row on or after `start` to the last row on or before `end`
+
+        An instrument first quoted within the period is measured from its
+        first price, and one not quoted within the period has no return.
+        """
+        i, j = self.dates.searchsorted(start), self.loc(end)
+        begin = np.maximum(i, self.first)
+        r = np.full(len(self.columns), np.nan)
+        ok = (begin < j) & (self.last[j] >= i) if j >= 0 else np.zeros(len(self.columns), dtype=bool)
+        r[ok] = np.expm1(self.log[j, ok] - self.log[begin[ok], np.flatnonzero(ok)])
+        return pd.Series(r, index=self.columns)
+
+    def price(self, date) -> pd.Series:
+        """Last price of every instrument on or before `date`"""
+        j = self.loc(date)
+        return pd.Series(self.filled[j] if j >= 0 else np.nan, index=self.columns)
+
+    def as_of(self, date) -> pd.Series:
+        """Date of the last price of every instrument on or before `date`"""
+        j = self.loc(date)
+        last = self.last[j] if j >= 0 else np.full(len(self.columns), -1)
+        return pd.Series(np.where(last >= 0, self.dates[np.maximum(last, 0)], pd.NaT), index=self.columns)
+
+    def window(self, date, n: int) -> np.ndarray:
+        """Filled prices of the last `n` rows up to `date`, shape (instruments, rows)"""
+        j = self.loc(date)
+        return self.filled[max(j - n + 1, 0):j + 1].T
+
+    def patch(self, date, quotes: pd.Series):
+        """Write the prices quoted on `date` into the last row, or into a new row after it
+
+        Only that row changes, so it is the only one of the filled prices,
+        their logarithms and the positions of the last prices to update.
+        Quotes older than the last row are ignored.
+
+        Parameters
+        ----------
+        date : pd.Timestamp
+            Date of the quotes
+        quotes : pd.Series
+            Prices by instrument, NaN where not quoted
+        """
+        if date < self.dates[-1]:
+            return self
+        if date > self.dates[-1]:
+            self.prices = pd.concat([self.prices, pd.DataFrame(index=[date], columns=self.columns, dtype=float)])
+            self.dates = self.prices.index
+            self.last, self.filled, self.log = (np.vstack([a, a[-1:]]) for a in (self.last, self.filled, self.log))
+        row = len(self.dates) - 1
+        q = quotes.reindex(self.columns).to_numpy(dtype=float)
+        quoted = ~np.isnan(q)
+        self.prices.iloc[row, np.flatnonzero(quoted)] = q[quoted]
+        self.last[row, quoted] = row
+        self.first = np.where(quoted, np.minimum(self.first, row), self.first)
+        self.filled[row, quoted] = q[quoted]
+        self.log[row, quoted] = np.log(q[quoted])
+        return self
@@ -0,0 +1,608 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+import numpy as np
+from scipy.special import ndtr
+import kernels
+
+INSTRUMENTS = ['Call', 'Put', 'Stock', 'Debt']
+AMERICAN = ['American Call', 'American Put']
+PATH_DEPENDENT = ['Asian Call', 'Asian Put',
+                  'Down-and-Out Call', 'Up-and-Out Call',
+                  'Down-and-Out Put', 'Up-and-Out Put']
+EXOTICS = AMERICAN + PATH_DEPENDENT
+GREEKS = ['Price', 'Delta', 'Gamma', 'Vega', 'Theta']
+IV_STATUS = ['Solved', 'At intrinsic value', 'At upper bound', 'Invalid', 'Not converged']
+
+SQRT_2PI = np.sqrt(2 * np.pi)
+
+
+def greeks(instrument, strike, qty, spot, rate: float, time: float, vol: float, dvd: float) -> np.ndarray:
+    """Black-Scholes value and Greeks of every leg of a strategy in one pass
+
+    The market inputs are broadcast against each other to form a grid and the
+    legs are laid out along a new leading axis, so d1, d2, Phi and phi are
+    computed once for all legs and all grid points.
+
+    Parameters
+    ----------
+    instrument : array-like of str
+        Type of each leg, one of `INSTRUMENTS`. Other values are valued at zero.
+    strike : array-like of float
+        Strike of an option, or face value of a debt. Ignored for stocks.
+    qty : array-like of float
+        Quantity of each leg, negative for short positions
+    spot : float | np.ndarray
+        Spot price(s) of the underlying asset
+    rate : float | np.ndarray
+        Risk-free rate
+    time : float | np.ndarray
+        Time to expiration
+    vol : float | np.ndarray
+        Volatility. May carry the leg axis in front, e.g. shape (legs, 1), for
+        strike-dependent volatility.
+    dvd : float | np.ndarray
+        Dividend yield
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (len(GREEKS), legs, *grid) scaled by quantity
+    """
+    ndim = np.broadcast(spot, rate, time, dvd).ndim
+    shape = (-1,) + (1,) * ndim
+    instrument = np.asarray(instrument).reshape(shape)
+    strike = np.asarray(strike, dtype=float).reshape(shape)
+    qty = np.asarray(qty, dtype=float).reshape(shape)
+
+    if kernels.ENABLED:
+        full = np.broadcast_shapes(strike.shape, *map(np.shape, (spot, rate, time, vol, dvd)))
+        code = np.select([instrument == name for name in INSTRUMENTS], range(len(INSTRUMENTS)), -1)
+        market = [np.broadcast_to(np.asarray(x, dtype=float), full[1:]).ravel() for x in (spot, rate, time, dvd)]
+        vol = np.broadcast_to(np.asarray(vol, dtype=float), full).reshape(full[0], int(np.prod(full[1:])))
+        out = kernels.greeks(*kernels.contiguous(code.ravel(), dtype=np.int64),
+                             *kernels.contiguous(strike.ravel(), qty.ravel(), *market[:3], vol, market[3]))
+        return out.reshape((len(GREEKS),) + full)
+
+    call = instrument == 'Call'
+    put = instrument == 'Put'
+    stock = instrument == 'Stock'
+    debt = instrument == 'Debt'
+    option = call | put
+    w = np.where(put, -1., 1.)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sqrt_t = np.sqrt(time)
+        vol_t = vol * sqrt_t
+        disc_q = np.exp(-dvd * time)
+        disc_r = np.exp(-rate * time)
+        d1 = (np.log(spot / strike) + (rate - dvd + vol ** 2 / 2) * time) / vol_t
+        d2 = d1 - vol_t
+        cdf1 = ndtr(w * d1)
+        cdf2 = ndtr(w * d2)
+        pdf1 = np.exp(-d1 ** 2 / 2) / SQRT_2PI
+
+        spot_q = spot * disc_q
+        strike_r = strike * disc_r
+
+        price = np.where(option, w * (spot_q * cdf1 - strike_r * cdf2),
+                         np.where(stock, spot_q, np.where(debt, strike_r, 0.)))
+        delta = np.where(option, w * disc_q * cdf1,
+                         np.where(stock, disc_q, 0.))
+        gamma = np.where(option, disc_q * pdf1 / (spot * vol_t), 0.)
+        vega = np.where(option, spot_q * pdf1 * sqrt_t, 0.)
+        theta = np.where(option, -spot_q * pdf1 * vol / (2 * sqrt_t) - w * rate * strike_r * cdf2 + w * dvd * spot_q * cdf1,
+                         np.where(stock, dvd * spot_q, np.where(debt, rate * strike_r, 0.)))
+
+    return np.stack(np.broadcast_arrays(price, delta, gamma, vega, theta)) * qty
+
+
+def payoff(instrument, strike, qty, spot, entry: float, rate: float, time: float, dvd: float) -> np.ndarray:
+    """Payoff at expiration of every leg, before the premium paid for the options
+
+    Parameters
+    ----------
+    instrument : array-like of str
+        Type of each leg, one of `INSTRUMENTS`
+    strike : array-like of float
+        Strike of an option, or face value of a debt. Ignored for stocks.
+    qty : array-like of float
+        Quantity of each leg, negative for short positions
+    spot : np.ndarray
+        Terminal price(s) of the underlying asset
+    entry : float
+        Price of the underlying asset when the position is entered
+    rate : float
+        Risk-free rate
+    time : float
+        Time to expiration
+    dvd : float
+        Dividend yield
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (legs, len(spot))
+    """
+    instrument = np.asarray(instrument)[:, None]
+    strike = np.asarray(strike, dtype=float)[:, None]
+    qty = np.asarray(qty, dtype=float)[:, None]
+    spot = np.asarray(spot, dtype=float)[None, :]
+
+    with np.errstate(invalid='ignore'):
+        return np.select(
+            [instrument == 'Call', instrument == 'Put',
+             instrument == 'Stock', instrument == 'Debt'],
+            [qty * np.maximum(0, spot - strike),
+             qty * np.maximum(0, strike - spot),
+             qty * (spot - entry) + entry * (1 - np.exp(-dvd * time)),
+             qty * strike * (1 - np.exp(-rate * time)) + 0 * spot],
+            0.)
+
+
+def surface(instrument, strike, qty, spot, time, vol, rate: float, dvd: float, dtype=np.float32, chunk_bytes: int = 2**26) -> np.ndarray:
+    """Value and Greeks of a strategy on a time x spot x volatility grid
+
+    The grid is evaluated in chunks along the time axis so that the float64
+    intermediate array of all legs stays below `chunk_bytes`, and only the
+    strategy total is kept in the requested precision.
+
+    Parameters
+    ----------
+    instrument : array-like of str
+        Type of each leg, one of `INSTRUMENTS`
+    strike : array-like of float
+        Strike of an option, or face value of a debt. Ignored for stocks.
+    qty : array-like of float
+        Quantity of each leg, negative for short positions
+    spot : np.ndarray
+        Spot prices of the underlying asset
+    time : np.ndarray
+        Times to expiration
+    vol : np.ndarray
+        Volatilities
+    rate : float
+        Risk-free rate
+    dvd : float
+        Dividend yield
+    dtype : optional
+        Precision of the result, by default np.float32
+    chunk_bytes : int, optional
+        Memory budget of each chunk, by default 64 MiB
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (len(GREEKS), len(time), len(spot), len(vol))
+    """
+    spot = np.asarray(spot, dtype=float)[None, :, None]
+    time = np.asarray(time, dtype=float)[:, None, None]
+    vol = np.asarray(vol, dtype=float)[None, None, :]
+    legs = max(np.size(qty), 1)
+
+    cube = np.empty((len(GREEKS), len(time), spot.size, vol.size), dtype=dtype)
+    step = max(1, chunk_bytes // (len(GREEKS) * legs * spot.size * vol.size * 8))
+    for i in range(0, len(time), step):
+        cube[:, i:i + step] = greeks(instrument, strike, qty, spot, rate,
+                                     time[i:i + step], vol, dvd).sum(axis=1)
+    return cube
+
+
+def _is_call(instrument) -> np.ndarray:
+    return np.char.endswith(np.asarray(instrument, dtype=str), 'Call')
+
+
+def lattice(instrument, strike, spot, rate: float, time: float, vol: float, dvd: float, steps: int = 200) -> np.ndarray:
+    """Cox-Ross-Rubinstein binomial tree, vectorized across legs and spots
+
+    Legs named `American ...` may be exercised at every node, the others are
+    valued as European options.
+
+    Parameters
+    ----------
+    instrument : array-like of str
+        Type of each leg, e.g. `American Call` or `Put`
+    strike : array-like of float
+        Strike of each leg
+    spot : np.ndarray
+        Spot prices of the underlying asset
+    rate : float
+        Risk-free rate
+    time : float
+        Time to expiration
+    vol : float | array-like
+        Volatility, or volatility of each leg
+    dvd : float
+        Dividend yield
+    steps : int, optional
+        Number of time steps, by default 200
+
+    Returns
+    -------
+    np.ndarray
+        Value of one unit of each leg, shape (legs, len(spot))
+    """
+    american = np.char.startswith(np.asarray(instrument, dtype=str), 'American')[:, None, None]
+    w = np.where(_is_call(instrument), 1., -1.)[:, None, None]
+    strike = np.asarray(strike, dtype=float)[:, None, None]
+    spot = np.asarray(spot, dtype=float)[None, :, None]
+    vol = np.broadcast_to(np.asarray(vol, dtype=float), (len(strike),))[:, None, None]
+
+    dt = time / steps
+    u = np.exp(vol * np.sqrt(dt))
+    p = (np.exp((rate - dvd) * dt) - 1 / u) / (u - 1 / u)
+    disc = np.exp(-rate * dt)
+
+    value = np.maximum(w * (spot * u ** (2 * np.arange(steps + 1) - steps) - strike), 0)
+    for n in range(steps - 1, -1, -1):
+        value = disc * (p * value[..., 1:] + (1 - p) * value[..., :-1])
+        exercise = np.maximum(w * (spot * u ** (2 * np.arange(n + 1) - n) - strike), 0)
+        value = np.where(american, np.maximum(value, exercise), value)
+    return value[..., 0]
+
+
+def _simulate(seed, pairs: int, steps: int, instrument, strike, barrier, spot, rate: float, time: float, vol: float, dvd: float) -> tuple:
+    """Simulate one chunk of antithetic pairs of unit paths
+
+    Because geometric Brownian motion scales with the initial price, paths
+    starting at 1 serve every spot: the terminal, average, minimum and maximum
+    of each path are simply multiplied by the spot. Legs with different
+    volatilities share the same draws.
+
+    Returns
+    -------
+    tuple
+        Number of pairs, sums of the control and its square in shape (legs,),
+        and sums of the discounted payoff, its square and its product with the
+        control, in shape (legs, len(spot))
+    """
+    rng = np.random.default_rng(seed)
+    z = rng.standard_normal((pairs, steps))
+    dt = time / steps
+    disc = np.exp(-rate * time)
+
+    instrument = np.asarray(instrument, dtype=str)
+    w = np.where(_is_call(instrument), 1., -1.)
+    asian = np.char.startswith(instrument, 'Asian')
+    down = np.char.startswith(instrument, 'Down')
+    up = np.char.startswith(instrument, 'Up')
+    spot = np.asarray(spot, dtype=float)
+    vol = np.broadcast_to(np.asarray(vol, dtype=float), (len(instrument),))
+
+    payoff = np.zeros((len(instrument), pairs, len(spot)))
+    control = np.zeros((len(instrument), pairs))
+    for sign in (1, -1):
+        summaries = {}
+        for i in range(len(instrument)):
+            if vol[i] not in summaries:
+                drift = (rate - dvd - vol[i] ** 2 / 2) * dt
+                path = np.exp(np.cumsum(drift + sign * vol[i] * np.sqrt(dt) * z, axis=1))
+                summaries[vol[i]] = (path[:, -1], path.mean(axis=1),
+                                     path.min(axis=1), path.max(axis=1))
+            terminal, average, low, high = summaries[vol[i]]
+            control[i] += disc * terminal / 2
+            underlying = np.outer(average if asian[i] else terminal, spot)
+            value = np.maximum(w[i] * (underlying - strike[i]), 0)
+            if down[i]:
+                value[np.outer(low, spot) <= barrier[i]] = 0
+            elif up[i]:
+                value[np.outer(high, spot) >= barrier[i]] = 0
+            payoff[i] += disc * value / 2
+
+    return (pairs, control.sum(axis=1), (control ** 2).sum(axis=1),
+            payoff.sum(axis=1), (payoff ** 2).sum(axis=1),
+            np.einsum('lps,lp->ls', payoff, control))
+
+
+def chunks(paths: int, chunk: int = 20_000) -> list[int]:
+    """Number of antithetic pairs of every chunk of `monte_carlo`"""
+    pairs = max(paths // 2, 2)
+    return [min(chunk, pairs - i) for i in range(0, pairs, chunk)]
+
+
+def monte_carlo(instrument, strike, barrier, spot, rate: float, time: float, vol: float, dvd: float, paths: int = 100_000, steps: int = 64, seed: int = 0, chunk: int = 20_000, workers: int = None, executor: ProcessPoolExecutor = None) -> tuple[np.ndarray, np.ndarray]:
+    """Monte Carlo pricer for Asian, barrier and European options
+
+    Paths are drawn in antithetic pairs and the discounted terminal price of
+    the underlying, whose expectation is known, is used as a control variate.
+    Chunks of paths are simulated in a process pool with independent streams
+    spawned from `seed`, so the result does not depend on the number of
+    workers. Barriers are monitored at every step.
+
+    Parameters
+    ----------
+    instrument : array-like of str
+        Type of each leg, one of `PATH_DEPENDENT`, `Call` or `Put`
+    strike : array-like of float
+        Strike of each leg
+    barrier : array-like of float
+        Barrier of each leg, ignored by Asian and European options
+    spot : np.ndarray
+        Spot prices of the underlying asset
+    rate : float
+        Risk-free rate
+    time : float
+        Time to expiration
+    vol : float | array-like
+        Volatility, or volatility of each leg
+    dvd : float
+        Dividend yield
+    paths : int, optional
+        Number of paths, by default 100,000
+    steps : int, optional
+        Number of monitoring dates, by default 64
+    seed : int, optional
+        Seed of the random number generator, by default 0
+    chunk : int, optional
+        Number of antithetic pairs per chunk, by default 20,000
+    workers : int, optional
+        Number of processes, by default the number of CPUs. Runs in the
+        current process if 1.
+    executor : ProcessPoolExecutor, optional
+        Pool to run the chunks on instead of starting one, e.g. shared by
+        several valuations
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        Value of one unit of each leg and its standard error, both in shape
+        (legs, len(spot))
+    """
+    strike = np.asarray(strike, dtype=float)
+    barrier = np.asarray(barrier, dtype=float)
+    sizes = chunks(paths, chunk)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    simulate = partial(_simulate, steps=steps, instrument=instrument, strike=strike, barrier=barrier,
+                       spot=spot, rate=rate, time=time, vol=vol, dvd=dvd)
+
+    workers = min(workers or os.cpu_count() or 1, len(sizes))
+    if executor is not None:
+        results = list(executor.map(simulate, seeds, sizes))
+    elif workers > 1:
+        with ProcessPoolExecutor(workers) as executor:
+            results = list(executor.map(simulate, seeds, sizes))
+    else:
+        results = list(map(simulate, seeds, sizes))
+
+    n, c, cc, y, yy, yc = (sum(x) for x in zip(*results))
+    mean_c, mean_y = c[:, None] / n, y / n
+    var_c = cc[:, None] / n - mean_c ** 2
+    var_y = yy / n - mean_y ** 2
+    cov = yc / n - mean_y * mean_c
+    beta = cov / var_c
+    price = mean_y - beta * (mean_c - np.exp(-dvd * time))
+    stderr = np.sqrt(np.maximum(var_y - beta * cov, 0) / (n - 1))
+    return price, stderr
+
+
+def exotic(instrument, strike, barrier, qty, spot, rate: float, time: float, vol: float, dvd: float, paths: int = 100_000, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """Value and Greeks of American and path-dependent legs
+
+    American legs are priced on a binomial tree and path-dependent legs by
+    Monte Carlo. Delta and gamma are differentiated along the spot grid, vega
+    and theta are bumped with common random numbers. The three Monte Carlo
+    valuations share one process pool.
+
+    Parameters
+    ----------
+    instrument : array-like of str
+        Type of each leg, one of `EXOTICS`. Other values are valued at zero.
+    strike : array-like of float
+        Strike of each leg
+    barrier : array-like of float
+        Barrier of each leg, only used by barrier options
+    qty : array-like of float
+        Quantity of each leg, negative for short positions
+    spot : np.ndarray
+        Increasing spot prices of the underlying asset
+    rate : float
+        Risk-free rate
+    time : float
+        Time to expiration
+    vol : float | array-like
+        Volatility, or volatility of each leg
+    dvd : float
+        Dividend yield
+    paths : int, optional
+        Number of Monte Carlo paths, by default 100,000
+    seed : int, optional
+        Seed of the random number generator, by default 0
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        Array of shape (len(GREEKS), legs, len(spot)) scaled by quantity, and
+        the standard error of the value in shape (legs, len(spot))
+    """
+    instrument = np.asarray(instrument, dtype=str)
+    strike = np.asarray(strike, dtype=float)
+    barrier = np.asarray(barrier, dtype=float)
+    qty = np.asarray(qty, dtype=float)[:, None]
+    spot = np.asarray(spot, dtype=float)
+    vol = np.broadcast_to(np.asarray(vol, dtype=float), instrument.shape)
+    american = np.isin(instrument, AMERICAN)
+    path_dependent = np.isin(instrument, PATH_DEPENDENT)
+
+    def value(time, vol, executor=None):
+        result = np.zeros((len(instrument), len(spot)))
+        stderr = np.zeros_like(result)
+        if american.any():
+            result[american] = lattice(instrument[american], strike[american],
+                                       spot, rate, time, vol[american], dvd)
+        if path_dependent.any():
+            result[path_dependent], stderr[path_dependent] = monte_carlo(
+                instrument[path_dependent], strike[path_dependent], barrier[path_dependent],
+                spot, rate, time, vol[path_dependent], dvd, paths=paths, seed=seed, executor=executor)
+        return result, stderr
+
+    dv, dt = 0.01, min(1 / 365, time / 2)
+    workers = min(os.cpu_count() or 1, len(chunks(paths))) if path_dependent.any() else 1
+    with ProcessPoolExecutor(workers) if workers > 1 else nullcontext() as executor:
+        price, stderr = value(time, vol, executor)
+        vega = (value(time, vol + dv, executor)[0] - price) / dv
+        theta = (value(time - dt, vol, executor)[0] - price) / dt
+    delta = np.gradient(price, spot, axis=1)
+    gamma = np.gradient(delta, spot, axis=1)
+
+    return np.stack([price, delta, gamma, vega, theta]) * qty, stderr * np.abs(qty)
+
+
+def implied_vol(price, instrument, strike, spot, rate, time, dvd=0., tol: float = 1e-8, max_iter: int = 100, full_output: bool = False):
+    """Implied volatility of many European option quotes at once
+
+    Starts from the Corrado-Miller approximation and iterates Newton-Raphson
+    on all quotes together. A bracket is kept for every quote and a bisection
+    step is taken whenever the Newton step leaves it or vega vanishes. A quote
+    stops when its volatility moves by less than `tol`, so deep out-of-the-money
+    quotes with tiny premiums are solved as accurately as the others.
+
+    Premiums at or below the intrinsic value, or whose time value is within
+    rounding of it, are clamped to a volatility of 0, and those at or above the
+    upper no-arbitrage bound to infinity.
+
+    Parameters
+    ----------
+    price : array-like of float
+        Option premiums
+    instrument : array-like of str
+        `Call` or `Put`
+    strike : array-like of float
+        Strikes
+    spot : float | array-like
+        Spot price of the underlying asset
+    rate : float | array-like
+        Risk-free rate
+    time : float | array-like
+        Time to expiration
+    dvd : float | array-like, optional
+        Dividend yield, by default 0.
+    tol : float, optional
+        Tolerance on the volatility, by default 1e-8
+    max_iter : int, optional
+        Maximum number of iterations, by default 100
+    full_output : bool, optional
+        Whether to also return the status of every quote, by default False
+
+    Returns
+    -------
+    np.ndarray | tuple[np.ndarray, np.ndarray]
+        Implied volatilities, NaN where the quote or its expiration is missing.
+        If `full_output`, also the status of every quote as an index of
+        `IV_STATUS`.
+    """
+    instrument = np.asarray(instrument, dtype=str)
+    shape = np.broadcast(price, instrument, strike, spot, rate, time, dvd).shape
+    price, strike, spot, rate, time, dvd = (np.broadcast_to(np.asarray(x, dtype=float), shape)
+                                            for x in (price, strike, spot, rate, time, dvd))
+    w = np.broadcast_to(np.where(_is_call(instrument), 1., -1.), shape)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sqrt_t = np.sqrt(time)
+        spot_q = spot * np.exp(-dvd * time)
+        strike_r = strike * np.exp(-rate * time)
+        lower = np.maximum(w * (spot_q - strike_r), 0)
+        upper = np.where(w > 0, spot_q, strike_r)
+        known = np.isfinite(price) & np.isfinite(lower) & np.isfinite(upper) & (time > 0)
+        # Time value lost in the rounding of the premium does not pin down the volatility
+        intrinsic = known & (price - lower <= 1e-12 * upper)
+        unbounded = known & (price >= upper)
+        valid = known & ~intrinsic & ~unbounded
+
+        # Corrado-Miller on the call premium implied by put-call parity
+        call = np.where(w > 0, price, price + spot_q - strike_r)
+        half = call - (spot_q - strike_r) / 2
+        guess = SQRT_2PI / (spot_q + strike_r) * (
+            half + np.sqrt(np.maximum(half ** 2 - (spot_q - strike_r) ** 2 / np.pi, 0))) / sqrt_t
+
+        lo = np.full(price.shape, 1e-6)
+        hi = np.full(price.shape, 5.)
+        vol = np.where(np.isfinite(guess) & (guess > lo) & (guess < hi), guess, 0.2)
+
+        done = ~valid
+        for _ in range(max_iter):
+            vol_t = vol * sqrt_t
+            d1 = (np.log(spot_q / strike_r) + vol_t ** 2 / 2) / vol_t
+            model = w * (spot_q * ndtr(w * d1) - strike_r * ndtr(w * (d1 - vol_t)))
+            diff = model - price
+            vega = spot_q * np.exp(-d1 ** 2 / 2) / SQRT_2PI * sqrt_t
+
+            # Newton on the log of the premium, which stays nearly linear in
+            # the volatility for the tiny premiums far out of the money
+            hi = np.where(diff > 0, vol, hi)
+            lo = np.where(diff < 0, vol, lo)
+            newton = vol - np.log(model / price) * model / vega
+            step = np.where((newton > lo) & (newton < hi), newton, (lo + hi) / 2)
+            done |= (diff == 0) | (np.abs(step - vol) < tol)
+            vol = np.where(done, vol, step)
+            if done.all():
+                break
+
+    vol = np.select([valid, intrinsic, unbounded], [vol, 0., np.inf], np.nan)
+    if not full_output:
+        return vol
+    status = np.select([~known, intrinsic, unbounded, ~done], [3, 1, 2, 4], 0)
+    return vol, status
+
+
+def fit_smile(strike, vol, forward, degree: int = 2) -> np.ndarray:
+    """Least-squares polynomial fit of volatility against log-moneyness
+
+    Parameters
+    ----------
+    strike : array-like of float
+        Strikes of the quotes of one expiration
+    vol : array-like of float
+        Implied volatilities, NaN are ignored
+    forward : float
+        Forward price of the underlying asset
+    degree : int, optional
+        Degree of the polynomial, by default 2
+
+    Returns
+    -------
+    np.ndarray
+        Coefficients, highest power first, for `smile`
+    """
+    k = np.log(np.asarray(strike, dtype=float) / forward)
+    vol = np.asarray(vol, dtype=float)
+    ok = np.isfinite(k) & np.isfinite(vol)
+    degree = min(degree, max(np.unique(k[ok]).size - 1, 0))
+    return np.polyfit(k[ok], vol[ok], degree)
+
+
+def smile(coef, strike, forward) -> np.ndarray:
+    """Volatility at the given strikes from the coefficients of `fit_smile`"""
+    k = np.log(np.asarray(strike, dtype=float) / forward)
+    return np.maximum(np.polyval(coef, k), 1e-4)
+
+
+def portfolios(instrument, strike, qty, group, spot, rate, time, vol, dvd) -> np.ndarray:
+    """Value and Greeks of many strategies in one batched evaluation
+
+    The legs of all strategies are priced together by `greeks` and then
+    summed into their strategy.
+
+    Parameters
+    ----------
+    instrument : array-like of str
+        Type of each leg, one of `INSTRUMENTS`
+    strike : array-like of float
+        Strike of an option, or face value of a debt. Ignored for stocks.
+    qty : array-like of float
+        Quantity of each leg, negative for short positions
+    group : array-like of int
+        Index of the strategy of each leg, from 0 to the number of strategies - 1
+    spot, rate, time, vol, dvd : float | np.ndarray
+        Market inputs, broadcast against each other as in `greeks`
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (len(GREEKS), strategies, *grid)
+    """
+    group = np.asarray(group, dtype=int)
+    legs = greeks(instrument, strike, qty, spot, rate, time, vol, dvd)
+    result = np.zeros((len(GREEKS), group.max() + 1) + legs.shape[2:])
+    np.add.at(result, (slice(None), group), legs)
+    return result
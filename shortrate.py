@@ -0,0 +1,692 @@
+import os
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial, reduce
+import numpy as np
+from scipy.optimize import least_squares
+from scipy.special import ndtr
+
+
+class Summary(ABC):
+    """Base of the summaries of the simulated paths
+
+    `observe` receives the states of a chunk of scenarios, and by default
+    updates the summary with their rates and zero-coupon bond prices.
+    """
+
+    def observe(self, model, states: np.ndarray, times: np.ndarray, years: float, rng: np.random.Generator):
+        rates = model.rate(states, times).astype(states.dtype)
+        prices = model.bond(states, times, years).astype(states.dtype)
+        return self.update(np.expm1(rates), prices)
+
+    @abstractmethod
+    def update(self, rates: np.ndarray, prices: np.ndarray):
+        """Fold the rates and bond prices of a chunk of scenarios into the summary"""
+
+    @abstractmethod
+    def merge(self, other):
+        """Fold another summary of the same kind into this one"""
+
+
+class Paths(Summary):
+    """Summary that keeps every simulated path
+
+    An empty summary is created for every chunk of scenarios, updated in the
+    worker and merged back in the parent, so only what it keeps leaves the
+    worker.
+    """
+
+    def __init__(self):
+        self.rates = []
+        self.prices = []
+
+    def update(self, rates: np.ndarray, prices: np.ndarray):
+        self.rates.append(rates)
+        self.prices.append(prices)
+        return self
+
+    def merge(self, other):
+        self.rates.extend(other.rates)
+        self.prices.extend(other.prices)
+        return self
+
+    def result(self) -> tuple[np.ndarray, np.ndarray]:
+        return np.hstack(self.rates), np.hstack(self.prices)
+
+
+class Histogram:
+    """Mergeable quantile sketch with one fixed-width histogram per step
+
+    Values outside [lo, hi] are counted in the first or last bin, NaN are
+    left out, and the quantiles are kept within the exact minimum and maximum
+    of every step. Unlike a P-square estimator the counts of different chunks simply add up,
+    so the sketch can be built in parallel.
+    """
+
+    def __init__(self, lo: float, hi: float, bins: int = 4000):
+        self.lo, self.hi, self.bins = lo, hi, bins
+        self.counts = None
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values: np.ndarray):
+        steps = len(values)
+        known = ~np.isnan(values)
+        idx = ((np.where(known, values, self.lo) - self.lo) * (self.bins / (self.hi - self.lo))).astype(np.int64)
+        idx = np.clip(idx, 0, self.bins - 1) + np.arange(steps)[:, None] * self.bins
+        # NaN go to one more bin, dropped
+        idx = np.where(known, idx, steps * self.bins)
+        counts = np.bincount(idx.ravel(), minlength=steps * self.bins + 1)[:-1].reshape(steps, self.bins)
+        return self.merge_counts(counts, np.where(known, values, np.inf).min(axis=1),
+                                 np.where(known, values, -np.inf).max(axis=1))
+
+    def merge_counts(self, counts: np.ndarray, low: np.ndarray, high: np.ndarray):
+        self.counts = counts if self.counts is None else self.counts + counts
+        self.min = np.minimum(self.min, low)
+        self.max = np.maximum(self.max, high)
+        return self
+
+    def merge(self, other):
+        return self.merge_counts(other.counts, other.min, other.max)
+
+    def quantile(self, q) -> np.ndarray:
+        """Quantiles of every step, interpolated within the bins, shape (len(q), steps)
+
+        NaN at the steps without any value.
+        """
+        cum = self.counts.cumsum(axis=1)
+        width = (self.hi - self.lo) / self.bins
+        result = []
+        for target in np.atleast_1d(q)[:, None] * cum[:, -1]:
+            idx = np.minimum((cum < target[:, None]).sum(axis=1), self.bins - 1)
+            below = np.take_along_axis(cum, idx[:, None], axis=1)[:, 0] - \
+                np.take_along_axis(self.counts, idx[:, None], axis=1)[:, 0]
+            within = np.take_along_axis(self.counts, idx[:, None], axis=1)[:, 0]
+            result.append(self.lo + (idx + (target - below) / np.maximum(within, 1)) * width)
+        return np.where(cum[:, -1] > 0, np.clip(result, self.min, self.max), np.nan)
+
+
+class Fan(Summary):
+    """Summary of the paths in O(steps) memory for fan charts
+
+    Keeps the quantile sketches and the means of the rates and the bond
+    prices at every step, and the first few paths as samples. The values
+    outside the range of a sketch are counted, so that the share of the
+    tails it clips can be reported.
+
+    Parameters
+    ----------
+    samples : int, optional
+        Number of sample paths kept, by default 10
+    rates : tuple, optional
+        Range of the rate sketch, e.g. from `Model.interval`, by default (-0.1, 0.3)
+    prices : tuple, optional
+        Range of the bond price sketch, by default (0, 2)
+    bins : int, optional
+        Number of bins of every sketch, by default 4000
+    """
+
+    def __init__(self, samples: int = 10, rates: tuple = (-0.1, 0.3), prices: tuple = (0., 2.), bins: int = 4000):
+        self.samples = samples
+        self.rates = Histogram(*rates, bins)
+        self.prices = Histogram(*prices, bins)
+        self.n = 0
+        self.rate_sum = self.price_sum = 0
+        self.rate_outside = self.price_outside = 0
+        self.sample_rates = self.sample_prices = None
+
+    def update(self, rates: np.ndarray, prices: np.ndarray):
+        self.rates.update(rates)
+        self.prices.update(prices)
+        self.rate_outside = self.rate_outside + ((rates < self.rates.lo) | (rates > self.rates.hi)).sum(axis=1)
+        self.price_outside = self.price_outside + ((prices < self.prices.lo) | (prices > self.prices.hi)).sum(axis=1)
+        self.n += rates.shape[1]
+        self.rate_sum = self.rate_sum + rates.sum(axis=1, dtype=float)
+        self.price_sum = self.price_sum + prices.sum(axis=1, dtype=float)
+        self.sample_rates = rates[:, :self.samples].copy()
+        self.sample_prices = prices[:, :self.samples].copy()
+        return self
+
+    def merge(self, other):
+        self.rates.merge(other.rates)
+        self.prices.merge(other.prices)
+        self.n += other.n
+        self.rate_sum = self.rate_sum + other.rate_sum
+        self.price_sum = self.price_sum + other.price_sum
+        self.rate_outside = self.rate_outside + other.rate_outside
+        self.price_outside = self.price_outside + other.price_outside
+        missing = self.samples - self.sample_rates.shape[1]
+        if missing > 0:
+            self.sample_rates = np.hstack([self.sample_rates, other.sample_rates[:, :missing]])
+            self.sample_prices = np.hstack([self.sample_prices, other.sample_prices[:, :missing]])
+        return self
+
+    def mean(self) -> tuple[np.ndarray, np.ndarray]:
+        return self.rate_sum / self.n, self.price_sum / self.n
+
+    def quantile(self, q) -> tuple[np.ndarray, np.ndarray]:
+        return self.rates.quantile(q), self.prices.quantile(q)
+
+    def clipped(self) -> tuple[np.ndarray, np.ndarray]:
+        """Share of the rates, and of the bond prices, outside the range of their sketch at every step"""
+        return self.rate_outside / self.n, self.price_outside / self.n
+
+
+def cir_bond(tau, a: float, b: float, sigma: float) -> tuple[np.ndarray, np.ndarray]:
+    """Coefficients of the zero-coupon bond price P = A exp(-B r) under CIR
+
+    Parameters
+    ----------
+    tau : float | np.ndarray
+        Time to maturity
+    a : float
+        Speed of mean reversion
+    b : float
+        Long-term average rate
+    sigma : float
+        Annualized volatility
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        A(tau) and B(tau)
+    """
+    tau = np.asarray(tau, dtype=float)
+    if sigma == 0:
+        # Deterministic limit, the rate decays exponentially towards b
+        B = -np.expm1(-a * tau) / a if a > 0 else tau
+        return np.exp(-b * (tau - B)), B
+
+    h = np.sqrt(a**2 + 2*sigma**2)
+    e = np.expm1(h*tau)
+    denom = 2*h + (h+a)*e
+    A = ((2*h*np.exp((h+a)*tau/2)) / denom)**(2*a*b/sigma**2)
+    B = (2*e) / denom
+    return A, B
+
+
+def cir_step(rng: np.random.Generator, r: np.ndarray, a: float, b: float, sigma: float, dt: float) -> np.ndarray:
+    """Exact transition of the CIR process over a step of any length
+
+    The rate after `dt` is a scaled non-central chi-square, sampled as a
+    Poisson mixture of gamma variates so that zero degrees of freedom work.
+    """
+    if sigma == 0:
+        return b + (r - b) * np.exp(-a * dt)
+
+    c = sigma**2 * -np.expm1(-a * dt) / (4 * a) if a > 0 else sigma**2 * dt / 4
+    df = 4 * a * b / sigma**2
+    nonc = r * np.exp(-a * dt) / c
+    return 2 * c * rng.standard_gamma(df / 2 + rng.poisson(nonc / 2))
+
+
+def _ou_step(a: float, dt: float) -> tuple[float, float]:
+    """Decay and standard deviation per unit volatility of an exact OU step"""
+    decay = np.exp(-a * dt)
+    return decay, np.sqrt(-np.expm1(-2 * a * dt) / (2 * a) if a > 0 else dt)
+
+
+class Curve:
+    """Zero curve with continuously compounded rates interpolated linearly
+
+    Parameters
+    ----------
+    tenors : array-like of float
+        Maturities in years
+    rates : array-like of float
+        Continuously compounded zero rates
+    """
+
+    def __init__(self, tenors, rates):
+        order = np.argsort(tenors)
+        self.tenors = np.asarray(tenors, dtype=float)[order]
+        self.rates = np.asarray(rates, dtype=float)[order]
+
+    def zero(self, t) -> np.ndarray:
+        return np.interp(t, self.tenors, self.rates)
+
+    def discount(self, t) -> np.ndarray:
+        return np.exp(-self.zero(t) * t)
+
+    def forward(self, t, h: float = 1e-4) -> np.ndarray:
+        t = np.asarray(t, dtype=float)
+        return (self.zero(t + h) * (t + h) - self.zero(t) * t) / h
+
+
+class Model(ABC):
+    """Short-rate model simulated by `simulate`
+
+    The state of every scenario is a vector of `factors`. Subclasses provide
+    the initial state, its exact transition over a step, the short rate and
+    the price of the zero-coupon bond for a state.
+    """
+
+    factors = 1
+
+    @abstractmethod
+    def initial(self, scenarios: int) -> np.ndarray:
+        """Initial state, shape (factors, scenarios)"""
+
+    @abstractmethod
+    def step(self, rng: np.random.Generator, x: np.ndarray, dt: float) -> np.ndarray:
+        """State after `dt`, same shape as `x`"""
+
+    @abstractmethod
+    def rate(self, x: np.ndarray, t: np.ndarray) -> np.ndarray:
+        """Continuously compounded short rate of states of shape (steps, factors, scenarios) at times `t`"""
+
+    @abstractmethod
+    def bond(self, x: np.ndarray, t: np.ndarray, maturity: float) -> np.ndarray:
+        """Price of the zero-coupon bond maturing at `maturity` in every state"""
+
+    @abstractmethod
+    def moments(self, t) -> tuple[np.ndarray, np.ndarray]:
+        """Mean and variance of the short rate at times `t`, seen from the initial state"""
+
+    def interval(self, years: float, sd: float = 4., pad: float = 0.01) -> tuple[float, float]:
+        """Range of the short rate within `sd` standard deviations of its mean until `years`, widened by `pad`
+
+        Suits the range of a `Fan`, whose quantiles would otherwise be
+        clipped for volatile models.
+        """
+        mean, var = self.moments(np.linspace(0, years, 65))
+        std = np.sqrt(np.maximum(var, 0))
+        return float((mean - sd * std).min() - pad), float((mean + sd * std).max() + pad)
+
+    def discount(self, tenors) -> np.ndarray:
+        """Discount factors of the initial state"""
+        x = self.initial(1)[None]
+        return np.array([self.bond(x, np.zeros(1), T)[0, 0] for T in np.atleast_1d(tenors)])
+
+    def value(self, x: np.ndarray, t: np.ndarray, maturities, flows) -> np.ndarray:
+        """Value of the cash flows paid after `t` in every state
+
+        Parameters
+        ----------
+        x : np.ndarray
+            States, shape (steps, factors, scenarios)
+        t : np.ndarray
+            Increasing times of the steps
+        maturities : array-like of float
+            Payment times of the cash flows
+        flows : array-like of float
+            Amounts of the cash flows, with a leading axis to value several
+            series of cash flows at once
+
+        Returns
+        -------
+        np.ndarray
+            Values, shape (steps, scenarios) or (series, steps, scenarios)
+        """
+        if self.factors == 1:
+            return self._grid_value(x, t, maturities, flows)
+        flows = np.asarray(flows, dtype=float)
+        values = np.zeros(flows.shape[:-1] + (len(t), x.shape[-1]))
+        for T, flow in zip(maturities, np.moveaxis(flows, -1, 0)):
+            live = np.searchsorted(t, T)
+            if live:
+                values[..., :live, :] += np.multiply.outer(flow, self.bond(x[:live], t[:live], T))
+        return values
+
+    def _grid_value(self, x, t, maturities, flows, points: int = 128) -> np.ndarray:
+        """Value priced on a grid of the first factor at every step and interpolated
+
+        The cost grows with the number of cash flows or the number of
+        scenarios, but not with both. The other factors are taken as zero.
+        """
+        flows = np.asarray(flows, dtype=float)
+        low, high = x[:, 0].min(axis=1), x[:, 0].max(axis=1)
+        width = np.maximum(high - low, 1e-12) / (points - 1)
+        grid = np.zeros((len(t), self.factors, points))
+        grid[:, 0] = low[:, None] + width[:, None] * np.arange(points)
+        values = np.zeros(flows.shape[:-1] + (len(t), points))
+        for T, flow in zip(maturities, np.moveaxis(flows, -1, 0)):
+            live = np.searchsorted(t, T)
+            if live:
+                values[..., :live, :] += np.multiply.outer(flow, self.bond(grid[:live], t[:live], T))
+
+        # Linear interpolation on the evenly spaced grid of every step
+        position = np.clip((x[:, 0] - low[:, None]) / width[:, None], 0, points - 1)
+        idx = np.minimum(position.astype(np.int64), points - 2)
+        weight = position - idx
+        lower = np.take_along_axis(values, np.broadcast_to(idx, values.shape[:-1] + idx.shape[-1:]), axis=-1)
+        upper = np.take_along_axis(values, np.broadcast_to(idx + 1, values.shape[:-1] + idx.shape[-1:]), axis=-1)
+        return lower + (upper - lower) * weight
+
+
+class CIR(Model):
+    """Cox-Ingersoll-Ross model, dr = a(b - r)dt + sigma sqrt(r) dW"""
+
+    def __init__(self, a: float, b: float, sigma: float, init: float):
+        self.a, self.b, self.sigma, self.init = a, b, sigma, init
+
+    def initial(self, scenarios):
+        return np.full((1, scenarios), np.log1p(self.init))
+
+    def step(self, rng, x, dt):
+        return cir_step(rng, x, self.a, self.b, self.sigma, dt)
+
+    def rate(self, x, t):
+        return x[:, 0]
+
+    def bond(self, x, t, maturity):
+        A, B = cir_bond(maturity - t, self.a, self.b, self.sigma)
+        return A[:, None] * np.exp(-B[:, None] * x[:, 0])
+
+    def discount(self, tenors):
+        A, B = cir_bond(tenors, self.a, self.b, self.sigma)
+        return A * np.exp(-B * np.log1p(self.init))
+
+    def moments(self, t):
+        a, b, sigma, r0 = self.a, self.b, self.sigma, np.log1p(self.init)
+        t = np.asarray(t, dtype=float)
+        if a == 0:
+            return np.full_like(t, r0), r0 * sigma**2 * t
+        decay = np.exp(-a * t)
+        return b + (r0 - b) * decay, \
+            sigma**2 / a * (r0 * (decay - decay**2) + b / 2 * (1 - decay)**2)
+
+
+class Vasicek(Model):
+    """Vasicek model, dr = a(b - r)dt + sigma dW"""
+
+    def __init__(self, a: float, b: float, sigma: float, init: float):
+        self.a, self.b, self.sigma, self.init = a, b, sigma, init
+
+    def coefficients(self, tau) -> tuple[np.ndarray, np.ndarray]:
+        a, b, sigma = self.a, self.b, self.sigma
+        tau = np.asarray(tau, dtype=float)
+        if a == 0:
+            return np.exp(sigma**2 * tau**3 / 6), tau
+        B = -np.expm1(-a * tau) / a
+        return np.exp((b - sigma**2 / (2 * a**2)) * (B - tau) - sigma**2 * B**2 / (4 * a)), B
+
+    def initial(self, scenarios):
+        return np.full((1, scenarios), np.log1p(self.init))
+
+    def step(self, rng, x, dt):
+        decay, scale = _ou_step(self.a, dt)
+        return self.b + (x - self.b) * decay + self.sigma * scale * rng.standard_normal(x.shape)
+
+    def rate(self, x, t):
+        return x[:, 0]
+
+    def bond(self, x, t, maturity):
+        A, B = self.coefficients(maturity - t)
+        return A[:, None] * np.exp(-B[:, None] * x[:, 0])
+
+    def discount(self, tenors):
+        A, B = self.coefficients(tenors)
+        return A * np.exp(-B * np.log1p(self.init))
+
+    def moments(self, t):
+        a, b, sigma, r0 = self.a, self.b, self.sigma, np.log1p(self.init)
+        t = np.asarray(t, dtype=float)
+        if a == 0:
+            return np.full_like(t, r0), sigma**2 * t
+        return b + (r0 - b) * np.exp(-a * t), sigma**2 * -np.expm1(-2 * a * t) / (2 * a)
+
+
+class G2(Model):
+    """Two-factor additive Gaussian model G2++, fitted to an initial curve
+
+    r = x + y + phi(t), where x and y are correlated Ornstein-Uhlenbeck
+    processes starting at zero, and phi(t) reproduces the curve exactly.
+    Both mean reversion speeds must be positive.
+    """
+
+    factors = 2
+
+    def __init__(self, a: float, sigma: float, b: float, eta: float, rho: float, curve: Curve):
+        self.a, self.sigma, self.b, self.eta, self.rho = a, sigma, b, eta, rho
+        self.curve = curve
+
+    def variance(self, tau) -> np.ndarray:
+        """Variance of the integral of x + y over `tau`"""
+        a, sigma, b, eta, rho = self.a, self.sigma, self.b, self.eta, self.rho
+        tau = np.asarray(tau, dtype=float)
+
+        def single(k, s):
+            return s**2 / k**2 * (tau + 2 / k * np.exp(-k * tau) - np.exp(-2 * k * tau) / (2 * k) - 3 / (2 * k))
+
+        cross = tau + np.expm1(-a * tau) / a + np.expm1(-b * tau) / b - np.expm1(-(a + b) * tau) / (a + b)
+        return single(a, sigma) + single(b, eta) + 2 * rho * sigma * eta / (a * b) * cross
+
+    def phi(self, t) -> np.ndarray:
+        a, sigma, b, eta, rho = self.a, self.sigma, self.b, self.eta, self.rho
+        t = np.asarray(t, dtype=float)
+        ea, eb = -np.expm1(-a * t), -np.expm1(-b * t)
+        return self.curve.forward(t) + sigma**2 / (2 * a**2) * ea**2 \
+            + eta**2 / (2 * b**2) * eb**2 + rho * sigma * eta / (a * b) * ea * eb
+
+    def initial(self, scenarios):
+        return np.zeros((2, scenarios))
+
+    def step(self, rng, x, dt):
+        decay_x, scale_x = _ou_step(self.a, dt)
+        decay_y, scale_y = _ou_step(self.b, dt)
+        sx, sy = self.sigma * scale_x, self.eta * scale_y
+        corr = self.rho * self.sigma * self.eta * -np.expm1(-(self.a + self.b) * dt) / (self.a + self.b) / (sx * sy) \
+            if sx * sy > 0 else 0.
+        z = rng.standard_normal(x.shape)
+        return np.stack([
+            x[0] * decay_x + sx * z[0],
+            x[1] * decay_y + sy * (corr * z[0] + np.sqrt(1 - corr**2) * z[1])])
+
+    def rate(self, x, t):
+        return x[:, 0] + x[:, 1] + self.phi(t)[:, None]
+
+    def moments(self, t):
+        a, sigma, b, eta, rho = self.a, self.sigma, self.b, self.eta, self.rho
+        t = np.asarray(t, dtype=float)
+        return self.phi(t), sigma**2 * -np.expm1(-2 * a * t) / (2 * a) + eta**2 * -np.expm1(-2 * b * t) / (2 * b) \
+            + 2 * rho * sigma * eta * -np.expm1(-(a + b) * t) / (a + b)
+
+    def bond(self, x, t, maturity):
+        tau = maturity - t
+        Ba, Bb = -np.expm1(-self.a * tau) / self.a, -np.expm1(-self.b * tau) / self.b
+        A = self.curve.discount(maturity) / self.curve.discount(t) * np.exp(
+            (self.variance(tau) - self.variance(maturity) + self.variance(t)) / 2)
+        return A[:, None] * np.exp(-Ba[:, None] * x[:, 0] - Bb[:, None] * x[:, 1])
+
+
+class HullWhite(G2):
+    """Hull-White model, dr = (theta(t) - a r)dt + sigma dW, fitted to an initial curve"""
+
+    def __init__(self, a: float, sigma: float, curve: Curve):
+        super().__init__(a, sigma, 1., 0., 0., curve)
+
+    def value(self, x, t, maturities, flows):
+        # The second factor never moves
+        return self._grid_value(x, t, maturities, flows)
+
+
+@lru_cache(maxsize=32)
+def _bk_chain(a: float, b: float, sigma: float, init: float, horizon: float, steps_per_year: int, points: int = 201) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Markov chain of the Black-Karasinski log-rate
+
+    The log-rate is discretized on a grid whose transitions over a step are
+    the exact Gaussian ones. Returns the grid, the transition matrix and the
+    discount factor of a step from every grid point.
+    """
+    dt = 1 / steps_per_year
+    mean, x0 = np.log(b), np.log(init)
+    spread = sigma / np.sqrt(2 * a) if a > 0 else sigma * np.sqrt(horizon)
+    grid = np.linspace(min(mean, x0) - 6 * spread, max(mean, x0) + 6 * spread, points)
+
+    decay, scale = _ou_step(a, dt)
+    edges = np.concatenate([[-np.inf], (grid[1:] + grid[:-1]) / 2, [np.inf]])
+    cdf = ndtr((edges[None, :] - (mean + (grid[:, None] - mean) * decay)) / max(sigma * scale, 1e-12))
+    return grid, np.diff(cdf, axis=1), np.exp(-np.exp(grid) * dt)
+
+
+class BlackKarasinski(Model):
+    """Black-Karasinski model, d ln r = a(ln b - ln r)dt + sigma dW
+
+    No closed form exists for the bond. Values are discounted backwards
+    through a cached Markov chain of the log-rate, and discount factors of
+    the initial state are rolled forward through it.
+    """
+
+    def __init__(self, a: float, b: float, sigma: float, init: float):
+        self.a, self.b, self.sigma = a, max(b, 1e-4), sigma
+        self.init = max(init, 1e-4)
+
+    def chain(self, horizon: float, steps_per_year: int):
+        return _bk_chain(self.a, self.b, self.sigma, np.log1p(self.init), horizon, steps_per_year)
+
+    def initial(self, scenarios):
+        return np.full((1, scenarios), np.log(np.log1p(self.init)))
+
+    def step(self, rng, x, dt):
+        decay, scale = _ou_step(self.a, dt)
+        mean = np.log(self.b)
+        return mean + (x - mean) * decay + self.sigma * scale * rng.standard_normal(x.shape)
+
+    def rate(self, x, t):
+        return np.exp(x[:, 0])
+
+    def moments(self, t):
+        """Mean and variance of the lognormal short rate"""
+        mean, x0 = np.log(self.b), np.log(np.log1p(self.init))
+        t = np.asarray(t, dtype=float)
+        m = mean + (x0 - mean) * np.exp(-self.a * t)
+        v = self.sigma**2 * (-np.expm1(-2 * self.a * t) / (2 * self.a) if self.a > 0 else t)
+        return np.exp(m + v / 2), np.expm1(v) * np.exp(2 * m + v)
+
+    def backward(self, x, t, maturities, flows) -> np.ndarray:
+        """Value of the cash flows paid from `t` onwards, which must start at zero"""
+        steps_per_year = round(1 / (t[1] - t[0])) if len(t) > 1 else 1
+        flows = np.asarray(flows, dtype=float)
+        idx = np.round(np.asarray(maturities) * steps_per_year).astype(int)
+        grid, transition, discount = self.chain(max(idx.max(), len(t) - 1) / steps_per_year, steps_per_year)
+
+        paid = np.zeros(flows.shape[:-1] + (max(idx.max() + 1, len(t)),))
+        np.add.at(paid, (..., idx), flows)
+        values = np.empty(flows.shape[:-1] + (len(t), x.shape[-1]))
+        value = np.zeros(flows.shape[:-1] + grid.shape)
+        for i in range(paid.shape[-1] - 1, -1, -1):
+            value = paid[..., i, None] + discount * (value @ transition.T)
+            if i < len(t):
+                for series in np.ndindex(flows.shape[:-1]):
+                    values[series + (i,)] = np.interp(x[i, 0], grid, value[series])
+        return values
+
+    def bond(self, x, t, maturity):
+        return self.backward(x, t, [maturity], [1.])
+
+    def value(self, x, t, maturities, flows):
+        steps_per_year = round(1 / (t[1] - t[0])) if len(t) > 1 else 1
+        flows = np.asarray(flows, dtype=float)
+        paid = np.zeros(flows.shape[:-1] + (len(t),))
+        idx = np.round(np.asarray(maturities) * steps_per_year).astype(int)
+        within = idx < len(t)
+        np.add.at(paid, (..., idx[within]), flows[..., within])
+        return self.backward(x, t, maturities, flows) - paid[..., None]
+
+    def discount(self, tenors, steps_per_year: int = 12):
+        tenors = np.atleast_1d(tenors)
+        grid, transition, discount = self.chain(tenors.max(), steps_per_year)
+
+        # State prices, starting at the initial log-rate split between its neighbours
+        x0 = np.log(np.log1p(self.init))
+        prices = np.maximum(0, 1 - np.abs(grid - x0) / (grid[1] - grid[0]))
+        factors = [1.]
+        for _ in range(int(np.ceil(tenors.max() * steps_per_year))):
+            prices = (prices * discount) @ transition
+            factors.append(prices.sum())
+        return np.interp(tenors, np.arange(len(factors)) / steps_per_year, factors)
+
+
+def _chunk(seed, scenarios: int, model: Model, years: float, steps_per_year: int, dtype, summary):
+    rng = np.random.default_rng(seed)
+    dt = 1/steps_per_year
+    n = int(years * steps_per_year) + 1
+    times = np.arange(n) * dt
+
+    x = model.initial(scenarios)
+    states = np.empty((n,) + x.shape, dtype=dtype)
+    states[0] = x
+    for step in range(1, n):
+        x = model.step(rng, x, dt)
+        states[step] = x
+
+    return summary().observe(model, states, times, years, rng)
+
+
+def simulate(model: Model, years: float, scenarios: int = 1, steps_per_year: int = 12, seed: int = None, dtype=np.float64, chunk: int = 10_000, workers: int = 1, summary=Paths):
+    """Simulation engine shared by the short-rate models
+
+    Scenarios are generated in chunks, optionally across a process pool.
+    Every chunk draws from its own stream spawned from `seed`, so the result
+    is reproducible and independent of the number of workers. Each chunk is
+    folded into `summary` in the worker, which bounds the memory by the size
+    of a chunk unless the summary keeps the paths.
+
+    Parameters
+    ----------
+    model : Model
+        Short-rate model
+    years : float
+        Number of years, also the maturity of the zero-coupon bond
+    scenarios : int, optional
+        Number of simulations, by default 1
+    steps_per_year : int, optional
+        Steps per year, by default 12
+    seed : int, optional
+        Seed of the random number generator, by default None
+    dtype : optional
+        Precision of the paths, by default np.float64
+    chunk : int, optional
+        Number of scenarios per chunk, by default 10,000
+    workers : int, optional
+        Number of processes, by default 1. None for the number of CPUs.
+    summary : optional
+        Factory of an empty summary of the paths, with `update` and `merge`
+        methods, by default `Paths`
+
+    Returns
+    -------
+    The merged summary
+    """
+    sizes = [min(chunk, scenarios - i) for i in range(0, scenarios, chunk)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    run = partial(_chunk, model=model, years=years, steps_per_year=steps_per_year,
+                  dtype=dtype, summary=summary)
+
+    workers = min(workers or os.cpu_count() or 1, len(sizes))
+    if workers > 1:
+        with ProcessPoolExecutor(workers) as executor:
+            return reduce(lambda x, y: x.merge(y), executor.map(run, seeds, sizes))
+    return reduce(lambda x, y: x.merge(y), map(run, seeds, sizes))
+
+
+def cir(years: float, a: float, b: float, sigma: float, init: float, scenarios: int = 1, steps_per_year: int = 12, **kwargs):
+    """Cox-Ingersoll-Ross simulation, see `simulate` for the other arguments"""
+    return simulate(CIR(a, b, sigma, init), years, scenarios, steps_per_year, **kwargs)
+
+
+def calibrate(model, curve: Curve, x0, bounds) -> Model:
+    """Least-squares fit of the constant parameters of a model to a zero curve
+
+    Parameters
+    ----------
+    model : type
+        Model class whose arguments are the fitted parameters, e.g. `Vasicek`
+        or `CIR` with (a, b, sigma, init)
+    curve : Curve
+        Zero curve to fit
+    x0 : array-like
+        Initial parameters
+    bounds : tuple
+        Lower and upper bounds of the parameters
+
+    Returns
+    -------
+    Model
+        The fitted model
+    """
+    def residuals(p):
+        return -np.log(model(*p).discount(curve.tenors)) / curve.tenors - curve.rates
+
+    return model(*least_squares(residuals, x0, bounds=bounds).x)
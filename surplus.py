@@ -0,0 +1,235 @@
+import numpy as np
+from scipy.optimize import nnls
+import kernels
+from shortrate import Histogram, Summary
+
+
+def align(maturities, flows, steps_per_year: int) -> tuple[np.ndarray, np.ndarray]:
+    """Cash flows moved to the end of their simulation step and summed
+
+    Parameters
+    ----------
+    maturities : array-like of float
+        Payment times in years
+    flows : array-like of float
+        Amounts
+    steps_per_year : int
+        Steps per year of the simulation
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        Payment times on the grid of the steps, and the amounts paid
+    """
+    idx = np.ceil(np.asarray(maturities, dtype=float) * steps_per_year - 1e-9).astype(int)
+    paid = np.bincount(idx, weights=flows)
+    steps = np.flatnonzero(paid)
+    return steps / steps_per_year, paid[steps]
+
+
+def hedge(maturities, flows, discount, budget: float, candidates, convexity: bool = True) -> np.ndarray:
+    """Face amounts of zero-coupon bonds matching the duration and convexity of liabilities
+
+    Non-negative least squares on the value and the first two moments of the
+    discounted cash flows in time, i.e. the sensitivities to a parallel shift
+    of the zero rates, each scaled to be comparable. The bonds cost `budget`
+    and share the duration and convexity of the liabilities when they can.
+
+    Parameters
+    ----------
+    maturities : array-like of float
+        Payment times of the liabilities
+    flows : array-like of float
+        Amounts of the liabilities
+    discount : callable
+        Discount factors by maturity
+    budget : float
+        Value to invest in the bonds
+    candidates : array-like of float
+        Maturities of the bonds available
+    convexity : bool, optional
+        Whether to match the convexity as well as the duration, by default True
+
+    Returns
+    -------
+    np.ndarray
+        Face amount of every candidate bond
+    """
+    maturities, candidates = np.asarray(maturities, dtype=float), np.asarray(candidates, dtype=float)
+    if budget <= 0:
+        return np.zeros(len(candidates))
+    liability = np.asarray(flows) * discount(maturities)
+    bond = discount(candidates)
+
+    # Value, dollar duration and dollar convexity of one unit of face
+    moments = np.arange(3 if convexity else 2)[:, None]
+    target = (maturities ** moments * liability).sum(axis=1)
+    target *= budget / target[0]
+    matrix = candidates ** moments * bond
+    scale = 1 / np.abs(target)
+    faces, _ = nnls(matrix * scale[:, None], target * scale)
+    return faces
+
+
+class Surplus(Summary):
+    """Summary of the funding of liabilities by a portfolio along the scenarios
+
+    The portfolio starts with cash, equity and zero-coupon bonds held to
+    maturity. Cash earns the short rate, receives the face of the maturing
+    bonds and pays the liabilities, borrowing at the short rate when
+    negative. Equity earns the short rate plus a premium with a lognormal
+    shock independent of the rates. Liabilities and bonds are valued in every
+    state with the model. The funding ratio is only defined while liabilities
+    are outstanding, so the steps after the last payment are left out of its
+    percentiles and mean, and the surplus at the horizon is kept for every
+    scenario instead.
+
+    Parameters
+    ----------
+    maturities, flows : array-like of float
+        Payment times, on the grid of the steps, and amounts of the liabilities
+    cash : float
+        Initial cash
+    equity : float
+        Initial equity
+    bonds, faces : array-like of float
+        Maturities, on the grid of the steps, and face amounts of the bonds
+    premium : float, optional
+        Equity risk premium, by default 0.04
+    vol : float, optional
+        Equity volatility, by default 0.15
+    samples : int, optional
+        Number of sample paths kept, by default 10
+    funding : tuple, optional
+        Range of the funding ratio sketch, by default (0, 3)
+    bins : int, optional
+        Number of bins of the sketch, by default 3000
+    fan : optional
+        Factory of a summary of the rates and bond prices of the same paths,
+        e.g. `shortrate.Fan`, kept as `fan`, by default None
+    """
+
+    def __init__(self, maturities, flows, cash: float, equity: float, bonds=(), faces=(), premium: float = 0.04, vol: float = 0.15, samples: int = 10, funding: tuple = (0., 3.), bins: int = 3000, fan=None):
+        self.maturities, self.flows = np.asarray(maturities, dtype=float), np.asarray(flows, dtype=float)
+        self.cash, self.equity = cash, equity
+        self.bonds, self.faces = np.asarray(bonds, dtype=float), np.asarray(faces, dtype=float)
+        self.premium, self.vol = premium, vol
+        self.samples = samples
+        self.funding = Histogram(*funding, bins)
+        self.n = 0
+        self.live = self.funding_sum = 0
+        self.shortfall = self.underfunded = 0
+        self.sample_funding = None
+        self.final = []
+        self.fan = None if fan is None else fan()
+
+    def observe(self, model, states, times, years, rng):
+        if self.fan is not None:
+            self.fan.observe(model, states, times, years, rng)
+        steps, scenarios = len(times), states.shape[-1]
+        dt = times[1] - times[0] if steps > 1 else years
+        rates = model.rate(states, times)
+
+        # Flows of every step, on the grid of the simulation
+        inflow = np.zeros(steps)
+        for maturities, flows, sign in [(self.maturities, self.flows, -1), (self.bonds, self.faces, 1)]:
+            idx = np.round(maturities / dt).astype(int)
+            within = idx < steps
+            np.add.at(inflow, idx[within], sign * flows[within])
+
+        shocks = (rates[:-1] + self.premium - self.vol ** 2 / 2) * dt \
+            + self.vol * np.sqrt(dt) * rng.standard_normal((steps - 1, scenarios))
+        equity = self.equity * np.exp(np.vstack([np.zeros((1, scenarios)), shocks.cumsum(axis=0)]))
+
+        # Liabilities and bonds valued together on the same grid
+        maturities = np.concatenate([self.maturities, self.bonds])
+        flows = np.zeros((2, len(maturities)))
+        flows[0, :len(self.maturities)] = self.flows
+        flows[1, len(self.maturities):] = self.faces
+        liabilities, bonds = model.value(states, times, maturities, flows)
+        return self.fund(rates, dt, inflow, equity + bonds, liabilities)
+
+    def fund(self, rates: np.ndarray, dt: float, inflow: np.ndarray, other: np.ndarray, liabilities: np.ndarray):
+        """Run the cash account along the scenarios and fold the funding ratios in
+
+        Parameters
+        ----------
+        rates : np.ndarray
+            Continuously compounded short rates, shape (steps, scenarios)
+        dt : float
+            Length of a step
+        inflow : np.ndarray
+            Cash received at every step, negative when paid
+        other : np.ndarray
+            Value of the other assets, shape (steps, scenarios)
+        liabilities : np.ndarray
+            Value of the liabilities, shape (steps, scenarios)
+        """
+        start = np.full(liabilities.shape[1], float(self.cash))
+        if kernels.ENABLED:
+            counts, low, high, *rest, cash = kernels.fund(
+                start, *kernels.contiguous(rates), float(dt), *kernels.contiguous(inflow, other, liabilities),
+                float(self.funding.lo), float(self.funding.hi), int(self.funding.bins), int(self.samples))
+            return self._add(len(start), Histogram(self.funding.lo, self.funding.hi, self.funding.bins)
+                             .merge_counts(counts, low, high), *rest, [cash + other[-1] - liabilities[-1]])
+
+        cash = np.empty_like(liabilities)
+        cash[0] = start + inflow[0]
+        growth = np.exp(rates[:-1] * dt)
+        for i in range(1, len(inflow)):
+            cash[i] = cash[i - 1] * growth[i - 1] + inflow[i]
+        return self.update(cash + other, liabilities)
+
+    def update(self, assets: np.ndarray, liabilities: np.ndarray):
+        surplus = assets - liabilities
+        # No funding ratio once every liability has been paid
+        live = liabilities > 0
+        funding = np.divide(assets, liabilities, out=np.full_like(assets, np.nan), where=live)
+        # Tolerate the rounding of a portfolio that exactly funds its liabilities
+        short = surplus < -1e-9 * np.abs(liabilities)
+        return self._add(assets.shape[1], Histogram(self.funding.lo, self.funding.hi, self.funding.bins).update(funding),
+                         np.where(live, np.minimum(funding, self.funding.hi), 0).sum(axis=1), live.sum(axis=1),
+                         short.sum(axis=1), np.logical_or.accumulate(short, axis=0).sum(axis=1),
+                         funding[:, :self.samples].copy(), [surplus[-1]])
+
+    def _add(self, n: int, funding: Histogram, total: np.ndarray, live: np.ndarray, shortfall: np.ndarray, underfunded: np.ndarray, sample: np.ndarray, final: list):
+        self.funding.merge(funding)
+        self.final.extend(final)
+        self.n += n
+        self.live = self.live + live
+        self.funding_sum = self.funding_sum + total
+        self.shortfall = self.shortfall + shortfall
+        self.underfunded = self.underfunded + underfunded
+        if self.sample_funding is None:
+            self.sample_funding = sample
+        elif self.sample_funding.shape[1] < self.samples:
+            self.sample_funding = np.hstack([self.sample_funding,
+                                             sample[:, :self.samples - self.sample_funding.shape[1]]])
+        return self
+
+    def merge(self, other):
+        if self.fan is not None:
+            self.fan.merge(other.fan)
+        return self._add(other.n, other.funding, other.funding_sum, other.live, other.shortfall, other.underfunded,
+                         other.sample_funding, other.final)
+
+    def mean(self) -> np.ndarray:
+        """Mean funding ratio at every step, capped at the top of the sketch"""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.funding_sum / self.live
+
+    def quantile(self, q) -> np.ndarray:
+        return self.funding.quantile(q)
+
+    def probability(self) -> tuple[np.ndarray, np.ndarray]:
+        """Probability of a shortfall at every step, and of any shortfall up to every step"""
+        return self.shortfall / self.n, self.underfunded / self.n
+
+    def terminal(self) -> np.ndarray:
+        """Surplus of every scenario at the horizon"""
+        return np.concatenate(self.final)
+
+    def distribution(self, bins: int = 60) -> tuple[np.ndarray, np.ndarray]:
+        """Histogram of the surplus at the horizon, edges and frequencies"""
+        counts, edges = np.histogram(self.terminal(), bins)
+        return edges, counts / self.n
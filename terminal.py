@@ -1,4 +1,6 @@
+import threading
 import streamlit as st
+import kernels
 
 pages = {
     "Market": [
@@ -36,6 +38,14 @@ st.set_page_config(
     }
 )
 
+
+@st.cache_resource
+def warmup():
+    """Load the compiled kernels in the background once per server, before a model page needs them"""
+    threading.Thread(target=kernels.warmup, daemon=True).start()
+
+
+warmup()
 st.logo('images/icon.png', icon_image='images/icon.png', size='large')
 pg = st.navigation(pages, position="top")
 pg.run()
@@ -0,0 +1,75 @@
+import io
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from zipfile import ZipFile
+import pandas as pd
+import pytest
+import bis
+
+CSV = """FREQ:Frequency,REF_AREA:Reference area,TIME_PERIOD:Time period or range,OBS_VALUE:Observation Value
+D: Daily,CA: Canada,2024-01-02,5.0
+D: Daily,US: United States,2024-01-02,5.5
+M: Monthly,CA: Canada,2024-01,5.0
+D: Daily,ZZ: Elsewhere,2024-01-02,9.0
+D: Daily,CA: Canada,2019-12-31,1.75
+"""
+
+
+class BIS(BaseHTTPRequestHandler):
+    """Stand-in for the BIS bulk file, answering 304 to a matching ETag"""
+    etag = '"v1"'
+    requests = []
+
+    def do_GET(self):
+        BIS.requests.append(dict(self.headers))
+        if self.headers.get('If-None-Match') == BIS.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        content = io.BytesIO()
+        with ZipFile(content, 'w') as z:
+            z.writestr('WS_CBPOL_csv_flat.csv', CSV)
+        self.send_response(200)
+        self.send_header('ETag', BIS.etag)
+        self.send_header('Last-Modified', 'Tue, 02 Jan 2024 00:00:00 GMT')
+        self.send_header('Content-Length', str(len(content.getvalue())))
+        self.end_headers()
+        self.wfile.write(content.getvalue())
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    BIS.requests = []
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), BIS)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_address[1]}/bulk.zip'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_load_downloads_then_revalidates(server, tmp_path):
+    path = str(tmp_path / 'policy.parquet')
+    first = bis.load(server, path)
+    assert sorted(first['iso']) == ['CA', 'US']
+    assert first['rate'].tolist() == pytest.approx([0.05, 0.055])
+    assert 'If-None-Match' not in BIS.requests[0]
+
+    second = bis.load(server, path)
+    assert BIS.requests[1]['If-None-Match'] == BIS.etag
+    pd.testing.assert_frame_equal(first, second)
+
+
+def test_load_leaves_no_temporary_files(server, tmp_path):
+    bis.load(server, str(tmp_path / 'policy.parquet'))
+    assert sorted(os.listdir(tmp_path)) == ['policy.parquet', 'policy.parquet.json']
+
+
+def test_load_serves_the_copy_when_unreachable(server, tmp_path):
+    path = str(tmp_path / 'policy.parquet')
+    first = bis.load(server, path)
+    pd.testing.assert_frame_equal(bis.load('http://127.0.0.1:9/bulk.zip', path, timeout=5), first)
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import pytest
+import kernels
+import pricing
+import surplus
+
+GRID = np.linspace(50, 150, 7)
+LEGS = (['Call', 'Put', 'Stock', 'Debt', 'Other'], [90., 110., 0., 100., 100.], [1., -2., 1., 0.5, 3.])
+
+
+def surplus_step(scenarios: int = 50, years: int = 2, steps_per_year: int = 12):
+    rng = np.random.default_rng(0)
+    steps = years * steps_per_year + 1
+    rates = rng.normal(0.03, 0.01, (steps, scenarios))
+    inflow = np.full(steps, -1000 / steps_per_year)
+    other = rng.lognormal(8, 0.5, (steps, scenarios))
+    liabilities = np.linspace(1, 0, steps)[:, None] * rng.lognormal(9.5, 0.1, scenarios)
+    summary = surplus.Surplus([], [], cash=5000., equity=0.).fund(
+        rates, 1 / steps_per_year, inflow, other, liabilities)
+    return np.concatenate([summary.funding.counts.ravel(), summary.funding_sum, summary.live, summary.shortfall,
+                           summary.underfunded, summary.sample_funding.ravel(), summary.terminal()])
+
+
+def frongello(periods: int, segments: int = 3):
+    """Linked attribution as on the linking page, by the kernel or by `ftk.frongello`"""
+    rng = np.random.default_rng(0)
+    p = pd.DataFrame(rng.normal(0.001, 0.01, (periods, segments)))
+    b = pd.DataFrame(rng.normal(0.001, 0.01, (periods, segments)))
+    if kernels.ENABLED:
+        return kernels.frongello(*kernels.contiguous(p.to_numpy(), b.to_numpy()), 0.5)
+    ftk = pytest.importorskip('toolkit')
+    return ftk.frongello(p, b, sel=0.5).to_numpy()
+
+
+CASES = {
+    'greeks without legs': lambda: pricing.greeks([], [], [], GRID, 0.03, 0.5, 0.2, 0.01),
+    'greeks without legs, scalar spot': lambda: pricing.greeks([], [], [], 100., 0.03, 0.5, 0.2, 0.01),
+    'greeks of scalar inputs': lambda: pricing.greeks(*LEGS, 100., 0.03, 0.5, 0.2, 0.01),
+    'greeks on a grid': lambda: pricing.greeks(*LEGS, GRID[:, None], 0.03, np.array([0.25, 1.]), 0.2, 0.01),
+    'greeks with volatility by leg': lambda: pricing.greeks(*LEGS, GRID, 0.03, 0.5,
+                                                            np.linspace(0.1, 0.5, 5)[:, None], 0.01),
+    'greeks at expiration': lambda: pricing.greeks(*LEGS, GRID, 0.03, 0., 0.2, 0.01),
+    'surface without legs': lambda: pricing.surface([], [], [], GRID, [0.5, 1.], [0.2, 0.3], 0.03, 0.01),
+    'surface': lambda: pricing.surface(*LEGS, GRID, [0.5, 1.], [0.2, 0.3], 0.03, 0.01, dtype=float),
+    'surplus step loop': surplus_step,
+    'frongello linking': lambda: frongello(12),
+    'frongello linking of one period': lambda: frongello(1),
+}
+
+
+@pytest.fixture(params=[False, True], ids=['FTK_JIT=0', 'FTK_JIT=1'])
+def jit(request, monkeypatch):
+    if request.param and kernels.numba is None:
+        pytest.skip('Numba is not installed')
+    monkeypatch.setattr(kernels, 'ENABLED', request.param)
+    return request.param
+
+
+@pytest.mark.parametrize('case', CASES)
+def test_kernels_agree_with_numpy(case, jit, monkeypatch):
+    actual = np.asarray(CASES[case]())
+    monkeypatch.setattr(kernels, 'ENABLED', False)
+    expected = np.asarray(CASES[case]())
+    assert actual.shape == expected.shape
+    np.testing.assert_allclose(actual, expected, rtol=1e-9, atol=1e-9, equal_nan=True)
+
+
+def test_greeks_without_legs_are_empty(jit):
+    assert pricing.greeks([], [], [], GRID, 0.03, 0.5, 0.2, 0.01).shape == (len(pricing.GREEKS), 0, len(GRID))
+
+
+def test_warmup_compiles_one_signature_per_kernel(jit):
+    kernels.warmup()
+    pricing.greeks(*LEGS, GRID, 0.03, 0.5, np.full(5, 0.2)[:, None], 0.01)
+    pricing.greeks(*LEGS, 100., 0.03, 0.5, 0.2, 0.01)
+    surplus_step()
+    frongello(12)
+    if jit:
+        assert all(len(getattr(kernels, name).signatures) == 1 for name in ('greeks', 'fund', 'frongello'))
@@ -6,8 +6,12 @@ import inspect
 import json
 import redis
 import os
+import time
+from concurrent import futures
 from datetime import datetime, timezone
+import pandas as pd
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import toolkit as ftk
 
 
@@ -19,6 +23,130 @@ def format_table(s):
     return tbl.style.format('{0:.2%}')
 
 
+def fetch(sources: dict, timeout=30, retries=2, backoff: float = 0.5, workers: int = None, progress=None) -> tuple[dict, dict]:
+    """Call independent data sources concurrently
+
+    Every source runs in its own thread, which carries the script run context
+    so that Streamlit calls inside it still reach the page. A failing source
+    is retried with exponential backoff, and one that fails or runs out of
+    time does not hold up the others.
+
+    Parameters
+    ----------
+    sources : dict
+        Functions without arguments by name
+    timeout : float or dict, optional
+        Seconds each source may take from the start, by name when a dict,
+        by default 30
+    retries : int or dict, optional
+        Number of retries after a failure, by name when a dict, by default 2
+    backoff : float, optional
+        Seconds before the first retry, doubled after every retry, by default 0.5
+    workers : int, optional
+        Number of threads, by default one per source
+    progress : callable, optional
+        Called with the number of sources done after each one
+
+    Returns
+    -------
+    tuple[dict, dict]
+        Results of the sources that succeeded, and exceptions of those that did not, by name
+    """
+    def attempt(func, retries):
+        for i in range(retries + 1):
+            try:
+                return func()
+            except Exception:
+                if i == retries:
+                    raise
+                time.sleep(backoff * 2 ** i)
+
+    ctx = get_script_run_ctx()
+    start = time.monotonic()
+    results, errors = {}, {}
+    pool = futures.ThreadPoolExecutor(max_workers=workers or max(len(sources), 1),
+                                      initializer=lambda: add_script_run_ctx(ctx=ctx))
+    pending = {name: pool.submit(attempt, func, retries.get(name, 2) if isinstance(retries, dict) else retries)
+               for name, func in sources.items()}
+    for name, future in pending.items():
+        limit = timeout.get(name, 30) if isinstance(timeout, dict) else timeout
+        try:
+            results[name] = future.result(timeout=max(start + limit - time.monotonic(), 0))
+        except futures.TimeoutError:
+            errors[name] = TimeoutError(f'{name} did not respond within {limit} seconds')
+        except Exception as e:
+            errors[name] = e
+        if progress is not None:
+            progress(len(results) + len(errors))
+    # Do not wait for the sources that timed out
+    pool.shutdown(wait=False, cancel_futures=True)
+    return results, errors
+
+
+@st.cache_data(ttl=3600)
+def get_region_yield_curve(region: str) -> pd.DataFrame:
+    """Month-end yield curve of 'Canada' or 'US' in long format, in percent"""
+    def canada():
+        yield_ca = ftk.get_boc_bulk(['V80691342', 'V80691344', 'V80691345', 'V80691346', 'BD.CDN.2YR.DQ.YLD', 'BD.CDN.3YR.DQ.YLD', 'BD.CDN.5YR.DQ.YLD', 'BD.CDN.7YR.DQ.YLD', 'BD.CDN.10YR.DQ.YLD', 'BD.CDN.LONG.DQ.YLD'])\
+            .groupby(pd.Grouper(freq='ME')).last()
+        yield_ca.rename(columns={
+            'V80691342': 1/12,
+            'V80691344': 3/12,
+            'V80691345': 6/12,
+            'V80691346': 1,
+            'BD.CDN.2YR.DQ.YLD': 2,
+            'BD.CDN.3YR.DQ.YLD': 3,
+            'BD.CDN.5YR.DQ.YLD': 5,
+            'BD.CDN.7YR.DQ.YLD': 7,
+            'BD.CDN.10YR.DQ.YLD': 10,
+            'BD.CDN.LONG.DQ.YLD': 25}, inplace=True)
+        return pd.melt(yield_ca.reset_index(), id_vars=['date'], var_name='Maturity', value_name='Bond Yield').assign(
+            Region='Canada').rename(columns={'date': 'Date'})
+
+    def us():
+        yield_us = ftk.get_us_yield_curve(n=3)\
+            .groupby(pd.Grouper(freq='ME')).last()
+        yield_us.rename(columns={
+            '1 Mo': 1/12,
+            '1.5 Month': 1.5/12,
+            '2 Mo': 2/12,
+            '3 Mo': 3/12,
+            '4 Mo': 4/12,
+            '6 Mo': 6/12,
+            '1 Yr': 1,
+            '2 Yr': 2,
+            '3 Yr': 3,
+            '5 Yr': 5,
+            '7 Yr': 7,
+            '10 Yr': 10,
+            '20 Yr': 20,
+            '30 Yr': 30}, inplace=True)
+        return pd.melt(yield_us.reset_index(), id_vars=['Date'], var_name='Maturity', value_name='Bond Yield').assign(Region='US')
+
+    return {'Canada': canada, 'US': us}[region]().dropna()
+
+
+def get_yield_curve() -> tuple[pd.DataFrame, dict]:
+    """Month-end yield curves of Canada and the US in long format, in percent
+
+    Both regions are fetched concurrently and cached one by one, so a region
+    that cannot be fetched is left out without being cached, and is fetched
+    again on the next call.
+
+    Returns
+    -------
+    tuple[pd.DataFrame, dict]
+        Yield curves of the regions fetched, and exceptions of those that
+        were not, by region
+    """
+    regions = ['Canada', 'US']
+    results, errors = fetch({region: functools.partial(get_region_yield_curve, region) for region in regions},
+                            timeout=60)
+    if not results:
+        raise next(iter(errors.values()))
+    return pd.concat([results[region] for region in regions if region in results], ignore_index=True), errors
+
+
 @st.cache_resource
 def get_redis():
     return redis.from_url(os.environ["REDIS_URL"])
@@ -1,89 +1,70 @@
+import numpy as np
 import pandas as pd
 import streamlit as st
 import altair as alt
-import toolkit as ftk
+import curves
+import bis
+import utils
 
-import requests
-from io import BytesIO
-from zipfile import ZipFile
 
-fields = {
-    'FREQ:Frequency': 'freq',
-    'REF_AREA:Reference area': 'country',
-    'TIME_PERIOD:Time period or range': 'date',
-    'OBS_VALUE:Observation Value': 'rate'
-}
-
-countries = ['CA', 'CH', 'CN', 'DE', 'FR', 'GB', 'HK',
-             'IN', 'IT', 'JP', 'KR', 'MX', 'AU', 'US', 'XM']
+@st.cache_data(ttl=3600)
+def get_policy() -> pd.DataFrame:
+    """Policy rates from the BIS bulk file, kept as Parquet between runs"""
+    return bis.load()
 
 
-@st.cache_data(ttl=3600)
-def get_data():
-    yield_ca = ftk.get_boc_bulk(['V80691342', 'V80691344', 'V80691345', 'V80691346', 'BD.CDN.2YR.DQ.YLD', 'BD.CDN.3YR.DQ.YLD', 'BD.CDN.5YR.DQ.YLD', 'BD.CDN.7YR.DQ.YLD', 'BD.CDN.10YR.DQ.YLD', 'BD.CDN.LONG.DQ.YLD'])\
-        .groupby(pd.Grouper(freq='ME')).last()
-    yield_ca.rename(columns={
-        'V80691342': 1/12,
-        'V80691344': 3/12,
-        'V80691345': 6/12,
-        'V80691346': 1,
-        'BD.CDN.2YR.DQ.YLD': 2,
-        'BD.CDN.3YR.DQ.YLD': 3,
-        'BD.CDN.5YR.DQ.YLD': 5,
-        'BD.CDN.7YR.DQ.YLD': 7,
-        'BD.CDN.10YR.DQ.YLD': 10,
-        'BD.CDN.LONG.DQ.YLD': 25}, inplace=True)
-
-    yield_us = ftk.get_us_yield_curve(n=3)\
-        .groupby(pd.Grouper(freq='ME')).last()
-    yield_us.rename(columns={
-        '1 Mo': 1/12,
-        '1.5 Month': 1.5/12,
-        '2 Mo': 2/12,
-        '3 Mo': 3/12,
-        '4 Mo': 4/12,
-        '6 Mo': 6/12,
-        '1 Yr': 1,
-        '2 Yr': 2,
-        '3 Yr': 3,
-        '5 Yr': 5,
-        '7 Yr': 7,
-        '10 Yr': 10,
-        '20 Yr': 20,
-        '30 Yr': 30}, inplace=True)
-
-    return pd.concat([
-        pd.melt(yield_ca.reset_index(), id_vars=['date'], var_name='Maturity', value_name='Bond Yield').assign(
-            Region='Canada').rename(columns={'date': 'Date'}),
-        pd.melt(yield_us.reset_index(), id_vars=['Date'], var_name='Maturity', value_name='Bond Yield').assign(Region='US')],
-        ignore_index=True).dropna()
+@st.cache_data(ttl=3600, show_spinner='Fitting curves...')
+def get_fit(region: str) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Nelson-Siegel-Svensson parameters of every month, and the yields they are fitted to"""
+    yields = utils.get_region_yield_curve(region).pivot_table(
+        index='Date', columns='Maturity', values='Bond Yield').sort_index(axis=1)
+    params = curves.fit(yields.columns.astype(float), yields.to_numpy())
+    return pd.DataFrame(params, index=yields.index, columns=curves.PARAMS), yields
 
 
 @st.cache_data(ttl=3600)
-def get_policy():
-    url = 'https://data.bis.org/static/bulk/WS_CBPOL_csv_flat.zip'
-    response = requests.get(url)
-    bytes = BytesIO(response.content)
-    with ZipFile(bytes) as z:
-        with z.open(z.namelist()[0]) as f:
-            df = pd.read_csv(f, usecols=fields.keys())
-
-    df = df.rename(columns=fields)
-    df = df[df['freq'] == 'D: Daily'].drop(columns='freq')
-    df[['iso', 'country']] = df['country'].str.split(':', expand=True)
-    df = df[df['iso'].isin(countries)]
-    df['date'] = pd.to_datetime(df["date"])
-    df['rate'] = df['rate'].div(100)
-    df = df[df['date'] >= '2020']
-
-    return df
-
-
-yc = get_data()
+def get_moments(region: str) -> tuple[pd.DatetimeIndex, np.ndarray, tuple]:
+    """Dates and maturities of the monthly yield changes, and their running sums"""
+    changes = utils.get_region_yield_curve(region).pivot_table(
+        index='Date', columns='Maturity', values='Bond Yield').sort_index(axis=1).diff().iloc[1:]
+    return changes.index, changes.columns.astype(float).to_numpy(), curves.moments(changes.to_numpy())
+
+
+@st.cache_data(ttl=3600, show_spinner='Decomposing changes...')
+def get_rolling(region: str, window: int, components: int = 3) -> pd.DataFrame:
+    """Share of variance explained by the first principal components over rolling windows"""
+    dates, _, moments = get_moments(region)
+    _, reference = curves.pca(curves.covariance(moments, 0, len(dates)))
+    share, _ = curves.rolling_pca(moments, window, reference)
+    return pd.DataFrame(share[:, :components], index=dates[window - 1:],
+                        columns=[f'PC {i + 1}' for i in range(components)])
+
+
+def fitted(region: str, at, method: str) -> pd.DataFrame:
+    """Yields of every month at maturities `at`, from the fitted curves or splines"""
+    params, yields = get_fit(region)
+    if method == 'Cubic Spline':
+        values = curves.spline(yields.columns.astype(float), yields.to_numpy(), at)
+    else:
+        values = curves.nss(params.to_numpy(), at)
+    return pd.DataFrame(values, index=yields.index, columns=at)
+
+
+# Yield curves and policy rates come from different sources, fetched concurrently.
+# The yield curves retry every region on their own, so they are not retried again as a whole.
+loaded, failed = utils.fetch({'yield curves': utils.get_yield_curve, 'policy rates': get_policy},
+                             timeout={'yield curves': 120, 'policy rates': 120},
+                             retries={'yield curves': 0, 'policy rates': 2})
+if 'yield curves' in failed:
+    st.error('Unable to fetch the yield curves')
+    st.stop()
+yc, missing = loaded['yield curves']
+for region in missing:
+    st.warning(f'Unable to fetch the {region} yield curve')
 dates = sorted(yc['Date'].unique())
 regions = sorted(yc['Region'].unique())
 
-policy = get_policy()
+policy = loaded.get('policy rates')
 
 with st.sidebar:
 
@@ -101,7 +82,7 @@ df = yc[(yc['Date'] == min) | (yc['Date'] == max)].copy()
 
 st.title('Fixed Income Dashboard')
 
-tab1, tab2 = st.tabs(['Canada & US Yield Curve', 'World Policy Rates'])
+tab1, tab3, tab4, tab2 = st.tabs(['Canada & US Yield Curve', 'Fitted Curves', 'Curve Risk', 'World Policy Rates'])
 with tab1:
     df['Date'] = df['Date'].dt.strftime('%Y-%m-%d')
     curve = alt.Chart(df).mark_line().encode(
@@ -121,28 +102,118 @@ with tab1:
     st.altair_chart(curve)
     st.altair_chart(history)
 
+with tab3:
+    col1, col2 = st.columns(2)
+    method = col1.segmented_control('Method', ['Nelson-Siegel-Svensson', 'Cubic Spline'],
+                                    default='Nelson-Siegel-Svensson') or 'Nelson-Siegel-Svensson'
+    maturity = col2.number_input('Maturity (Years)', min_value=0.1, max_value=30., value=4., step=0.5)
+
+    grid = np.round(np.linspace(1/12, 30, 120), 4)
+    smooth = pd.concat([
+        fitted(region, grid, method).reindex([min, max]).dropna(how='all').reset_index().melt(
+            id_vars='Date', var_name='Maturity', value_name='Bond Yield').assign(Region=region)
+        for region in regions], ignore_index=True)
+    smooth['Date'] = smooth['Date'].dt.strftime('%Y-%m-%d')
+    observed = df.assign(Maturity=df['Maturity'].astype(float))
+    line = alt.Chart().mark_line().encode(
+        x=alt.X('Maturity:Q', title='Maturity (Years)'),
+        y=alt.Y('Bond Yield:Q', title='Bond Yield (%)'),
+        color=alt.Color('Date:N', legend=alt.Legend(title='Dates', orient='top'))
+    ).transform_filter(alt.datum.Kind == 'Fitted')
+    points = alt.Chart().mark_point().encode(
+        x='Maturity:Q',
+        y='Bond Yield:Q',
+        color='Date:N'
+    ).transform_filter(alt.datum.Kind == 'Observed')
+    st.altair_chart(alt.layer(line, points, data=pd.concat([smooth.assign(Kind='Fitted'), observed.assign(Kind='Observed')],
+                                                            ignore_index=True)).facet(
+        column=alt.Column('Region:N', header=alt.Header(title=None))))
+
+    interpolated = pd.concat({region: fitted(region, [maturity], method)[maturity] for region in regions},
+                             axis=1).loc[min:max]
+    st.altair_chart(alt.Chart(interpolated.reset_index().melt(id_vars='Date', var_name='Region', value_name='Bond Yield')).mark_line().encode(
+        x='Date',
+        y=alt.Y('Bond Yield', title=f'{maturity:g}-Year Yield (%)'),
+        color=alt.Color('Region', legend=alt.Legend(orient='bottom'))
+    ))
+
+    st.markdown('##### Level, Slope and Curvature')
+    factors = pd.concat({region: curves.factors(get_fit(region)[0]) for region in regions},
+                        names=['Region']).loc[(slice(None), slice(min, max)), :]
+    st.altair_chart(alt.Chart(factors.reset_index().melt(id_vars=['Region', 'Date'], var_name='Factor', value_name='Value')).mark_line().encode(
+        x='Date',
+        y=alt.Y('Value', title='Yield (%)'),
+        color=alt.Color('Factor', legend=alt.Legend(orient='bottom'))
+    ).facet(column=alt.Column('Region:N', header=alt.Header(title=None))))
+
+with tab4:
+    window = st.select_slider('Rolling window (months)', options=[12, 24, 36, 60, 120], value=36)
+    components = 3
+
+    loadings, explained, rolling = [], [], []
+    for region in regions:
+        changes, maturities, moments = get_moments(region)
+        start, end = changes.searchsorted(min), changes.searchsorted(max, side='right')
+        if end - start < 2:
+            continue
+        share, vectors = curves.pca(curves.covariance(moments, start, end))
+        names = [f'PC {i + 1}' for i in range(components)]
+        loadings.append(pd.DataFrame(vectors[:, :components], index=pd.Index(maturities, name='Maturity'),
+                                     columns=names).reset_index().melt(id_vars='Maturity', var_name='Component',
+                                                                       value_name='Loading').assign(Region=region))
+        explained.append(pd.DataFrame({'Component': names, 'Share': share[:components], 'Region': region}))
+        rolling.append(get_rolling(region, window, components).loc[min:max].rename_axis('Date').reset_index().melt(
+            id_vars='Date', var_name='Component', value_name='Share').assign(Region=region))
+
+    if not loadings:
+        st.info('Select a wider date range')
+    else:
+        st.markdown('##### Loadings of Monthly Changes')
+        st.altair_chart(alt.Chart(pd.concat(loadings, ignore_index=True)).mark_line(point=True).encode(
+            x=alt.X('Maturity:Q', title='Maturity (Years)'),
+            y=alt.Y('Loading:Q'),
+            color=alt.Color('Component:N', legend=alt.Legend(orient='top'))
+        ).facet(column=alt.Column('Region:N', header=alt.Header(title=None))))
+
+        st.markdown('##### Explained Variance')
+        st.altair_chart(alt.Chart(pd.concat(explained, ignore_index=True)).mark_bar().encode(
+            x=alt.X('Component:N', title=None),
+            y=alt.Y('Share:Q', title='Share of Variance', axis=alt.Axis(format='%')),
+            color=alt.Color('Component:N', legend=None)
+        ).facet(column=alt.Column('Region:N', header=alt.Header(title=None))))
+
+        st.markdown(f'##### Rolling {window}-Month Explained Variance')
+        st.altair_chart(alt.Chart(pd.concat(rolling, ignore_index=True)).mark_line().encode(
+            x='Date',
+            y=alt.Y('Share:Q', title='Share of Variance', axis=alt.Axis(format='%')),
+            color=alt.Color('Component:N', legend=alt.Legend(orient='bottom'))
+        ).facet(column=alt.Column('Region:N', header=alt.Header(title=None))))
+
 with tab2:
-    policy = get_policy().ffill()
-
-    scale = alt.Scale(domain=[policy['rate'].min(), policy['rate'].max()])
-    line = alt.Chart(policy).mark_line().encode(
-        x=alt.Y('date:T', title='Date'),
-        y=alt.Y('rate:Q', title='Policy Rate',
-                axis=alt.Axis(format='%'), scale=scale),
-        color='country:N'
-    ).properties(title='Historical')
-
-    line_chart = line
-
-    idx = policy.groupby('iso')['date'].idxmax()
-    latest = policy.loc[idx].reset_index(drop=True)
-
-    bar_chart = alt.Chart(latest).mark_bar().encode(
-        x=alt.X('iso:N', title='Country', sort=alt.SortField(
-            'rate', order='ascending')),
-        y=alt.Y('rate:Q', title='Policy Rate',
-                axis=alt.Axis(format='%'), scale=scale),
-        color=alt.Color('country:N', title=None)
-    ).properties(title='Latest')
-
-    st.altair_chart(line_chart | bar_chart)
+    if policy is None:
+        st.warning('Unable to fetch the policy rates')
+    else:
+        policy = policy.ffill()
+
+        scale = alt.Scale(domain=[policy['rate'].min(), policy['rate'].max()])
+        line = alt.Chart(policy).mark_line().encode(
+            x=alt.Y('date:T', title='Date'),
+            y=alt.Y('rate:Q', title='Policy Rate',
+                    axis=alt.Axis(format='%'), scale=scale),
+            color='country:N'
+        ).properties(title='Historical')
+
+        line_chart = line
+
+        idx = policy.groupby('iso', observed=True)['date'].idxmax()
+        latest = policy.loc[idx].reset_index(drop=True)
+
+        bar_chart = alt.Chart(latest).mark_bar().encode(
+            x=alt.X('iso:N', title='Country', sort=alt.SortField(
+                'rate', order='ascending')),
+            y=alt.Y('rate:Q', title='Policy Rate',
+                    axis=alt.Axis(format='%'), scale=scale),
+            color=alt.Color('country:N', title=None)
+        ).properties(title='Latest')
+
+        st.altair_chart(line_chart | bar_chart)